@@ -1,11 +1,16 @@
-from typing import List
+import uuid
 
+from typing import Dict, List
+
+import storage_system
 from storage_system import StorageSystem
 import property_set
 import typing
 import utils
 
 METADATA_FILE_SUFFIX = ".meta"
+# suffix of the files that objects are written to before they're moved into place
+PUT_FILE_SUFFIX = ".put"
 
 
 class FSStorageSystem(StorageSystem):
@@ -14,6 +19,7 @@ class FSStorageSystem(StorageSystem):
         StorageSystem.__init__(self, "FS", debug_mode)
         self.root_dir = root_dir
         self.list_containers: List[str] = []
+        self.is_local = True
 
     def __enter__(self):
         if not utils.directory_exists(self.root_dir):
@@ -21,7 +27,7 @@ class FSStorageSystem(StorageSystem):
         return self
 
     def __exit__(self, exception_type, exception_value, traceback):
-        pass
+        self.shutdown_request_executor()
 
     def get_container_dir(self, container_name) -> str:
         return utils.path_join(self.root_dir, container_name)
@@ -45,10 +51,11 @@ class FSStorageSystem(StorageSystem):
                 print("container deleted: '%s'" % container_name)
         return container_deleted
 
-    def list_container_contents(self, container_name: str) -> typing.Optional[List[str]]:
+    def iter_container_contents(self, container_name: str, prefix: str = ""):
         container_dir = self.get_container_dir(container_name)
         if utils.directory_exists(container_dir):
-            return utils.list_files_in_directory(container_dir)
+            return (file_name for file_name in utils.list_files_in_directory(container_dir)
+                    if file_name.startswith(prefix) and not file_name.endswith(PUT_FILE_SUFFIX))
         else:
             return None
 
@@ -73,6 +80,21 @@ class FSStorageSystem(StorageSystem):
 
         return None
 
+    def head_object(self, container_name: str, object_name: str) -> typing.Optional[Dict[str, object]]:
+        if container_name is not None and \
+                object_name is not None and \
+                len(container_name) > 0 and \
+                len(object_name) > 0:
+
+            object_path = utils.path_join(self.get_container_dir(container_name), object_name)
+            if utils.file_exists(object_path):
+                file_size = utils.get_file_size(object_path)
+                file_mtime = utils.path_get_mtime(object_path)
+                return {storage_system.OBJECT_ETAG: "%s-%s" % (repr(file_mtime), file_size),
+                        storage_system.OBJECT_LAST_MODIFIED: repr(file_mtime),
+                        storage_system.OBJECT_SIZE: file_size}
+        return None
+
     def put_object(self, container_name: str, object_name: str, file_contents: str,
                    headers: property_set.PropertySet = None) -> bool:
         object_added = False
@@ -86,7 +108,12 @@ class FSStorageSystem(StorageSystem):
             container_dir = self.get_container_dir(container_name)
             if utils.directory_exists(container_dir):
                 object_path = utils.path_join(container_dir, object_name)
-                object_added = utils.file_write_all_bytes(object_path, file_contents)
+                # replace rather than overwrite the file, since it may be hard
+                # linked into a play list directory. until the new contents
+                # are completely written, the old object stays in place
+                put_path = self.put_file_path(object_path)
+                object_added = utils.file_write_all_bytes(put_path, file_contents) and \
+                    utils.replace_file(put_path, object_path)
                 if object_added:
                     if self.debug_mode:
                         print("object added: %s/%s", container_name, object_name)
@@ -94,7 +121,8 @@ class FSStorageSystem(StorageSystem):
                         meta_path = object_path + METADATA_FILE_SUFFIX
                         headers.write_to_file(meta_path)
                 else:
-                    print("file_write_all_bytes failed to write object contents, put failed")
+                    utils.delete_file(put_path)
+                    print("failed to write object contents, put failed")
             else:
                 print("container doesn't exist, can't put object")
         else:
@@ -107,8 +135,54 @@ class FSStorageSystem(StorageSystem):
                     else:
                         if len(file_contents) == 0:
                             print("object content is empty, can't put object")
+        if object_added:
+            self.invalidate_container_listing(container_name)
         return object_added
 
+    def put_object_stream(self, container_name: str, object_name: str, stream, content_length: int,
+                          headers: property_set.PropertySet = None) -> bool:
+        object_added = False
+        if container_name is not None and \
+                object_name is not None and \
+                stream is not None and \
+                len(container_name) > 0 and \
+                len(object_name) > 0 and \
+                content_length > 0:
+
+            container_dir = self.get_container_dir(container_name)
+            if utils.directory_exists(container_dir):
+                object_path = utils.path_join(container_dir, object_name)
+                put_path = self.put_file_path(object_path)
+                bytes_written = utils.file_write_from_stream(put_path, stream)
+                if bytes_written == content_length:
+                    object_added = utils.replace_file(put_path, object_path)
+                if not object_added:
+                    utils.delete_file(put_path)
+                if bytes_written != content_length:
+                    print("stream length did not match content length, put failed")
+                elif not object_added:
+                    print("unable to move object into place, put failed")
+                else:
+                    if self.debug_mode:
+                        print("object added: %s/%s" % (container_name, object_name))
+                    if headers is not None:
+                        meta_path = object_path + METADATA_FILE_SUFFIX
+                        headers.write_to_file(meta_path)
+            else:
+                print("container doesn't exist, can't put object")
+        else:
+            if self.debug_mode:
+                print("container name, object name or content is missing, can't put object")
+        if object_added:
+            self.invalidate_container_listing(container_name)
+        return object_added
+
+    def put_file_path(self, object_path: str) -> str:
+        # a file next to the object that new contents are written to before
+        # it replaces the object. the name is unique so that concurrent puts
+        # of the same object don't write to the same file
+        return "%s.%s%s" % (object_path, uuid.uuid4().hex, PUT_FILE_SUFFIX)
+
     def delete_object(self, container_name: str, object_name: str) -> bool:
         object_deleted = False
         if container_name is not None and object_name is not None:
@@ -126,11 +200,15 @@ class FSStorageSystem(StorageSystem):
                     if self.debug_mode:
                         print("delete of object file failed")
             else:
+                # an object that's already gone counts as deleted
                 if self.debug_mode:
-                    print("cannot delete object, path doesn't exist")
+                    print("object doesn't exist: %s/%s" % (container_name, object_name))
+                object_deleted = True
         else:
             if self.debug_mode:
                 print("cannot delete object, container name or object name is missing")
+        if object_deleted:
+            self.invalidate_container_listing(container_name)
         return object_deleted
 
     def get_object(self, container_name: str, object_name: str, local_file_path: str) -> int:
@@ -145,17 +223,48 @@ class FSStorageSystem(StorageSystem):
             container_dir = self.get_container_dir(container_name)
             object_path = utils.path_join(container_dir, object_name)
             if utils.file_exists(object_path):
-                obj_file_contents = utils.file_read_all_bytes(object_path)
-                if obj_file_contents is not None:
-                    if self.debug_mode:
-                        print("attempting to write object to '%s'" % local_file_path)
-                    if utils.file_write_all_bytes(local_file_path, obj_file_contents):
-                        bytes_retrieved = len(obj_file_contents)
+                if self.debug_mode:
+                    print("attempting to write object to '%s'" % local_file_path)
+                # the copy is private to the caller (e.g., the metadata db is
+                # modified after it's retrieved), so it can't be a hard link
+                if utils.copy_file(object_path, local_file_path):
+                    bytes_retrieved = utils.get_file_size(local_file_path)
                 else:
-                    print("error: unable to read object file '%s'" % object_path)
+                    print("error: unable to copy object file '%s'" % object_path)
             else:
                 print("error: object path does not exist, cannot retrieve object")
         else:
             print("error: missing container, object, or local file path")
 
         return bytes_retrieved
+
+    def get_object_chunks(self, container_name: str, object_name: str,
+                          chunk_size: int = storage_system.DOWNLOAD_CHUNK_SIZE,
+                          offset: int = 0,
+                          length: typing.Optional[int] = None):
+        if container_name is not None and \
+                object_name is not None and \
+                len(container_name) > 0 and \
+                len(object_name) > 0:
+
+            object_path = utils.path_join(self.get_container_dir(container_name), object_name)
+            if utils.file_exists(object_path):
+                return utils.file_iter_chunks(object_path, chunk_size, offset, length)
+            else:
+                print("error: object path does not exist, cannot retrieve object")
+        else:
+            print("error: missing container or object")
+
+        return None
+
+    def local_object_path(self, container_name: str, object_name: str) -> typing.Optional[str]:
+        if container_name is not None and \
+                object_name is not None and \
+                len(container_name) > 0 and \
+                len(object_name) > 0:
+
+            object_path = utils.path_join(self.get_container_dir(container_name), object_name)
+            if utils.file_exists(object_path):
+                return object_path
+
+        return None
@@ -0,0 +1,35 @@
+import hashlib
+
+
+# read-only file wrapper that computes the md5 hash of the bytes as they
+# are read, so a file can be hashed and uploaded in a single pass. seeking
+# isn't supported (re-reading would corrupt the hash), which also tells the
+# storage clients not to rewind and retry with it.
+class HashingReader(object):
+
+    def __init__(self, file_obj):
+        self.file_obj = file_obj
+        self.md5 = hashlib.md5()
+        self.bytes_read = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.file_obj.read(size)
+        if data:
+            self.md5.update(data)
+            self.bytes_read += len(data)
+        return data
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return False
+
+    def tell(self) -> int:
+        return self.bytes_read
+
+    def close(self):
+        self.file_obj.close()
+
+    def hexdigest(self) -> str:
+        return self.md5.hexdigest()
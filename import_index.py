@@ -0,0 +1,66 @@
+import json
+import logging
+import typing
+
+from typing import Dict
+
+import utils
+
+INDEX_FILE_SIZE = "size"
+INDEX_FILE_MTIME = "mtime"
+INDEX_MD5_HASH = "md5_hash"
+
+
+# local record of song files that have already been imported. entries are
+# keyed by file name and remember the size and modification time seen when
+# the file was hashed, so unchanged files can be skipped on later imports
+# without being read again.
+class ImportIndex(object):
+
+    def __init__(self, index_file_path: str):
+        self.index_file_path = index_file_path
+        self.entries: Dict[str, Dict[str, object]] = {}
+        self.is_dirty = False
+
+    def load(self) -> bool:
+        self.entries = {}
+        self.is_dirty = False
+        if not utils.file_exists(self.index_file_path):
+            return False
+        file_contents = utils.file_read_all_text(self.index_file_path)
+        if file_contents is None:
+            logging.error("unable to read import index %s" % self.index_file_path)
+            return False
+        try:
+            entries = json.loads(file_contents)
+        except ValueError:
+            logging.error("import index %s is corrupt, ignoring it" % self.index_file_path)
+            return False
+        if isinstance(entries, dict):
+            self.entries = entries
+            return True
+        return False
+
+    def save(self) -> bool:
+        if not self.is_dirty:
+            return True
+        if utils.file_write_all_text(self.index_file_path, json.dumps(self.entries)):
+            self.is_dirty = False
+            return True
+        logging.error("unable to write import index %s" % self.index_file_path)
+        return False
+
+    def lookup(self, file_name: str, file_size: int, file_mtime: float) -> typing.Optional[str]:
+        # returns the md5 hash recorded for the file if it hasn't changed
+        entry = self.entries.get(file_name)
+        if entry is not None and \
+                entry.get(INDEX_FILE_SIZE) == file_size and \
+                entry.get(INDEX_FILE_MTIME) == file_mtime:
+            return entry.get(INDEX_MD5_HASH)
+        return None
+
+    def update(self, file_name: str, file_size: int, file_mtime: float, md5_hash: str):
+        self.entries[file_name] = {INDEX_FILE_SIZE: file_size,
+                                   INDEX_FILE_MTIME: file_mtime,
+                                   INDEX_MD5_HASH: md5_hash}
+        self.is_dirty = True
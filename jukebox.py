@@ -41,40 +41,65 @@
 #
 # ******************************************************************************
 
+import concurrent.futures
 import datetime
 import logging
 
-from typing import List, Tuple
+from typing import Dict, List, Tuple
 
 import sys
+import threading
 import time
 import random
-from subprocess import Popen
+from subprocess import Popen, PIPE
 import jukebox_db
 import file_metadata
+import hashing_reader
+import import_index
 import song_metadata
+import snapshot_codec
+import song_cache
+import object_cache
 import song_downloader
+import song_streamer
 import storage_system
 import utils
 import json
 import typing
+import uuid
 import jb_utils
 
 if utils.os_is_posix():
     import signal
 
 DOWNLOAD_EXTENSION = ".download"
+DOWNLOAD_INFO_SUFFIX = ".info"
 ALBUM_CONTAINER = "albums"
 ALBUM_ART_CONTAINER = "album-art"
 METADATA_CONTAINER = "music-metadata"
 PLAYLIST_CONTAINER = "playlists"
 SONG_CONTAINER_SUFFIX = "-artist-songs"
 ALBUM_ART_IMPORT_DIR = "album-art-import"
+ALBUM_IMPORT_DIR = "album-import"
 PLAYLIST_IMPORT_DIR = "playlist-import"
 SONG_IMPORT_DIR = "song-import"
 SONG_PLAY_DIR = "song-play"
+SONG_CACHE_DIR = "song-cache"
+OBJECT_CACHE_DIR = "object-cache"
 DEFAULT_DB_FILE_NAME = "jukebox_db.sqlite3"
+METADATA_DB_STAT_SUFFIX = ".stat"
+METADATA_DELTA_INFIX = ".delta."
+METADATA_DELTA_COMPACT_THRESHOLD = 50
 JUKEBOX_PID_FILE_NAME = "jukebox.pid"
+IMPORT_INDEX_FILE_NAME = "import_index.json"
+METADATA_BATCH_SIZE = 500
+# nominal bitrates used to estimate how long a song file plays for
+NOMINAL_BITRATE_KBPS = {".flac": 1000, ".m4a": 256, ".mp3": 256}
+DEFAULT_BITRATE_KBPS = 256
+# weight of the latest download in the moving average of download throughput
+DOWNLOAD_THROUGHPUT_WEIGHT = 0.3
+# audio players that can play from standard input, with the arguments for it
+STREAMING_AUDIO_PLAYER_ARGS = {"mplayer": ["-"]}
 
 g_jukebox_instance: typing.Optional['Jukebox'] = None
 
@@ -107,9 +132,16 @@ class Jukebox:
         self.song_import_dir = utils.path_join(self.current_dir, SONG_IMPORT_DIR)
         self.playlist_import_dir = utils.path_join(self.current_dir, PLAYLIST_IMPORT_DIR)
         self.song_play_dir = utils.path_join(self.current_dir, SONG_PLAY_DIR)
+        self.song_cache_dir = utils.path_join(self.current_dir, SONG_CACHE_DIR)
+        self.song_cache: typing.Optional[song_cache.SongCache] = None
+        self.object_cache_dir = utils.path_join(self.current_dir, OBJECT_CACHE_DIR)
+        self.object_cache: typing.Optional[object_cache.ObjectCache] = None
         self.album_art_import_dir = utils.path_join(self.current_dir, ALBUM_ART_IMPORT_DIR)
+        self.album_import_dir = utils.path_join(self.current_dir, ALBUM_IMPORT_DIR)
+        self.import_index_file = utils.path_join(self.current_dir, IMPORT_INDEX_FILE_NAME)
         self.download_extension = DOWNLOAD_EXTENSION
         self.metadata_db_file = DEFAULT_DB_FILE_NAME
+        self.metadata_db_object_stat: typing.Optional[dict] = None
         self.metadata_container = self.container_prefix + METADATA_CONTAINER
         self.playlist_container = self.container_prefix + PLAYLIST_CONTAINER
         self.album_container = self.container_prefix + ALBUM_CONTAINER
@@ -119,9 +151,15 @@ class Jukebox:
         self.song_index = -1
         self.audio_player_command_args = []
         self.audio_player_popen = None
+        # set when the player is stopped to pause or skip the song, as
+        # opposed to exiting on its own
+        self.audio_player_stopped = False
         self.song_play_length_seconds = 20
         self.cumulative_download_bytes = 0
         self.cumulative_download_time = 0
+        self.download_throughput = 0.0
+        self.download_stats_lock = threading.Lock()
+        self.song_downloader: typing.Optional[song_downloader.SongDownloader] = None
         self.exit_requested = False
         self.is_paused = False
         self.song_start_time = 0
@@ -137,28 +175,47 @@ class Jukebox:
 
     def __enter__(self):
         # look for stored metadata in the storage system
+        db_object_stat = None
         if self.storage_system is not None and \
                 self.storage_system.has_container(self.metadata_container) and \
                 not self.jukebox_options.suppress_metadata_download:
 
-            # metadata container exists, retrieve container listing
-            container_contents = self.storage_system.list_container_contents(self.metadata_container)
-
             # does our metadata DB file exist in the metadata container?
-            if container_contents is not None and self.metadata_db_file in container_contents:
-                # download it
+            db_object_stat = self.storage_system.head_object(self.metadata_container, self.metadata_db_file)
+            if db_object_stat is not None:
                 metadata_db_file_path = self.get_metadata_db_file_path()
-                download_file = metadata_db_file_path + ".download"
-                if self.storage_system.get_object(self.metadata_container, self.metadata_db_file, download_file) > 0:
-                    # have an existing metadata DB file?
-                    if utils.file_exists(metadata_db_file_path):
-                        logging.debug("deleting existing metadata DB file")
-                        utils.delete_file(metadata_db_file_path)
-                    # rename downloaded file
-                    logging.debug("renaming '%s' to '%s'" % (download_file, metadata_db_file_path))
-                    utils.rename_file(download_file, metadata_db_file_path)
+                if self.metadata_db_is_current(db_object_stat):
+                    logging.debug("local metadata DB file is current, skipping download")
                 else:
-                    logging.error("unable to retrieve metadata DB file")
+                    # download it
+                    download_file = metadata_db_file_path + ".download"
+                    if self.storage_system.get_object(self.metadata_container, self.metadata_db_file, download_file) > 0:
+                        # the existing metadata DB file is only replaced once
+                        # the new one is complete. if the download can't be
+                        # decoded, the old file is kept and no stat is saved
+                        # so that the next run downloads it again
+                        if snapshot_codec.detect_codec(download_file) != snapshot_codec.CODEC_NONE:
+                            # compressed snapshot, decode it next to the DB file
+                            decoded_file = metadata_db_file_path + ".decoded"
+                            logging.debug("decompressing '%s' to '%s'" % (download_file, decoded_file))
+                            if snapshot_codec.decompress_file(download_file, decoded_file) and \
+                                    utils.replace_file(decoded_file, metadata_db_file_path):
+                                logging.debug("replaced metadata DB file with decoded snapshot")
+                            else:
+                                logging.error("unable to decompress metadata DB file, keeping existing one")
+                                utils.delete_file(decoded_file)
+                                db_object_stat = None
+                            utils.delete_file(download_file)
+                        else:
+                            # replace the existing file with the downloaded one
+                            logging.debug("replacing '%s' with '%s'" % (metadata_db_file_path, download_file))
+                            if not utils.replace_file(download_file, metadata_db_file_path):
+                                logging.error("unable to replace metadata DB file")
+                                utils.delete_file(download_file)
+                                db_object_stat = None
+                    else:
+                        logging.error("unable to retrieve metadata DB file")
+                        db_object_stat = None
             else:
                 logging.error("no metadata DB file in metadata container")
         else:
@@ -167,9 +224,27 @@ class Jukebox:
         self.jukebox_db = jukebox_db.JukeboxDB(self.get_metadata_db_file_path())
         if not self.jukebox_db.open():
             logging.error("unable to connect to database")
+        else:
+            if self.metadata_deltas_enabled():
+                self.apply_metadata_deltas()
+                self.jukebox_db.start_change_log()
+            if db_object_stat is not None:
+                # recorded after opening so that any schema migration or
+                # deltas applied to the downloaded file are part of the local
+                # state
+                self.save_metadata_db_stat(db_object_stat)
         return self
 
     def __exit__(self, exception_type, exception_value, traceback):
+        if self.debug_print and self.storage_system is not None:
+            print("storage request counters: %s" % repr(self.storage_system.retry_policy.get_counters()))
+        if self.song_cache is not None:
+            # persist access times and hit counts for the cache policy
+            self.song_cache.save()
+            self.song_cache = None
+        if self.object_cache is not None:
+            self.object_cache.save()
+            self.object_cache = None
         if self.jukebox_db is not None:
             if self.jukebox_db.is_open():
                 self.jukebox_db.close()
@@ -181,6 +256,7 @@ class Jukebox:
             print("paused")
             if self.audio_player_popen is not None:
                 # capture current song position (seconds into song)
+                self.audio_player_stopped = True
                 self.audio_player_popen.terminate()
         else:
             print("resuming play")
@@ -188,11 +264,48 @@ class Jukebox:
     def advance_to_next_song(self):
         print("advancing to next song")
         if self.audio_player_popen is not None:
+            self.audio_player_stopped = True
             self.audio_player_popen.terminate()
 
     def get_metadata_db_file_path(self) -> str:
         return utils.path_join(self.current_dir, self.metadata_db_file)
 
+    def get_metadata_db_stat_file_path(self) -> str:
+        return self.get_metadata_db_file_path() + METADATA_DB_STAT_SUFFIX
+
+    def local_metadata_db_stat(self) -> typing.Optional[dict]:
+        metadata_db_file_path = self.get_metadata_db_file_path()
+        if utils.file_exists(metadata_db_file_path):
+            return {"size": utils.get_file_size(metadata_db_file_path),
+                    "mtime": utils.path_get_mtime(metadata_db_file_path)}
+        return None
+
+    def metadata_db_is_current(self, db_object_stat: dict) -> bool:
+        # the local metadata DB file is current if the stored object hasn't
+        # changed since it was downloaded (or uploaded) and the local file
+        # hasn't been modified since then
+        local_stat = self.local_metadata_db_stat()
+        if local_stat is None:
+            return False
+        file_contents = utils.file_read_all_text(self.get_metadata_db_stat_file_path())
+        if file_contents is None:
+            return False
+        try:
+            saved_stat = json.loads(file_contents)
+        except ValueError:
+            return False
+        return saved_stat.get("remote") == db_object_stat and saved_stat.get("local") == local_stat
+
+    def save_metadata_db_stat(self, db_object_stat: typing.Optional[dict]):
+        self.metadata_db_object_stat = db_object_stat
+        stat_file_path = self.get_metadata_db_stat_file_path()
+        local_stat = self.local_metadata_db_stat()
+        if db_object_stat is not None and local_stat is not None:
+            utils.file_write_all_text(stat_file_path, json.dumps({"remote": db_object_stat,
+                                                                  "local": local_stat}))
+        else:
+            utils.delete_file(stat_file_path)
+
     def components_from_file_name(self, file_name: str):  # -> typing.Optional[List[str, str, str]]:
         if len(file_name) == 0:
             return None
@@ -231,15 +344,7 @@ class Jukebox:
         return None
 
     def store_song_metadata(self, fs_song: song_metadata.SongMetadata) -> bool:
-        db_song = self.jukebox_db.retrieve_song(fs_song.fm.file_uid)
-        if db_song is not None:
-            if fs_song != db_song:
-                return self.jukebox_db.update_song(fs_song)
-            else:
-                return True  # no insert or update needed (already up-to-date)
-        else:
-            # song is not in the database, insert it
-            return self.jukebox_db.insert_song(fs_song)
+        return self.jukebox_db.store_song_metadata(fs_song)
 
     def store_song_playlist(self, file_name: str, file_contents: str) -> bool:
         pl = json.loads(file_contents)
@@ -264,6 +369,69 @@ class Jukebox:
 
         return self.container_prefix + artist_letter.lower() + SONG_CONTAINER_SUFFIX
 
+    def song_metadata_for_import(self, file_name: str, full_path: str) -> typing.Optional[song_metadata.SongMetadata]:
+        extension = utils.path_split_ext(full_path)[1]
+        if extension:
+            file_size = utils.get_file_size(full_path)
+            artist = self.artist_from_file_name(file_name)
+            album = self.album_from_file_name(file_name)
+            song = self.song_from_file_name(file_name)
+            if file_size > 0 and artist is not None and album is not None and song is not None:
+                object_name = file_name
+                fs_song = song_metadata.SongMetadata()
+                fs_song.fm = file_metadata.FileMetadata()
+                fs_song.fm.file_uid = object_name
+                fs_song.artist_uid = jb_utils.encode_value(artist)
+                fs_song.album_uid = jb_utils.encode_artist_album(artist, album)
+                fs_song.fm.origin_file_size = file_size
+                fs_song.fm.file_time = datetime.datetime.fromtimestamp(utils.path_get_mtime(full_path))
+                fs_song.artist_name = artist
+                fs_song.song_name = song
+                fs_song.fm.compressed = 0
+                fs_song.fm.encrypted = 0
+                fs_song.fm.object_name = object_name
+                fs_song.fm.pad_char_count = 0
+                fs_song.fm.container_name = self.container_for_song(file_name)
+                return fs_song
+        return None
+
+    def upload_song_file(self, fs_song: song_metadata.SongMetadata, full_path: str) -> Tuple[bool, float, float]:
+        # runs on an import worker thread. reads a single song file once,
+        # hashing it while it's streamed to the storage system, and returns
+        # whether it was uploaded along with the start and end times of the
+        # upload.
+        fs_song.fm.stored_file_size = fs_song.fm.origin_file_size
+
+        try:
+            with open(full_path, 'rb') as content_file:
+                song_reader = hashing_reader.HashingReader(content_file)
+                start_upload_time = time.time()
+
+                # store song file to storage system
+                uploaded = self.storage_system.put_object_stream(fs_song.fm.container_name,
+                                                                 fs_song.fm.object_name,
+                                                                 song_reader,
+                                                                 fs_song.fm.stored_file_size)
+                end_upload_time = time.time()
+        except IOError:
+            logging.error("unable to read file %s" % full_path)
+            return False, 0.0, 0.0
+
+        if uploaded:
+            if song_reader.bytes_read == fs_song.fm.stored_file_size:
+                fs_song.fm.md5_hash = song_reader.hexdigest()
+                return True, start_upload_time, end_upload_time
+            else:
+                # the file changed while it was being uploaded
+                logging.error("size of '%s' changed during upload" % full_path)
+                self.storage_system.delete_object(fs_song.fm.container_name,
+                                                  fs_song.fm.object_name)
+        else:
+            logging.error("unable to upload '%s' to '%s'" % (fs_song.fm.object_name,
+                                                             fs_song.fm.container_name))
+
+        return False, 0.0, 0.0
+
     def import_songs(self):
         if self.jukebox_db is not None and self.jukebox_db.is_open():
             if not utils.directory_exists(self.song_import_dir):
@@ -290,82 +458,8 @@ class Jukebox:
                 sys.stdout.flush()
                 sys.stdout.write("\b" * (progressbar_width + 1))  # return to start of line, after '['
 
-            cumulative_upload_time = 0
-            cumulative_upload_bytes = 0
-            file_import_count = 0
-
-            for listing_entry in dir_listing:
-                full_path = utils.path_join(self.song_import_dir, listing_entry)
-                # ignore it if it's not a file
-                if utils.path_is_file(full_path):
-                    file_name = listing_entry
-                    extension = utils.path_split_ext(full_path)[1]
-                    if extension:
-                        file_size = utils.get_file_size(full_path)
-                        artist = self.artist_from_file_name(file_name)
-                        album = self.album_from_file_name(file_name)
-                        song = self.song_from_file_name(file_name)
-                        if file_size > 0 and artist is not None and album is not None and song is not None:
-                            object_name = file_name
-                            fs_song = song_metadata.SongMetadata()
-                            fs_song.fm = file_metadata.FileMetadata()
-                            fs_song.fm.file_uid = object_name
-                            fs_song.album_uid = None
-                            fs_song.fm.origin_file_size = file_size
-                            fs_song.fm.file_time = datetime.datetime.fromtimestamp(utils.path_get_mtime(full_path))
-                            fs_song.artist_name = artist
-                            fs_song.song_name = song
-                            fs_song.fm.md5_hash = utils.md5_for_file(full_path)
-                            fs_song.fm.compressed = 0
-                            fs_song.fm.encrypted = 0
-                            fs_song.fm.object_name = object_name
-                            fs_song.fm.pad_char_count = 0
-
-                            fs_song.fm.container_name = self.container_for_song(file_name)
-
-                            # read file contents
-                            file_read = False
-                            file_contents = None
-
-                            try:
-                                with open(full_path, 'rb') as content_file:
-                                    file_contents = content_file.read()
-                                file_read = True
-                            except IOError:
-                                logging.error("unable to read file %s" % full_path)
-
-                            if file_read and file_contents is not None:
-                                # now that we have the data that will be stored, set the file size for
-                                # what's being stored
-                                fs_song.fm.stored_file_size = len(file_contents)
-                                start_upload_time = time.time()
-
-                                # store song file to storage system
-                                if self.storage_system.put_object(fs_song.fm.container_name,
-                                                                  fs_song.fm.object_name,
-                                                                  file_contents):
-                                    end_upload_time = time.time()
-                                    upload_elapsed_time = end_upload_time - start_upload_time
-                                    cumulative_upload_time += upload_elapsed_time
-                                    cumulative_upload_bytes += len(file_contents)
-
-                                    # store song metadata in local database
-                                    if not self.store_song_metadata(fs_song):
-                                        # we stored the song to the storage system, but were unable to store
-                                        # the metadata in the local database. we need to delete the song
-                                        # from the storage system since we won't have any way to access it
-                                        # since we can't store the song metadata locally.
-                                        logging.error(
-                                            "unable to store metadata, deleting obj '%s'" % fs_song.fm.object_name)
-
-                                        self.storage_system.delete_object(fs_song.fm.container_name,
-                                                                          fs_song.fm.object_name)
-                                    else:
-                                        file_import_count += 1
-                                else:
-                                    logging.error("unable to upload '%s' to '%s'" % (fs_song.fm.object_name,
-                                                                                     fs_song.fm.container_name))
-
+            def advance_progressbar():
+                nonlocal progressbar_chars, bar_chars
                 if not self.debug_print:
                     progressbar_chars += progress_chars_per_iteration
                     if int(progressbar_chars) > bar_chars:
@@ -377,6 +471,110 @@ class Jukebox:
                             sys.stdout.flush()
                             bar_chars += num_new_chars
 
+            import_workers = 1
+            if self.jukebox_options is not None:
+                import_workers = self.jukebox_options.import_workers
+            if not self.storage_system.thread_safe:
+                import_workers = 1
+
+            # files whose size and modification time match the import index, and
+            # whose recorded hash is already in the catalog, are skipped without
+            # being read, hashed or uploaded. a full import re-uploads every
+            # file, but the index is still loaded so that saving it at the end
+            # keeps the entries of files that weren't part of this import
+            song_import_index = import_index.ImportIndex(self.import_index_file)
+            song_import_index.load()
+            incremental_import = self.jukebox_options is None or self.jukebox_options.incremental_import
+            # also tells which uploads replaced songs already in the catalog
+            catalog_hashes = self.jukebox_db.retrieve_song_md5_hashes()
+
+            upload_intervals = []
+            cumulative_upload_bytes = 0
+            file_import_count = 0
+            file_skip_count = 0
+
+            # metadata for uploaded songs is written in batches, each batch in
+            # a single transaction
+            pending_songs = []
+
+            def store_pending_songs():
+                nonlocal file_import_count
+                if not pending_songs:
+                    return
+                if self.jukebox_db.upsert_songs([song for song, _ in pending_songs]):
+                    stored_songs = list(pending_songs)
+                else:
+                    # one bad song fails the whole batch, so store the songs
+                    # one at a time to find the ones that can't be stored
+                    stored_songs = []
+                    unstored_songs = []
+                    for song, song_mtime in pending_songs:
+                        if self.jukebox_db.upsert_songs([song]):
+                            stored_songs.append((song, song_mtime))
+                        else:
+                            unstored_songs.append(song)
+
+                    # we stored these songs to the storage system, but were unable to store
+                    # the metadata in the local database. new songs are deleted from the
+                    # storage system since we won't have any way to access them. songs
+                    # that were already in the catalog are kept, since the catalog still
+                    # refers to their objects.
+                    new_songs = []
+                    for song in unstored_songs:
+                        if song.fm.file_uid in catalog_hashes:
+                            logging.error("unable to store metadata of re-uploaded '%s'" % song.fm.object_name)
+                        else:
+                            logging.error("unable to store metadata, deleting obj '%s'" % song.fm.object_name)
+                            new_songs.append(song)
+                    self.delete_song_objects(new_songs)
+
+                for song, song_mtime in stored_songs:
+                    file_import_count += 1
+                    catalog_hashes[song.fm.file_uid] = song.fm.md5_hash
+                    song_import_index.update(song.fm.file_uid,
+                                             song.fm.origin_file_size,
+                                             song_mtime,
+                                             song.fm.md5_hash)
+                pending_songs.clear()
+
+            # hashing, reading and uploading happen on the worker threads. the
+            # metadata database is only touched from this thread.
+            with concurrent.futures.ThreadPoolExecutor(max_workers=import_workers) as executor:
+                pending_uploads = {}
+                for listing_entry in dir_listing:
+                    full_path = utils.path_join(self.song_import_dir, listing_entry)
+                    fs_song = None
+                    # ignore it if it's not a file
+                    if utils.path_is_file(full_path):
+                        indexed_md5 = None
+                        if incremental_import:
+                            indexed_md5 = song_import_index.lookup(listing_entry,
+                                                                   utils.get_file_size(full_path),
+                                                                   utils.path_get_mtime(full_path))
+                        if indexed_md5 is not None and catalog_hashes.get(listing_entry) == indexed_md5:
+                            file_skip_count += 1
+                            advance_progressbar()
+                            continue
+                        fs_song = self.song_metadata_for_import(listing_entry, full_path)
+                    if fs_song is not None:
+                        upload_future = executor.submit(self.upload_song_file, fs_song, full_path)
+                        pending_uploads[upload_future] = (fs_song, utils.path_get_mtime(full_path))
+                    else:
+                        advance_progressbar()
+
+                for upload_future in concurrent.futures.as_completed(pending_uploads):
+                    fs_song, file_mtime = pending_uploads[upload_future]
+                    uploaded, start_upload_time, end_upload_time = upload_future.result()
+                    if uploaded:
+                        upload_intervals.append((start_upload_time, end_upload_time))
+                        cumulative_upload_bytes += fs_song.fm.stored_file_size
+                        pending_songs.append((fs_song, file_mtime))
+                        if len(pending_songs) >= METADATA_BATCH_SIZE:
+                            store_pending_songs()
+                    advance_progressbar()
+
+            store_pending_songs()
+
             if not self.debug_print:
                 # if we haven't filled up the progress bar, fill it now
                 if bar_chars < progressbar_width:
@@ -387,10 +585,17 @@ class Jukebox:
                 sys.stdout.write("\n")
 
             if file_import_count > 0:
-                self.upload_metadata_db()
+                self.publish_metadata_changes()
+
+            song_import_index.save()
 
             print("%s song files imported" % file_import_count)
+            if file_skip_count > 0:
+                print("%s unchanged song files skipped" % file_skip_count)
 
+            # uploads overlap when running with multiple workers, so use the
+            # wall-clock time that uploads were in progress rather than the sum
+            cumulative_upload_time = utils.elapsed_time_of_intervals(upload_intervals)
             if cumulative_upload_time > 0:
                 cumulative_upload_kb = cumulative_upload_bytes / 1000.0
                 print("average upload throughput = %s KB/sec" % (int(cumulative_upload_kb / cumulative_upload_time)))
@@ -398,6 +603,130 @@ class Jukebox:
     def song_path_in_playlist(self, song: song_metadata.SongMetadata) -> str:
         return utils.path_join(self.song_play_dir, song.fm.file_uid)
 
+    def partial_download_path(self, song: song_metadata.SongMetadata) -> str:
+        return self.song_path_in_playlist(song) + self.download_extension
+
+    def partial_download_info(self, song: song_metadata.SongMetadata) -> Dict[str, object]:
+        return {"object": "%s/%s" % (song.fm.container_name, song.fm.object_name),
+                "size": song.fm.stored_file_size,
+                "md5": song.fm.md5_hash}
+
+    def start_partial_download(self, song: song_metadata.SongMetadata) -> int:
+        # songs are downloaded into a .download file next to a .info file
+        # that identifies the object. if an earlier download of the same
+        # object was interrupted, returns the number of bytes it already
+        # wrote so that the download can resume from there. otherwise any
+        # partial file is discarded and 0 is returned.
+        download_path = self.partial_download_path(song)
+        info_path = download_path + DOWNLOAD_INFO_SUFFIX
+        download_info = self.partial_download_info(song)
+        if utils.file_exists(download_path) and utils.file_exists(info_path):
+            file_contents = utils.file_read_all_text(info_path)
+            try:
+                if file_contents is not None and json.loads(file_contents) == download_info:
+                    bytes_downloaded = utils.get_file_size(download_path)
+                    if bytes_downloaded <= song.fm.stored_file_size:
+                        return bytes_downloaded
+            except ValueError:
+                pass
+        utils.delete_file(download_path)
+        utils.file_write_all_text(info_path, json.dumps(download_info))
+        return 0
+
+    def finish_partial_download(self, song: song_metadata.SongMetadata) -> bool:
+        # moves a completed download into place
+        download_path = self.partial_download_path(song)
+        if utils.rename_file(download_path, self.song_path_in_playlist(song)):
+            utils.delete_file(download_path + DOWNLOAD_INFO_SUFFIX)
+            return True
+        return False
+
+    def discard_partial_download(self, song: song_metadata.SongMetadata):
+        download_path = self.partial_download_path(song)
+        utils.delete_file(download_path)
+        utils.delete_file(download_path + DOWNLOAD_INFO_SUFFIX)
+
+    def get_song_chunks(self, song: song_metadata.SongMetadata, offset: int,
+                        hedge_event: typing.Optional[threading.Event]):
+        # a song that playback is waiting for is read with a hedged request,
+        # so that one slow response doesn't stall playback. the hedge is sent
+        # once hedge_event is set, which can happen after the read started
+        hedge_after_ms = self.jukebox_options.hedge_after_ms if self.jukebox_options is not None else 0
+        if hedge_event is not None and hedge_after_ms > 0:
+            return self.storage_system.get_object_chunks_hedged(song.fm.container_name,
+                                                                song.fm.object_name,
+                                                                hedge_after_ms / 1000.0,
+                                                                offset=offset,
+                                                                hedge_event=hedge_event)
+        return self.storage_system.get_object_chunks(song.fm.container_name, song.fm.object_name,
+                                                     offset=offset)
+
+    def download_song_file(self, song: song_metadata.SongMetadata) -> Tuple[int, int]:
+        # downloads the song into the play list directory, resuming an
+        # interrupted download with a ranged read. returns the size of the
+        # song file (0 if it wasn't completely downloaded) and the number of
+        # bytes transferred.
+        object_path = self.storage_system.local_object_path(song.fm.container_name, song.fm.object_name)
+        if object_path is not None:
+            # the song is already a local file. link it (or clone or copy it)
+            # into the play list directory so the player reads from the store
+            self.discard_partial_download(song)
+            file_path = self.song_path_in_playlist(song)
+            if utils.link_or_copy_file(object_path, file_path):
+                return utils.get_file_size(file_path), 0
+            return 0, 0
+
+        if song.fm.stored_file_size <= 0:
+            # without a known size there's no telling when a download is complete
+            song_bytes_retrieved = self.storage_system.retrieve_file(song.fm, self.song_play_dir)
+            return song_bytes_retrieved, song_bytes_retrieved
+
+        offset = self.start_partial_download(song)
+        if offset > 0 and self.debug_print:
+            print("resuming download of %s at byte %d" % (song.fm.file_uid, offset))
+
+        bytes_transferred = 0
+        if offset < song.fm.stored_file_size:
+            hedge_event = None
+            if self.song_downloader is not None:
+                hedge_event = self.song_downloader.hedge_event(song)
+            chunks = self.get_song_chunks(song, offset, hedge_event)
+            if chunks is None:
+                return 0, 0
+            try:
+                with open(self.partial_download_path(song), "ab") as download_file:
+                    for chunk in chunks:
+                        if self.exit_requested:
+                            break
+                        download_file.write(chunk)
+                        bytes_transferred += len(chunk)
+            except (IOError, OSError) as e:
+                # what was written so far is kept for the next attempt
+                logging.error("error downloading %s: %s" % (song.fm.file_uid, repr(e)))
+            finally:
+                chunks.close()
+
+        bytes_downloaded = offset + bytes_transferred
+        if bytes_downloaded == song.fm.stored_file_size:
+            if self.finish_partial_download(song):
+                return bytes_downloaded, bytes_transferred
+        elif bytes_downloaded > song.fm.stored_file_size:
+            logging.error("download of %s is larger than expected" % song.fm.file_uid)
+            self.discard_partial_download(song)
+        return 0, bytes_transferred
+
+    def clean_song_play_dir(self):
+        # deletes songs left in the play list directory, keeping the partial
+        # downloads of songs in the current list so that they can be resumed
+        resumable_files = set()
+        for song in self.song_list:
+            download_file = song.fm.file_uid + self.download_extension
+            resumable_files.add(download_file)
+            resumable_files.add(download_file + DOWNLOAD_INFO_SUFFIX)
+        for file_name in utils.list_files_in_directory(self.song_play_dir):
+            if file_name not in resumable_files:
+                utils.delete_file(utils.path_join(self.song_play_dir, file_name))
+
     def check_file_integrity(self, song: song_metadata.SongMetadata) -> bool:
         file_integrity_passed = True
 
@@ -424,17 +753,47 @@ class Jukebox:
         return file_integrity_passed
 
     def batch_download_start(self):
-        self.cumulative_download_bytes = 0
-        self.cumulative_download_time = 0
+        with self.download_stats_lock:
+            self.cumulative_download_bytes = 0
+            self.cumulative_download_time = 0
 
     def batch_download_complete(self):
         if not self.exit_requested:
-            if self.cumulative_download_time > 0:
-                cumulative_download_kb = self.cumulative_download_bytes / 1000.0
-                print("average download throughput = %s KB/sec" % (
-                    int(cumulative_download_kb / self.cumulative_download_time)))
-            self.cumulative_download_bytes = 0
-            self.cumulative_download_time = 0
+            with self.download_stats_lock:
+                if self.cumulative_download_time > 0:
+                    cumulative_download_kb = self.cumulative_download_bytes / 1000.0
+                    print("average download throughput = %s KB/sec" % (
+                        int(cumulative_download_kb / self.cumulative_download_time)))
+                self.cumulative_download_bytes = 0
+                self.cumulative_download_time = 0
+
+    def record_download_throughput(self, bytes_per_second: float):
+        # caller must hold self.download_stats_lock
+        if self.download_throughput > 0:
+            self.download_throughput += DOWNLOAD_THROUGHPUT_WEIGHT * (bytes_per_second - self.download_throughput)
+        else:
+            self.download_throughput = bytes_per_second
+
+    def estimated_play_seconds(self, song: song_metadata.SongMetadata) -> float:
+        extension = utils.path_split_ext(song.fm.file_uid)[1].lower()
+        bitrate_kbps = NOMINAL_BITRATE_KBPS.get(extension, DEFAULT_BITRATE_KBPS)
+        file_size = song.fm.origin_file_size if song.fm.origin_file_size > 0 else song.fm.stored_file_size
+        return file_size * 8 / (bitrate_kbps * 1000.0)
+
+    def needs_more_prefetch(self, lookahead_seconds: float, lookahead_bytes: int, throughput: float) -> bool:
+        # beyond the file_cache_count floor, keep looking ahead until the next
+        # prefetch_seconds of playback are local. when downloads are slower
+        # than playback, also keep going until the playing time that's
+        # buffered covers the time needed to download the whole window. the
+        # byte budget caps both.
+        prefetch_seconds = self.jukebox_options.prefetch_seconds
+        if prefetch_seconds <= 0:
+            return False
+        if lookahead_bytes > self.jukebox_options.prefetch_max_mb * 1000000:
+            return False
+        if lookahead_seconds < prefetch_seconds:
+            return True
+        return throughput > 0 and lookahead_bytes / throughput > lookahead_seconds
 
     def download_song(self, song: song_metadata.SongMetadata) -> bool:
         if self.exit_requested:
@@ -442,19 +801,33 @@ class Jukebox:
 
         if song is not None:
             file_path = self.song_path_in_playlist(song)
-            download_start_time = time.time()
-            song_bytes_retrieved = self.storage_system.retrieve_file(song.fm, self.song_play_dir)
-            if self.exit_requested:
-                return False
-
-            if self.debug_print:
-                print("bytes retrieved: %s" % song_bytes_retrieved)
+            song_bytes_retrieved = 0
+            cache_hit = False
+            if self.song_cache is not None:
+                song_bytes_retrieved = self.song_cache.retrieve_file(song, file_path)
+                cache_hit = song_bytes_retrieved > 0
+                if cache_hit and self.debug_print:
+                    print("song cache hit: %s" % song.fm.file_uid)
+
+            if not cache_hit:
+                download_start_time = time.time()
+                song_bytes_retrieved, bytes_transferred = self.download_song_file(song)
+                if self.exit_requested:
+                    return False
+
+                if self.debug_print:
+                    print("bytes retrieved: %s" % song_bytes_retrieved)
+
+                if bytes_transferred > 0:
+                    download_end_time = time.time()
+                    download_elapsed_time = download_end_time - download_start_time
+                    with self.download_stats_lock:
+                        self.cumulative_download_time += download_elapsed_time
+                        self.cumulative_download_bytes += bytes_transferred
+                        if download_elapsed_time > 0:
+                            self.record_download_throughput(bytes_transferred / download_elapsed_time)
 
             if song_bytes_retrieved > 0:
-                download_end_time = time.time()
-                download_elapsed_time = download_end_time - download_start_time
-                self.cumulative_download_time += download_elapsed_time
-                self.cumulative_download_bytes += song_bytes_retrieved
 
                 # are we checking data integrity?
                 # if so, verify that the storage system retrieved the same length that has been stored
@@ -466,6 +839,8 @@ class Jukebox:
                         return False
 
                 if self.check_file_integrity(song):
+                    if self.song_cache is not None and not cache_hit:
+                        self.song_cache.add(song, file_path)
                     return True
                 else:
                     # we retrieved the file, but it failed our integrity check
@@ -516,37 +891,156 @@ class Jukebox:
             with open("404.txt", "a+") as f:
                 f.write("%s\n" % song_file_path)
 
-    def download_songs(self):
-        # scan the play list directory to see if we need to download more songs
-        dir_listing = utils.list_files_in_directory(self.song_play_dir)
-        song_file_count = 0
-        for listing_entry in dir_listing:
-            full_path = utils.path_join(self.song_play_dir, listing_entry)
-            extension = utils.path_split_ext(full_path)[1]
-            if extension and extension != self.download_extension:
-                song_file_count += 1
+    def stream_playback_supported(self) -> bool:
+        return self.jukebox_options is not None and \
+            self.jukebox_options.stream_playback and \
+            not self.storage_system.is_local and \
+            len(self.audio_player_command_args) > 0 and \
+            self.audio_player_command_args[0] in STREAMING_AUDIO_PLAYER_ARGS
+
+    def song_is_local(self, song: song_metadata.SongMetadata) -> bool:
+        if utils.file_exists(self.song_path_in_playlist(song)):
+            return True
+        return self.song_cache is not None and \
+            self.song_cache.retrieve_file(song, self.song_path_in_playlist(song)) > 0
+
+    def stream_song(self, song: song_metadata.SongMetadata) -> bool:
+        # plays the song while it's being downloaded. returns False if the
+        # song couldn't be streamed, in which case nothing was played
+        if song.fm.stored_file_size <= 0:
+            return False
 
-        file_cache_count = self.jukebox_options.file_cache_count
+        # a partial download left by an earlier attempt is played first,
+        # and the rest of the song is read from where it stopped
+        offset = self.start_partial_download(song)
+        if offset == song.fm.stored_file_size and self.finish_partial_download(song):
+            # an earlier download finished without being moved into place
+            self.play_song(song)
+            return True
+
+        # the song is playing, so a slow response is hedged right away
+        hedge_now = threading.Event()
+        hedge_now.set()
+        chunks = self.get_song_chunks(song, offset, hedge_now)
+        if chunks is None:
+            return False
 
-        if song_file_count < file_cache_count:
-            dl_songs = []
-            # start looking at the next song in the list
-            check_index = self.song_index + 1
-            for j in iter(range(self.number_songs)):
-                if check_index >= self.number_songs:
-                    check_index = 0
-                if check_index != self.song_index:
-                    si = self.song_list[check_index]
-                    file_path = self.song_path_in_playlist(si)
-                    if not utils.file_exists(file_path):
-                        dl_songs.append(si)
-                        if len(dl_songs) >= file_cache_count:
-                            break
-                check_index += 1
+        file_path = self.song_path_in_playlist(song)
+        download_path = self.partial_download_path(song)
+        try:
+            download_file = open(download_path, "ab")
+        except IOError:
+            logging.error("unable to create '%s'" % download_path)
+            chunks.close()
+            return False
+
+        cmd_args = self.audio_player_command_args[:]
+        cmd_args.extend(STREAMING_AUDIO_PLAYER_ARGS[cmd_args[0]])
+        try:
+            audio_player_proc = Popen(cmd_args, stdin=PIPE)
+        except OSError:
+            # audio player not available
+            self.audio_player_command_args = []
+            download_file.close()
+            chunks.close()
+            return False
+
+        print("streaming %s" % song.fm.file_uid)
+        self.song_start_time = time.time()
+        self.audio_player_stopped = False
+        self.audio_player_popen = audio_player_proc
+        streamer = song_streamer.SongStreamer(download_path, audio_player_proc.stdin)
+        streamer.data_written(offset)
+        streamer.start()
+
+        download_start_time = time.time()
+        song_bytes_retrieved = 0
+        try:
+            with download_file:
+                for chunk in chunks:
+                    # stop downloading if the song was skipped. when paused, the
+                    # download completes so the song can resume from the file
+                    if self.exit_requested or \
+                            (audio_player_proc.poll() is not None and not self.is_paused):
+                        break
+                    download_file.write(chunk)
+                    download_file.flush()
+                    song_bytes_retrieved += len(chunk)
+                    streamer.data_written(len(chunk))
+        except (IOError, OSError) as e:
+            logging.error("error streaming %s: %s" % (song.fm.file_uid, repr(e)))
+        finally:
+            chunks.close()
+            streamer.finish()
+
+        audio_player_proc.wait()
+        streamer.join()
+        self.audio_player_popen = None
 
-            if dl_songs:
-                download_thread = song_downloader.SongDownloader(self, dl_songs)
-                download_thread.start()
+        # a player that exits on its own with an error, or before taking any
+        # data (e.g., it can't play this format from standard input), played
+        # nothing. the song is then downloaded and played from the file
+        if not self.exit_requested and not self.audio_player_stopped and \
+                (audio_player_proc.returncode != 0 or streamer.bytes_fed == 0):
+            logging.error("audio player couldn't stream %s (exit status %d)" %
+                          (song.fm.file_uid, audio_player_proc.returncode))
+            self.discard_partial_download(song)
+            return False
+
+        if offset + song_bytes_retrieved == song.fm.stored_file_size and \
+                self.finish_partial_download(song):
+            download_elapsed_time = time.time() - download_start_time
+            with self.download_stats_lock:
+                self.cumulative_download_time += download_elapsed_time
+                self.cumulative_download_bytes += song_bytes_retrieved
+                if download_elapsed_time > 0:
+                    self.record_download_throughput(song_bytes_retrieved / download_elapsed_time)
+            if self.check_file_integrity(song):
+                if self.song_cache is not None:
+                    self.song_cache.add(song, file_path)
+            else:
+                utils.delete_file(file_path)
+        elif offset + song_bytes_retrieved > song.fm.stored_file_size:
+            self.discard_partial_download(song)
+
+        if not self.is_paused:
+            utils.delete_file(file_path)
+        return True
+
+    def download_songs(self):
+        # make sure that the upcoming songs are either already in the play
+        # list directory or queued for download. at least file_cache_count
+        # songs are looked ahead, more when needed to cover prefetch_seconds
+        # of playback at the measured download throughput. songs that are
+        # pending in the download pool aren't queued again.
+        if self.song_downloader is None:
+            return
+
+        with self.download_stats_lock:
+            throughput = self.download_throughput
+
+        file_cache_count = self.jukebox_options.file_cache_count
+        lookahead_count = 0
+        lookahead_bytes = 0
+        lookahead_seconds = 0.0
+        check_index = self.song_index + 1
+        for j in iter(range(self.number_songs)):
+            if check_index >= self.number_songs:
+                check_index = 0
+            if check_index != self.song_index:
+                si = self.song_list[check_index]
+                if lookahead_count >= file_cache_count and \
+                        not self.needs_more_prefetch(lookahead_seconds,
+                                                     lookahead_bytes + si.fm.stored_file_size,
+                                                     throughput):
+                    break
+                if not self.song_downloader.is_pending(si) and \
+                        not utils.file_exists(self.song_path_in_playlist(si)):
+                    self.song_downloader.enqueue(si)
+                lookahead_count += 1
+                lookahead_bytes += si.fm.stored_file_size
+                lookahead_seconds += self.estimated_play_seconds(si)
+            check_index += 1
 
     def play_songs(self, shuffle: bool = False, artist: str = "", album: str = "", file_format: str = ""):
         song_list = self.jukebox_db.retrieve_songs(artist, album, file_format)
@@ -566,9 +1060,22 @@ class Jukebox:
                 logging.debug("song-play directory does not exist, creating it")
                 utils.create_directory(self.song_play_dir)
             else:
-                # play list directory exists, delete any files in it
+                # play list directory exists, delete any files in it other
+                # than interrupted downloads that can be resumed
                 logging.debug("deleting existing files in song-play directory")
-                utils.delete_files_in_directory(self.song_play_dir)
+                self.clean_song_play_dir()
+
+            # songs are kept in the song cache across sessions so that they
+            # don't have to be downloaded again. local storage doesn't need one
+            if self.song_cache is None and \
+                    not self.storage_system.is_local and \
+                    self.jukebox_options is not None and \
+                    self.jukebox_options.song_cache_size_mb > 0:
+                cache = song_cache.SongCache(self.song_cache_dir,
+                                             self.jukebox_options.song_cache_size_mb * 1000000,
+                                             self.jukebox_options.song_cache_policy)
+                if cache.open():
+                    self.song_cache = cache
 
             self.song_index = 0
             install_signal_handlers()
@@ -589,21 +1096,45 @@ class Jukebox:
             else:
                 self.audio_player_command_args = []
 
-            print("downloading first song...")
-
             if shuffle:
                 self.song_list = random.sample(self.song_list, len(self.song_list))
 
             try:
-                if self.download_song(self.song_list[0]):
-                    print("first song downloaded. starting playing now.")
+                if self.stream_playback_supported():
+                    # the first song plays while it's being downloaded
+                    first_song_ready = True
+                else:
+                    print("downloading first song...")
+                    first_song_ready = self.download_song(self.song_list[0])
+                    if first_song_ready:
+                        print("first song downloaded. starting playing now.")
+
+                if first_song_ready:
                     with open("jukebox.pid", "w") as f:
                         f.write('%d\n' % utils.get_process_id())
+                    download_workers = self.jukebox_options.download_workers
+                    if not self.storage_system.thread_safe:
+                        download_workers = 1
+                    self.song_downloader = song_downloader.SongDownloader(self, download_workers)
+                    self.song_downloader.start()
                     while True:
                         if not self.exit_requested:
                             if not self.is_paused:
                                 self.download_songs()
-                                self.play_song(self.song_list[self.song_index])
+                                # the next song is running late if its download
+                                # hasn't started responding by the time the song
+                                # before it starts
+                                next_index = (self.song_index + 1) % self.number_songs
+                                self.song_downloader.request_hedge(self.song_list[next_index])
+                                song = self.song_list[self.song_index]
+                                # don't start playing a song that's still being downloaded
+                                self.song_downloader.wait_for_song(song)
+                                if self.stream_playback_supported() and not self.song_is_local(song):
+                                    if not self.stream_song(song):
+                                        self.download_song(song)
+                                        self.play_song(song)
+                                else:
+                                    self.play_song(song)
                             if not self.is_paused:
                                 self.song_index += 1
                                 if self.song_index >= self.number_songs:
@@ -620,6 +1151,10 @@ class Jukebox:
                 print("\nexiting jukebox")
                 utils.delete_file("jukebox.pid")
                 self.exit_requested = True
+            finally:
+                if self.song_downloader is not None:
+                    self.song_downloader.stop()
+                    self.song_downloader = None
 
     def show_list_containers(self):
         if self.storage_system is not None:
@@ -643,6 +1178,16 @@ class Jukebox:
         if self.jukebox_db is not None:
             self.jukebox_db.show_albums()
 
+    def search(self, search_text: str):
+        if self.jukebox_db is not None:
+            songs = self.jukebox_db.search(search_text)
+            if songs:
+                for song in songs:
+                    album = self.album_from_file_name(song.fm.file_uid)
+                    print("%s, %s, %s (%s)" % (song.artist_name, album, song.song_name, song.fm.file_uid))
+            else:
+                print("no songs found")
+
     def read_file_contents(self, file_path: str) -> Tuple[bool, str]:
         file_read = False
         file_contents = None
@@ -669,21 +1214,127 @@ class Jukebox:
             self.jukebox_db.close()
             self.jukebox_db = None
 
-            db_file_contents = ''
-            with open(self.get_metadata_db_file_path(), 'rb') as db_file:
-                db_file_contents = db_file.read()
+            upload_file_path = self.get_metadata_db_file_path()
+            compression = snapshot_codec.CODEC_NONE
+            if self.jukebox_options is not None:
+                compression = self.jukebox_options.metadata_compression
+            if compression != snapshot_codec.CODEC_NONE:
+                # the snapshot is stored compressed under the usual object
+                # name. downloads detect the compression from the contents.
+                compressed_file_path = upload_file_path + "." + compression
+                if snapshot_codec.compress_file(upload_file_path, compressed_file_path, compression):
+                    upload_file_path = compressed_file_path
+                else:
+                    logging.error("unable to compress metadata db file, uploading it uncompressed")
 
-            metadata_db_upload = self.storage_system.put_object(self.metadata_container,
-                                                                self.metadata_db_file,
-                                                                db_file_contents)
+            metadata_db_upload = self.storage_system.put_object_from_file(self.metadata_container,
+                                                                          self.metadata_db_file,
+                                                                          upload_file_path)
+            if upload_file_path != self.get_metadata_db_file_path():
+                utils.delete_file(upload_file_path)
 
             if metadata_db_upload:
                 logging.debug("metadata db file uploaded")
+                # the local file is now the same as the stored one
+                self.save_metadata_db_stat(self.storage_system.head_object(self.metadata_container,
+                                                                           self.metadata_db_file))
             else:
                 logging.error("unable to upload metadata db file")
 
         return metadata_db_upload
 
+    def metadata_deltas_enabled(self) -> bool:
+        return self.jukebox_options is not None and self.jukebox_options.metadata_deltas
+
+    def list_metadata_deltas(self) -> List[str]:
+        # delta object names sort in the order the deltas were created
+        delta_prefix = self.metadata_db_file + METADATA_DELTA_INFIX
+        container_contents = self.storage_system.list_container_contents(self.metadata_container, delta_prefix)
+        if container_contents is None:
+            return []
+        return sorted(container_contents)
+
+    def apply_metadata_deltas(self):
+        # bring the local catalog up to date with changes that other clients
+        # have published since the metadata DB snapshot was uploaded
+        if self.storage_system is None or not self.storage_system.has_container(self.metadata_container):
+            return
+
+        applied_deltas = set(self.jukebox_db.get_applied_deltas())
+        delta_names = self.list_metadata_deltas()
+        download_file = self.get_metadata_db_file_path() + METADATA_DELTA_INFIX + "download"
+        for delta_name in delta_names:
+            if delta_name in applied_deltas:
+                continue
+            logging.debug("applying metadata delta %s" % delta_name)
+            delta = None
+            if self.storage_system.get_object(self.metadata_container, delta_name, download_file) > 0:
+                file_contents = utils.file_read_all_text(download_file)
+                utils.delete_file(download_file)
+                if file_contents is not None:
+                    try:
+                        delta = json.loads(file_contents)
+                    except ValueError:
+                        delta = None
+            if delta is None or "changes" not in delta or \
+                    not self.jukebox_db.apply_delta(delta_name, delta["changes"]):
+                # later deltas may depend on this one, so stop here
+                logging.error("unable to apply metadata delta %s" % delta_name)
+                return
+
+        # deltas that were compacted into a snapshot no longer need tracking
+        compacted_deltas = applied_deltas.difference(delta_names)
+        if compacted_deltas:
+            self.jukebox_db.remove_applied_deltas(list(compacted_deltas))
+
+    def publish_metadata_changes(self) -> bool:
+        # uploads the changes made to the catalog. with metadata deltas on,
+        # only the changes are uploaded as a small delta object, and the
+        # deltas are periodically compacted into a new snapshot. otherwise
+        # the whole metadata DB is uploaded.
+        if not self.metadata_deltas_enabled() or \
+                self.jukebox_db is None or \
+                self.metadata_db_object_stat is None or \
+                not self.storage_system.has_container(self.metadata_container):
+            return self.upload_metadata_db()
+
+        changes = self.jukebox_db.take_change_log()
+        if not changes:
+            return True
+
+        delta_name = "%s%s%020d.%s" % (self.metadata_db_file,
+                                       METADATA_DELTA_INFIX,
+                                       time.time_ns(),
+                                       uuid.uuid4().hex[:8])
+        delta_contents = json.dumps({"changes": changes}, default=str)
+        if not self.storage_system.put_object(self.metadata_container,
+                                              delta_name,
+                                              delta_contents.encode("utf-8")):
+            logging.error("unable to upload metadata delta, uploading metadata db instead")
+            return self.upload_metadata_db()
+
+        logging.debug("metadata delta %s uploaded" % delta_name)
+        self.jukebox_db.add_applied_delta(delta_name)
+        # the stored snapshot hasn't changed, but the local file has
+        self.save_metadata_db_stat(self.metadata_db_object_stat)
+
+        delta_names = self.list_metadata_deltas()
+        if len(delta_names) >= METADATA_DELTA_COMPACT_THRESHOLD:
+            self.compact_metadata_deltas(delta_names)
+        return True
+
+    def compact_metadata_deltas(self, delta_names: List[str]) -> bool:
+        # the local catalog already has the deltas applied, so uploading it
+        # as the new snapshot makes the delta objects redundant
+        applied_deltas = set(self.jukebox_db.get_applied_deltas())
+        compacted_deltas = [delta_name for delta_name in delta_names if delta_name in applied_deltas]
+        logging.debug("compacting %d metadata deltas" % len(compacted_deltas))
+        if not self.upload_metadata_db():
+            return False
+        for delta_name in compacted_deltas:
+            self.storage_system.delete_object(self.metadata_container, delta_name)
+        return True
+
     def import_playlists(self):
         if self.jukebox_db is not None and self.jukebox_db.is_open():
             if not utils.directory_exists(self.playlist_import_dir):
@@ -725,8 +1376,8 @@ class Jukebox:
 
             if file_import_count > 0:
                 print("%d playlists imported" % file_import_count)
-                # upload metadata DB file
-                self.upload_metadata_db()
+                # upload metadata changes
+                self.publish_metadata_changes()
             else:
                 print("no files imported")
 
@@ -734,135 +1385,243 @@ class Jukebox:
         if self.jukebox_db is not None:
             self.jukebox_db.show_playlists()
 
+    def metadata_version(self) -> typing.Optional[dict]:
+        # identifies the state of the published metadata: the stored DB
+        # snapshot plus the deltas applied on top of it. None if it isn't
+        # known
+        if self.metadata_db_object_stat is None or self.jukebox_db is None:
+            return None
+        applied_deltas = self.jukebox_db.get_applied_deltas()
+        return {"db": self.metadata_db_object_stat.get(storage_system.OBJECT_ETAG),
+                "deltas": len(applied_deltas),
+                "last_delta": max(applied_deltas) if applied_deltas else None}
+
+    def get_object_cache(self) -> typing.Optional[object_cache.ObjectCache]:
+        if self.object_cache is None:
+            cache = object_cache.ObjectCache(self.object_cache_dir)
+            if cache.open():
+                self.object_cache = cache
+        return self.object_cache
+
+    def get_json_object(self, container_name: str, object_name: str, changes_with_metadata: bool = True):
+        # returns the parsed contents of a playlist or album json object.
+        # objects that only change along with the published metadata (like
+        # playlists) are used from the cache without any request while the
+        # metadata version is the same. otherwise the cached copy is checked
+        # against the object's ETag and only downloaded again if it changed
+        file_contents = None
+        cache = self.get_object_cache()
+        version = self.metadata_version()
+        cached = cache.get(container_name, object_name) if cache is not None else None
+        if cached is not None and changes_with_metadata:
+            cached_contents, entry = cached
+            if version is not None and entry.get(object_cache.ENTRY_VERSION) == version:
+                file_contents = cached_contents
+
+        if file_contents is None:
+            object_stat = self.storage_system.head_object(container_name, object_name)
+            if object_stat is None:
+                if cache is not None:
+                    cache.remove(container_name, object_name)
+                logging.error("unable to retrieve %s" % object_name)
+                return None
+            etag = object_stat.get(storage_system.OBJECT_ETAG)
+            if cached is not None and etag is not None and cached[1].get(object_cache.ENTRY_ETAG) == etag:
+                file_contents = cached[0]
+                cache.set_version(container_name, object_name, etag, version)
+            elif cache is not None and cache.prepare_container(container_name):
+                download_file = cache.download_path(container_name, object_name)
+                if self.storage_system.get_object(container_name, object_name, download_file) > 0:
+                    file_contents = utils.file_read_all_text(download_file)
+                    if file_contents is not None:
+                        cache.add(container_name, object_name, download_file, etag, version)
+                utils.delete_file(download_file)
+            else:
+                # no cache directory, read the object straight into memory
+                chunks = self.storage_system.get_object_chunks(container_name, object_name)
+                if chunks is not None:
+                    try:
+                        file_contents = b"".join(chunks)
+                    except IOError:
+                        file_contents = None
+
+        if file_contents is None:
+            logging.error("unable to retrieve %s" % object_name)
+            return None
+        try:
+            return json.loads(file_contents)
+        except ValueError:
+            print("error: unable to parse json object %s" % object_name)
+            return None
+
     def show_playlist(self, playlist):
         object_name = "%s.json" % jb_utils.encode_value(playlist)
-        download_file = object_name
-        if self.storage_system.get_object(self.playlist_container,
-                                          object_name,
-                                          download_file) > 0:
-            file_contents = utils.file_read_all_text(download_file)
-            if file_contents is not None:
-                file_read = True
-            else:
-                logging.error("unable to read file %s" % download_file)
-                file_read = False
-
-            if file_read:
-                pl = json.loads(file_contents)
-                if pl is not None:
-                    if "songs" in pl:
-                        list_song_dicts = pl["songs"]
-                        for song_dict in list_song_dicts:
-                            if "artist" in song_dict and "album" in song_dict and "song" in song_dict:
-                                artist = song_dict["artist"]
-                                album = song_dict["album"]
-                                song = song_dict["song"]
-                                base_object_name = jb_utils.encode_artist_album_song(artist, album, song)
-                                print(base_object_name)
-                            else:
-                                print("error: song entry is missing 'artist', 'album', or 'song' element")
+        pl = self.get_json_object(self.playlist_container, object_name)
+        if pl is not None:
+            if "songs" in pl:
+                list_song_dicts = pl["songs"]
+                for song_dict in list_song_dicts:
+                    if "artist" in song_dict and "album" in song_dict and "song" in song_dict:
+                        artist = song_dict["artist"]
+                        album = song_dict["album"]
+                        song = song_dict["song"]
+                        base_object_name = jb_utils.encode_artist_album_song(artist, album, song)
+                        print(base_object_name)
                     else:
-                        print("error: playlist json file missing 'songs' element")
-                else:
-                    print("error: unable to parse playlist json file")
-        else:
-            logging.error("unable to retrieve %s" % object_name)
+                        print("error: song entry is missing 'artist', 'album', or 'song' element")
+            else:
+                print("error: playlist json file missing 'songs' element")
+
+    def resolve_songs(self, base_object_names: List[str]) -> List[song_metadata.SongMetadata]:
+        # looks up the songs for object names without a file extension,
+        # keeping their order and skipping the names with no song
+        song_list = []
+        db_songs = self.jukebox_db.retrieve_songs_for_base_names(base_object_names)
+        for base_object_name, db_song in zip(base_object_names, db_songs):
+            if db_song is not None:
+                song_list.append(db_song)
+            else:
+                logging.error("No song file for %s" % base_object_name)
+        return song_list
 
     def play_playlist(self, playlist):
         object_name = "%s.json" % jb_utils.encode_value(playlist)
-        download_file = object_name
-        if self.storage_system.get_object(self.playlist_container,
-                                          object_name,
-                                          download_file) > 0:
-            file_contents = utils.file_read_all_text(download_file)
-            if file_contents is not None:
-                file_read = True
+        pl = self.get_json_object(self.playlist_container, object_name)
+        if pl is not None:
+            if "songs" in pl:
+                base_object_names = []
+                list_song_dicts = pl["songs"]
+                for song_dict in list_song_dicts:
+                    if "artist" in song_dict and "album" in song_dict and "song" in song_dict:
+                        artist = song_dict["artist"]
+                        album = song_dict["album"]
+                        song = song_dict["song"]
+                        base_object_names.append(jb_utils.encode_artist_album_song(artist, album, song))
+                    else:
+                        print("error: 'artist', 'album', or 'song' missing from playlist entry")
+
+                self.play_song_list(self.resolve_songs(base_object_names), False)
             else:
-                logging.error("unable to read file %s" % download_file)
-                file_read = False
-
-            if file_read:
-                pl = json.loads(file_contents)
-                if pl is not None:
-                    if "songs" in pl:
-                        song_list = []
-                        list_song_dicts = pl["songs"]
-                        for song_dict in list_song_dicts:
-                            if "artist" in song_dict and "album" in song_dict and "song" in song_dict:
-                                artist = song_dict["artist"]
-                                album = song_dict["album"]
-                                song = song_dict["song"]
-                                base_object_name = jb_utils.encode_artist_album_song(artist, album, song)
-                                ext_list = [".flac", ".m4a", ".mp3"]
-                                song_file_found = False
-                                for ext in ext_list:
-                                    object_name = base_object_name + ext
-                                    db_song = self.jukebox_db.retrieve_song(object_name)
-                                    if db_song is not None:
-                                        song_list.append(db_song)
-                                        song_file_found = True
-                                        break
-
-                                if not song_file_found:
-                                    logging.error("No song file for %s" % base_object_name)
-                            else:
-                                print("error: 'artist', 'album', or 'song' missing from playlist entry")
+                print("error: no 'songs' element in playlist json file")
 
-                        self.play_song_list(song_list, False)
-                    else:
-                        print("error: no 'songs' element in playlist json file")
-                else:
-                    print("error: unable to parse playlist json file")
-        else:
-            logging.error("unable to retrieve %s" % object_name)
+    @staticmethod
+    def album_tracks_from_json(album_json) -> typing.Optional[List[str]]:
+        # object names (without file extension) of the tracks listed in an
+        # album json file, in order
+        if album_json is None or "tracks" not in album_json:
+            return None
+        album_tracks = []
+        for song_dict in album_json["tracks"]:
+            if not "object" in song_dict:
+                logging.error("missing 'object' in %s" % repr(song_dict))
+                continue
+            base_object_name = song_dict["object"]
+            pos_dot = base_object_name.find(".")
+            if pos_dot > 0:
+                base_object_name = base_object_name[0:pos_dot]
+            album_tracks.append(base_object_name)
+        return album_tracks
 
     def get_album_songs(self, artist, album):
-        album_songs = []
-        object_name = jb_utils.encode_artist_album(artist, album)
-        download_file = object_name
-        if self.storage_system.get_object(self.album_container,
-                                          object_name,
-                                          download_file) > 0:
-            try:
-                with open(download_file, 'rb') as content_file:
-                    file_contents = content_file.read()
-                file_read = True
-            except IOError:
-                logging.error("unable to read file %s" % download_file)
-                file_read = False
-
-            if file_read:
-                pl = json.loads(file_contents)
-                if pl is not None:
-                    if "tracks" in pl:
-                        song_list = []
-                        list_song_dicts = pl["tracks"]
-                        for song_dict in list_song_dicts:
-                            if not "object" in song_dict:
-                                logging.error("missing 'object' in %s" % repr(song_dict))
-                                continue
-                            base_object_name = song_dict["object"]
-                            pos_dot = base_object_name.find(".")
-                            if pos_dot > 0:
-                                base_object_name = base_object_name[0:pos_dot]
-                            album_songs.append(base_object_name)
+        album_uid = jb_utils.encode_artist_album(artist, album)
+        album_songs = self.jukebox_db.get_album_tracks(album_uid)
+        if not album_songs:
+            # an album that hasn't been imported into the metadata yet
+            logging.debug("album %s not in metadata, retrieving album object" % album_uid)
+            album_songs = self.album_tracks_from_json(self.get_json_object(self.album_container, album_uid, False))
+            if album_songs is None:
+                album_songs = []
         return album_songs
 
+    def import_albums(self):
+        # stores the track lists of new albums in the metadata. albums come
+        # from json files in the album-import subdirectory (which are also
+        # uploaded to the album container) and from album objects already in
+        # the album container
+        if self.jukebox_db is not None and self.jukebox_db.is_open():
+            if not self.storage_system.has_container(self.album_container):
+                if not self.storage_system.create_container(self.album_container):
+                    logging.error("unable to create container for albums. unable to import")
+                    return
+
+            album_import_count = 0
+            if utils.directory_exists(self.album_import_dir):
+                for listing_entry in utils.list_files_in_directory(self.album_import_dir):
+                    object_name = utils.path_split_ext(listing_entry)[0]
+                    full_path = utils.path_join(self.album_import_dir, listing_entry)
+                    file_read, file_contents = self.read_file_contents(full_path)
+                    if not file_read or file_contents is None:
+                        continue
+                    try:
+                        album_tracks = self.album_tracks_from_json(json.loads(file_contents))
+                    except ValueError:
+                        album_tracks = None
+                    if album_tracks is None:
+                        print("error: '%s' isn't an album json file with 'tracks'" % listing_entry)
+                        continue
+                    if self.storage_system.put_object(self.album_container,
+                                                      object_name,
+                                                      file_contents.encode('utf-8')):
+                        if self.store_album(object_name, album_tracks):
+                            album_import_count += 1
+                    else:
+                        logging.error("unable to upload album %s" % object_name)
+
+            container_contents = self.storage_system.list_container_contents(self.album_container)
+            for object_name in container_contents or []:
+                if not self.jukebox_db.get_album_tracks(object_name):
+                    album_json = self.get_json_object(self.album_container, object_name, False)
+                    album_tracks = self.album_tracks_from_json(album_json)
+                    if album_tracks is not None and self.store_album(object_name, album_tracks):
+                        album_import_count += 1
+
+            if album_import_count > 0:
+                print("%d albums imported" % album_import_count)
+                # upload metadata changes
+                self.publish_metadata_changes()
+            else:
+                print("no albums imported")
+
+    def link_songs_to_albums(self):
+        # fills in the artist and album of songs imported before songs were
+        # linked to the artist and album tables, so that artist and album
+        # filters can use indexed lookups
+        if self.jukebox_db is not None and self.jukebox_db.is_open():
+            linked_songs = []
+            for song in self.jukebox_db.retrieve_unlinked_songs():
+                components = self.components_from_file_name(song.fm.file_uid)
+                if components is None:
+                    logging.error("unable to get artist and album from '%s'" % song.fm.file_uid)
+                    continue
+                artist, album, _ = components
+                song.artist_uid = jb_utils.encode_value(artist)
+                song.album_uid = jb_utils.encode_artist_album(artist, album)
+                linked_songs.append(song)
+
+            if linked_songs:
+                if self.jukebox_db.link_songs(linked_songs):
+                    print("%d songs linked to their artist and album" % len(linked_songs))
+                    # upload metadata changes
+                    self.publish_metadata_changes()
+                else:
+                    logging.error("unable to link songs to their artist and album")
+            else:
+                print("all songs are already linked to their artist and album")
+
+    def store_album(self, object_name: str, album_tracks: List[str]) -> bool:
+        # album object names have the form 'the-artist--the-album'
+        components = object_name.split(jb_utils.DOUBLE_DASHES)
+        if len(components) != 2:
+            logging.error("album object name '%s' isn't 'the-artist--the-album'" % object_name)
+            return False
+        return self.jukebox_db.store_album(jb_utils.decode_value(components[0]),
+                                           jb_utils.decode_value(components[1]),
+                                           album_tracks)
+
     def play_album(self, artist, album):
         album_songs = self.get_album_songs(artist, album)
         if album_songs is not None and len(album_songs) > 0:
-            song_list = []
-            for base_object_name in album_songs:
-                ext_list = [".flac", ".m4a", ".mp3"]
-                for ext in ext_list:
-                    object_name = base_object_name + ext
-                    db_song = self.jukebox_db.retrieve_song(object_name)
-                    if db_song is not None:
-                        song_list.append(db_song)
-                        break
-                else:
-                    logging.error("No song file for %s" % base_object_name)
-            self.play_song_list(song_list, False)
+            self.play_song_list(self.resolve_songs(album_songs), False)
         else:
             logging.error("unable to retrieve album %s/%s" % (artist, album))
 
@@ -883,11 +1642,62 @@ class Jukebox:
             if container is not None and len(container) > 0:
                 ss_deleted = self.storage_system.delete_object(container, song_uid)
             if db_deleted and upload_metadata:
-                self.upload_metadata_db()
+                self.publish_metadata_changes()
             is_deleted = db_deleted or ss_deleted
 
         return is_deleted
 
+    def delete_song_objects(self, songs: List[song_metadata.SongMetadata]) -> List[song_metadata.SongMetadata]:
+        # deletes the songs' audio files with one bulk delete per container.
+        # returns the songs whose files were deleted
+        songs_by_container: Dict[str, List[song_metadata.SongMetadata]] = {}
+        for song in songs:
+            songs_by_container.setdefault(song.fm.container_name, []).append(song)
+
+        deleted_songs = []
+        for container_name, container_songs in songs_by_container.items():
+            deleted_objects = set(self.storage_system.delete_objects(
+                container_name, [song.fm.object_name for song in container_songs]))
+            for song in container_songs:
+                if song.fm.object_name in deleted_objects:
+                    deleted_songs.append(song)
+                else:
+                    logging.error("unable to delete song %s" % song.fm.object_name)
+        return deleted_songs
+
+    def delete_songs(self, songs: List[song_metadata.SongMetadata]) -> int:
+        # deletes the songs' files and then their metadata (in one
+        # transaction), and publishes the metadata changes once. returns the
+        # number of songs deleted
+        deleted_songs = self.delete_song_objects(songs)
+        if deleted_songs:
+            if not self.jukebox_db.delete_songs([song.fm.object_name for song in deleted_songs]):
+                logging.error("unable to delete metadata of deleted songs")
+                return 0
+            self.delete_empty_album_objects(deleted_songs)
+            self.publish_metadata_changes()
+        return len(deleted_songs)
+
+    def delete_empty_album_objects(self, deleted_songs: List[song_metadata.SongMetadata]):
+        # the metadata of albums left without songs is deleted along with the
+        # songs. their album objects go too, so that they aren't read in place
+        # of the metadata or imported again
+        album_uids = set()
+        for song in deleted_songs:
+            if song.album_uid:
+                album_uids.add(song.album_uid)
+            else:
+                components = song.fm.file_uid.split(jb_utils.DOUBLE_DASHES)
+                if len(components) == 3:
+                    album_uids.add(jb_utils.DOUBLE_DASHES.join(components[:2]))
+        empty_albums = sorted(album_uid for album_uid in album_uids
+                              if not self.jukebox_db.album_has_songs(album_uid))
+        if empty_albums and self.storage_system.has_container(self.album_container):
+            deleted_albums = self.storage_system.delete_objects(self.album_container, empty_albums)
+            if self.get_object_cache() is not None:
+                for album_uid in deleted_albums:
+                    self.object_cache.remove(self.album_container, album_uid)
+
     def delete_artist(self, artist: str) -> bool:
         is_deleted = False
         if len(artist) > 0:
@@ -897,11 +1707,9 @@ class Jukebox:
                     print("no songs in jukebox")
                     sys.exit(0)
                 else:
-                    for song in song_list:
-                        if not self.delete_song(song.fm.object_name, False):
-                            logging.error("deleting song '%s'" % song.fm.object_name)
-                            sys.exit(1)
-                    self.upload_metadata_db()
+                    if self.delete_songs(song_list) < len(song_list):
+                        logging.error("unable to delete all songs of artist '%s'" % artist)
+                        sys.exit(1)
                     is_deleted = True
             else:
                 print("no songs in jukebox")
@@ -916,20 +1724,9 @@ class Jukebox:
             album_name = album[pos_double_dash + 2:]
             list_album_songs = self.jukebox_db.retrieve_songs(artist, album_name)
             if list_album_songs is not None and len(list_album_songs) > 0:
-                num_songs_deleted = 0
                 for song in list_album_songs:
                     print("%s %s" % (song.fm.container_name, song.fm.object_name))
-                    # delete each song audio file
-                    if self.storage_system.delete_object(song.fm.container_name, song.fm.object_name):
-                        num_songs_deleted += 1
-                        # delete song metadata
-                        self.jukebox_db.delete_song(song.fm.object_name)
-                    else:
-                        logging.error("unable to delete song %s" % song.fm.object_name)
-                        # TODO: delete song metadata if we got 404
-                if num_songs_deleted > 0:
-                    # upload metadata db
-                    self.upload_metadata_db()
+                if self.delete_songs(list_album_songs) > 0:
                     return True
             else:
                 print("no songs found for artist='%s' album name='%s'" % (artist, album_name))
@@ -946,12 +1743,14 @@ class Jukebox:
                 print("container='%s', object='%s'" % (self.playlist_container, object_name))
                 if self.storage_system.delete_object(self.playlist_container, object_name):
                     is_deleted = True
+                    if self.get_object_cache() is not None:
+                        self.object_cache.remove(self.playlist_container, object_name)
                 else:
                     logging.error("object delete failed")
             else:
                 logging.error("database delete failed")
             if is_deleted:
-                self.upload_metadata_db()
+                self.publish_metadata_changes()
             else:
                 logging.error("delete of playlist failed")
         else:
@@ -1019,5 +1818,6 @@ def initialize_storage_system(storage_sys: storage_system.StorageSystem, contain
     # delete metadata DB file if present
     if utils.file_exists(DEFAULT_DB_FILE_NAME):
         utils.delete_file(DEFAULT_DB_FILE_NAME)
+    utils.delete_file(DEFAULT_DB_FILE_NAME + METADATA_DB_STAT_SUFFIX)
 
     return True
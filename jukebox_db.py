@@ -1,20 +1,150 @@
+import json
 import logging
 import sqlite3
 import typing
 
-from typing import List
+from typing import Dict, List
 
 import jb_utils
 import song_metadata
 from song_metadata import SongMetadata
 from file_metadata import FileMetadata
 
+# album name of a song, decoded from the song_uid
+# ('the-artist--the-album--the-song.ext') of the song row named by %(row)s
+SONG_FTS_ALBUM_EXPR = "replace(substr(substr(%(row)s.song_uid, instr(%(row)s.song_uid, '--') + 2), 1, " \
+                      "instr(substr(%(row)s.song_uid, instr(%(row)s.song_uid, '--') + 2), '--') - 1), '-', ' ')"
+
+SONG_FTS_INSERT = "INSERT INTO song_fts_map (song_uid) VALUES (new.song_uid); " \
+                  "INSERT INTO song_fts (rowid, artist, album, song) " \
+                  "VALUES ((SELECT fts_rowid FROM song_fts_map WHERE song_uid = new.song_uid), " \
+                  "new.artist_name, %s, new.song_name)" % (SONG_FTS_ALBUM_EXPR % {"row": "new"})
+
+SONG_FTS_DELETE = "DELETE FROM song_fts WHERE rowid = " \
+                  "(SELECT fts_rowid FROM song_fts_map WHERE song_uid = old.song_uid); " \
+                  "DELETE FROM song_fts_map WHERE song_uid = old.song_uid"
+
+# full-text index of artist, album and song names for search. it's only
+# built when SQLite has FTS5 (see open_search_index), so it isn't part of
+# the schema migrations. song has no INTEGER PRIMARY KEY, so its rowids can
+# change when the catalog is VACUUMed; instead, song_fts_map gives each
+# song a stable rowid in song_fts and lets the triggers find a song's row
+# with an index lookup. the triggers keep the index in sync, including
+# when metadata deltas are applied. updates that leave the indexed names
+# alone skip it
+SEARCH_INDEX_TRIGGERS = {
+    "song_fts_insert": "CREATE TRIGGER song_fts_insert AFTER INSERT ON song BEGIN " +
+                       SONG_FTS_INSERT + "; END",
+    "song_fts_delete": "CREATE TRIGGER song_fts_delete AFTER DELETE ON song BEGIN " +
+                       SONG_FTS_DELETE + "; END",
+    "song_fts_update": "CREATE TRIGGER song_fts_update AFTER UPDATE OF song_uid, artist_name, song_name ON song " +
+                       "WHEN old.song_uid IS NOT new.song_uid OR old.artist_name IS NOT new.artist_name " +
+                       "OR old.song_name IS NOT new.song_name BEGIN " +
+                       SONG_FTS_DELETE + "; " + SONG_FTS_INSERT + "; END",
+}
+
+SEARCH_INDEX_BUILD = [
+    "DROP TABLE IF EXISTS song_fts",
+    "DROP TABLE IF EXISTS song_fts_map",
+    "CREATE TABLE song_fts_map (fts_rowid INTEGER PRIMARY KEY, song_uid TEXT UNIQUE NOT NULL)",
+    "CREATE VIRTUAL TABLE song_fts USING fts5(artist, album, song)",
+    "INSERT INTO song_fts_map (song_uid) SELECT song_uid FROM song",
+    "INSERT INTO song_fts (rowid, artist, album, song) " +
+    "SELECT song_fts_map.fts_rowid, artist_name, %s, song_name " % (SONG_FTS_ALBUM_EXPR % {"row": "song"}) +
+    "FROM song JOIN song_fts_map ON song_fts_map.song_uid = song.song_uid",
+] + list(SEARCH_INDEX_TRIGGERS.values())
+
+# each entry upgrades the schema by one version, starting from version 0
+# (a catalog created before schema versioning). the version of a catalog is
+# kept in 'PRAGMA user_version', so catalogs downloaded from the storage
+# system are upgraded in place the first time they're opened.
+SCHEMA_MIGRATIONS = [
+    # version 1: indexes for song filtering and listings (song_filter_idx
+    # is replaced in version 6)
+    ["CREATE INDEX IF NOT EXISTS song_filter_idx ON song (encrypted, compressed, song_uid)",
+     "CREATE INDEX IF NOT EXISTS song_listing_idx ON song (artist_name, song_name)"],
+    # version 2: names of the metadata delta objects applied to the catalog
+    ["CREATE TABLE IF NOT EXISTS metadata_delta (delta_name TEXT UNIQUE NOT NULL)"],
+    # version 3: track order of albums. tracks are song object names
+    # without their file extension, as in the album json objects
+    ["CREATE TABLE IF NOT EXISTS album_track (" +
+     "album_uid TEXT NOT NULL REFERENCES album(album_uid)," +
+     "track_number INTEGER NOT NULL," +
+     "track_object TEXT NOT NULL," +
+     "PRIMARY KEY (album_uid, track_number))",
+     "CREATE INDEX IF NOT EXISTS album_artist_idx ON album (artist_uid, album_name)"],
+    # version 4: artist and album filters are equality lookups on the
+    # song's foreign keys
+    ["CREATE INDEX IF NOT EXISTS song_artist_idx ON song (artist_uid)",
+     "CREATE INDEX IF NOT EXISTS song_album_idx ON song (album_uid)"],
+    # version 5: previously created the full-text search index, which is
+    # now built by open_search_index() when SQLite supports it
+    [],
+    # version 6: song_uid prefix filters are case-insensitive range
+    # searches on lower(song_uid) (see prefix_range), which this index
+    # serves in place of song_filter_idx
+    ["CREATE INDEX IF NOT EXISTS song_prefix_idx ON song (encrypted, compressed, lower(song_uid))",
+     "DROP INDEX IF EXISTS song_filter_idx"],
+]
+
+SCHEMA_VERSION = len(SCHEMA_MIGRATIONS)
+
+# file extensions of song objects, in order of preference
+SONG_FILE_EXTENSIONS = [".flac", ".m4a", ".mp3"]
+
+SONG_COLUMNS = """song_uid,
+                  file_time,
+                  origin_file_size,
+                  stored_file_size,
+                  pad_char_count,
+                  artist_name,
+                  artist_uid,
+                  song_name,
+                  md5_hash,
+                  compressed,
+                  encrypted,
+                  container_name,
+                  object_name,
+                  album_uid"""
+
+
+def prefix_range(prefix: str) -> typing.Tuple[str, str]:
+    # bounds of the strings that start with prefix, as in 'x >= low AND
+    # x < high', which SQLite can answer with an index range search
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def song_for_row(row) -> SongMetadata:
+    # row holds the SONG_COLUMNS, in order
+    song = SongMetadata()
+    song.fm = FileMetadata()
+    song.fm.file_uid = row[0]
+    song.fm.file_time = row[1]
+    song.fm.origin_file_size = row[2]
+    song.fm.stored_file_size = row[3]
+    song.fm.pad_char_count = row[4]
+    song.artist_name = row[5]
+    song.artist_uid = row[6]
+    song.song_name = row[7]
+    song.fm.md5_hash = row[8]
+    song.fm.compressed = row[9]
+    song.fm.encrypted = row[10]
+    song.fm.container_name = row[11]
+    song.fm.object_name = row[12]
+    song.album_uid = row[13]
+    return song
+
 
 class JukeboxDB:
 
     def __init__(self, metadata_db_file_path: str = "", debug_print: bool = False):
         self.debug_print = debug_print
         self.db_connection = None
+        # when not None, every change made to the catalog is appended as an
+        # (sql, arguments) entry so it can be replayed against other copies
+        self.change_log: typing.Optional[List[dict]] = None
+        # whether song_fts can be used by search (see open_search_index)
+        self.search_index_available = False
         if len(metadata_db_file_path) > 0:
             self.metadata_db_file_path = metadata_db_file_path
         else:
@@ -34,6 +164,10 @@ class JukeboxDB:
                     logging.error('unable to create all tables')
             else:
                 open_success = True
+            if open_success:
+                open_success = self.migrate_schema()
+            if open_success:
+                self.search_index_available = self.open_search_index()
         return open_success
 
     def close(self) -> bool:
@@ -128,6 +262,166 @@ class JukeboxDB:
 
         return False
 
+    def get_schema_version(self) -> int:
+        schema_version = 0
+        if self.db_connection is not None:
+            row = self.db_connection.execute("PRAGMA user_version").fetchone()
+            if row is not None:
+                schema_version = row[0]
+        return schema_version
+
+    def migrate_schema(self) -> bool:
+        if self.db_connection is None:
+            return False
+
+        schema_version = self.get_schema_version()
+        if schema_version > SCHEMA_VERSION:
+            logging.error("metadata db schema version %d is newer than supported version %d" %
+                          (schema_version, SCHEMA_VERSION))
+            return False
+
+        while schema_version < SCHEMA_VERSION:
+            logging.debug("migrating metadata db schema to version %d" % (schema_version + 1))
+            try:
+                self.db_connection.execute("BEGIN")
+                for sql in SCHEMA_MIGRATIONS[schema_version]:
+                    self.db_connection.execute(sql)
+                self.db_connection.execute("PRAGMA user_version = %d" % (schema_version + 1))
+                self.db_connection.commit()
+            except sqlite3.Error as e:
+                self.db_connection.rollback()
+                logging.error("error migrating schema: " + e.args[0])
+                return False
+            schema_version += 1
+
+        return True
+
+    def fts5_is_available(self) -> bool:
+        try:
+            row = self.db_connection.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')").fetchone()
+            return row is not None and row[0] == 1
+        except sqlite3.Error:
+            return False
+
+    def open_search_index(self) -> bool:
+        # makes sure the full-text search index exists and is kept in sync
+        # by its triggers. without FTS5 the triggers are dropped (they would
+        # make every write to song fail) and search falls back to LIKE; the
+        # next open with FTS5 finds them missing and rebuilds the index. the
+        # index is also rebuilt when its triggers differ from the current
+        # definitions
+        if self.db_connection is None:
+            return False
+
+        trigger_names = list(SEARCH_INDEX_TRIGGERS.keys())
+        try:
+            sql = "SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND name IN (%s)" % \
+                  ", ".join("?" * len(trigger_names))
+            triggers = dict(self.db_connection.execute(sql, trigger_names).fetchall())
+        except sqlite3.Error as e:
+            logging.error("error checking search index: " + e.args[0])
+            return False
+
+        if not self.fts5_is_available():
+            if len(triggers) > 0:
+                logging.warning("sqlite has no FTS5, dropping search index triggers")
+                try:
+                    for trigger_name in trigger_names:
+                        self.db_connection.execute("DROP TRIGGER IF EXISTS %s" % trigger_name)
+                    self.db_connection.commit()
+                except sqlite3.Error as e:
+                    logging.error("error dropping search index triggers: " + e.args[0])
+            return False
+
+        if triggers == SEARCH_INDEX_TRIGGERS:
+            return True
+
+        logging.debug("building search index")
+        try:
+            self.db_connection.execute("BEGIN")
+            for trigger_name in trigger_names:
+                self.db_connection.execute("DROP TRIGGER IF EXISTS %s" % trigger_name)
+            for sql in SEARCH_INDEX_BUILD:
+                self.db_connection.execute(sql)
+            self.db_connection.commit()
+        except sqlite3.Error as e:
+            self.db_connection.rollback()
+            logging.error("error building search index: " + e.args[0])
+            return False
+        return True
+
+    def start_change_log(self):
+        self.change_log = []
+
+    def take_change_log(self) -> List[dict]:
+        # returns the changes recorded so far and starts a new log
+        changes = self.change_log
+        if changes is None:
+            return []
+        self.change_log = []
+        return changes
+
+    def record_change(self, sql: str, args: list):
+        if self.change_log is not None:
+            self.change_log.append({"sql": sql, "args": args})
+
+    def record_changes(self, sql: str, rows: list):
+        if self.change_log is not None:
+            self.change_log.append({"sql": sql, "many": rows})
+
+    def get_applied_deltas(self) -> List[str]:
+        delta_names = []
+        if self.db_connection is not None:
+            sql = "SELECT delta_name FROM metadata_delta"
+            cursor = self.db_connection.cursor()
+            for row in cursor.execute(sql):
+                delta_names.append(row[0])
+        return delta_names
+
+    def apply_delta(self, delta_name: str, changes: List[dict]) -> bool:
+        # replays changes recorded by another copy of the catalog. the
+        # changes and the delta name are stored in one transaction so that a
+        # delta is either fully applied or not at all.
+        apply_success = False
+        if self.db_connection is not None:
+            cursor = self.db_connection.cursor()
+            try:
+                for change in changes:
+                    if "many" in change:
+                        cursor.executemany(change["sql"], change["many"])
+                    else:
+                        cursor.execute(change["sql"], change["args"])
+                cursor.execute("INSERT OR IGNORE INTO metadata_delta VALUES (?)", [delta_name])
+                self.db_connection.commit()
+                apply_success = True
+            except (sqlite3.Error, KeyError) as e:
+                self.db_connection.rollback()
+                logging.error("error applying metadata delta %s: %s" % (delta_name, repr(e)))
+        return apply_success
+
+    def add_applied_delta(self, delta_name: str) -> bool:
+        add_success = False
+        if self.db_connection is not None:
+            try:
+                self.db_connection.execute("INSERT OR IGNORE INTO metadata_delta VALUES (?)", [delta_name])
+                self.db_connection.commit()
+                add_success = True
+            except sqlite3.Error as e:
+                logging.error("error recording metadata delta: " + e.args[0])
+        return add_success
+
+    def remove_applied_deltas(self, delta_names: List[str]) -> bool:
+        remove_success = False
+        if self.db_connection is not None:
+            try:
+                self.db_connection.executemany("DELETE FROM metadata_delta WHERE delta_name = ?",
+                                               [[delta_name] for delta_name in delta_names])
+                self.db_connection.commit()
+                remove_success = True
+            except sqlite3.Error as e:
+                logging.error("error removing metadata deltas: " + e.args[0])
+        return remove_success
+
     def have_tables(self) -> bool:
         have_tables_in_db = False
         if self.db_connection is not None:
@@ -142,26 +436,117 @@ class JukeboxDB:
 
         return have_tables_in_db
 
-    def id_for_artist(self, artist_name: str):
-        pass
+    def id_for_artist(self, artist_name: str) -> typing.Optional[str]:
+        if self.db_connection is not None:
+            sql = "SELECT artist_uid FROM artist WHERE artist_name = ?"
+            row = self.db_connection.execute(sql, [artist_name]).fetchone()
+            if row is not None:
+                return row[0]
+        return None
 
-    def id_for_album(self, artist_name: str, album_name: str):
-        pass
+    def id_for_album(self, artist_name: str, album_name: str) -> typing.Optional[str]:
+        if self.db_connection is not None:
+            sql = "SELECT album.album_uid " + \
+                  "FROM album, artist " + \
+                  "WHERE album.artist_uid = artist.artist_uid " + \
+                  "AND artist.artist_name = ? AND album.album_name = ?"
+            row = self.db_connection.execute(sql, [artist_name, album_name]).fetchone()
+            if row is not None:
+                return row[0]
+        return None
 
-    def insert_artist(self, artist_name: str):
-        pass
+    def insert_artist(self, artist_name: str) -> typing.Optional[str]:
+        # returns the uid of the artist, adding the artist if it's new. uids
+        # are derived from the name so that every replica of the catalog
+        # agrees on them
+        artist_uid = None
+        if self.db_connection is not None and artist_name is not None and len(artist_name) > 0:
+            artist_uid = jb_utils.encode_value(artist_name)
+            sql = "INSERT OR IGNORE INTO artist VALUES (?,?,?)"
+            args = [artist_uid, artist_name, None]
+            try:
+                self.db_connection.execute(sql, args)
+                self.db_connection.commit()
+                self.record_change(sql, args)
+            except sqlite3.Error as e:
+                logging.error("error inserting artist: " + e.args[0])
+                artist_uid = None
+        return artist_uid
 
-    def insert_album(self, album_name: str, artist_id: str):
-        pass
+    def insert_album(self, album_name: str, artist_id: str) -> typing.Optional[str]:
+        # returns the uid of the album, adding the album if it's new
+        album_uid = None
+        if self.db_connection is not None and album_name is not None and len(album_name) > 0:
+            album_uid = artist_id + jb_utils.DOUBLE_DASHES + jb_utils.encode_value(album_name)
+            sql = "INSERT OR IGNORE INTO album VALUES (?,?,?,?,?)"
+            args = [album_uid, album_name, None, artist_id, None]
+            try:
+                self.db_connection.execute(sql, args)
+                self.db_connection.commit()
+                self.record_change(sql, args)
+            except sqlite3.Error as e:
+                logging.error("error inserting album: " + e.args[0])
+                album_uid = None
+        return album_uid
 
-    def albums_for_artist(self, artist_id: str):
-        pass
+    def store_album(self, artist_name: str, album_name: str, track_objects: List[str]) -> bool:
+        # adds the album (and its artist) if needed and replaces its track
+        # list, all in one transaction
+        stored = False
+        if self.db_connection is None:
+            return stored
 
-    def get_artists(self):
-        pass
+        artist_uid = jb_utils.encode_value(artist_name)
+        album_uid = artist_uid + jb_utils.DOUBLE_DASHES + jb_utils.encode_value(album_name)
+        changes = [("INSERT OR IGNORE INTO artist VALUES (?,?,?)", [artist_uid, artist_name, None]),
+                   ("INSERT OR IGNORE INTO album VALUES (?,?,?,?,?)", [album_uid, album_name, None, artist_uid, None]),
+                   ("DELETE FROM album_track WHERE album_uid = ?", [album_uid])]
+        track_sql = "INSERT INTO album_track VALUES (?,?,?)"
+        track_rows = [[album_uid, track_number, track_object]
+                      for track_number, track_object in enumerate(track_objects, 1)]
+        try:
+            for sql, args in changes:
+                self.db_connection.execute(sql, args)
+            self.db_connection.executemany(track_sql, track_rows)
+            self.db_connection.commit()
+            for sql, args in changes:
+                self.record_change(sql, args)
+            self.record_changes(track_sql, track_rows)
+            stored = True
+        except sqlite3.Error as e:
+            self.db_connection.rollback()
+            logging.error("error storing album: " + e.args[0])
+        return stored
 
-    def songs_for_album(self, album_id: str):
-        pass
+    def albums_for_artist(self, artist_id: str) -> List[str]:
+        album_names = []
+        if self.db_connection is not None:
+            sql = "SELECT album_name FROM album WHERE artist_uid = ? ORDER BY album_name"
+            for row in self.db_connection.execute(sql, [artist_id]):
+                album_names.append(row[0])
+        return album_names
+
+    def get_artists(self) -> List[str]:
+        artist_names = []
+        if self.db_connection is not None:
+            sql = "SELECT artist_name FROM artist ORDER BY artist_name"
+            for row in self.db_connection.execute(sql):
+                artist_names.append(row[0])
+        return artist_names
+
+    def get_album_tracks(self, album_id: str) -> List[str]:
+        # object names (without file extension) of the album's tracks, in order
+        track_objects = []
+        if self.db_connection is not None:
+            sql = "SELECT track_object FROM album_track WHERE album_uid = ? ORDER BY track_number"
+            for row in self.db_connection.execute(sql, [album_id]):
+                track_objects.append(row[0])
+        return track_objects
+
+    def songs_for_album(self, album_id: str) -> List[song_metadata.SongMetadata]:
+        # the album's songs in track order, skipping tracks with no song
+        album_songs = self.retrieve_songs_for_base_names(self.get_album_tracks(album_id))
+        return [song for song in album_songs if song is not None]
 
     def get_playlists(self):
         pass
@@ -185,23 +570,7 @@ class JukeboxDB:
         else:
             db_results = db_cursor.execute(sql)
         for row in db_results:
-            song = SongMetadata()
-            song.fm = FileMetadata()
-            song.fm.file_uid = row[0]
-            song.fm.file_time = row[1]
-            song.fm.origin_file_size = row[2]
-            song.fm.stored_file_size = row[3]
-            song.fm.pad_char_count = row[4]
-            song.artist_name = row[5]
-            song.artist_uid = row[6]
-            song.song_name = row[7]
-            song.fm.md5_hash = row[8]
-            song.fm.compressed = row[9]
-            song.fm.encrypted = row[10]
-            song.fm.container_name = row[11]
-            song.fm.object_name = row[12]
-            song.album_uid = row[13]
-            result_songs.append(song)
+            result_songs.append(song_for_row(row))
         return result_songs
 
     def retrieve_song(self, file_name: str):
@@ -226,6 +595,109 @@ class JukeboxDB:
                 return song_results[0]
         return None
 
+    def retrieve_songs_for_base_names(self,
+                                      base_object_names: List[str],
+                                      ext_list: List[str] = None) -> List[typing.Optional[SongMetadata]]:
+        # resolves song object names without their file extension (as
+        # stored in playlists and albums) with a single query. when a song
+        # is stored in more than one format, the first extension in ext_list
+        # wins. the returned list lines up with base_object_names, with None
+        # for each name that has no song
+        if ext_list is None:
+            ext_list = SONG_FILE_EXTENSIONS
+        resolved_songs: List[typing.Optional[SongMetadata]] = [None] * len(base_object_names)
+        if self.db_connection is None or not base_object_names:
+            return resolved_songs
+
+        # every (name, extension) pair is looked up by song_uid. SQLite takes
+        # the bare columns of an aggregate query from the row holding the
+        # MIN(), which here is the preferred extension
+        sql = """SELECT %s,
+                  wanted.key,
+                  MIN(ext.key)
+                  FROM json_each(?) AS wanted
+                  CROSS JOIN json_each(?) AS ext
+                  JOIN song ON song.song_uid = wanted.value || ext.value
+                  GROUP BY wanted.key""" % SONG_COLUMNS
+        db_cursor = self.db_connection.cursor()
+        try:
+            db_results = db_cursor.execute(sql, [json.dumps(base_object_names), json.dumps(ext_list)])
+            for row in db_results:
+                resolved_songs[row[14]] = song_for_row(row)
+        except sqlite3.OperationalError:
+            # SQLite built without the JSON functions
+            for i, base_object_name in enumerate(base_object_names):
+                for ext in ext_list:
+                    db_song = self.retrieve_song(base_object_name + ext)
+                    if db_song is not None:
+                        resolved_songs[i] = db_song
+                        break
+        return resolved_songs
+
+    @staticmethod
+    def search_query(search_text: str) -> str:
+        # turns what the user typed into an FTS5 query that matches songs
+        # containing every word (or a word starting with it) in any of the
+        # artist, album and song names. words are quoted so that FTS5
+        # operators and punctuation in them are taken literally
+        terms = []
+        for word in search_text.split():
+            word = word.replace('"', '""')
+            terms.append('"%s"*' % word)
+        return " ".join(terms)
+
+    def search(self, search_text: str, limit: int = 50) -> List[song_metadata.SongMetadata]:
+        # songs whose artist, album or song names match the search text,
+        # best matches (by bm25) first
+        if not self.search_index_available:
+            return self.search_without_index(search_text, limit)
+        songs = []
+        query = self.search_query(search_text)
+        if self.db_connection is not None and len(query) > 0:
+            sql = "SELECT %s FROM song JOIN " % SONG_COLUMNS
+            sql += "(SELECT song_fts_map.song_uid AS match_uid, song_fts.rank AS rank FROM song_fts " \
+                   "JOIN song_fts_map ON song_fts_map.fts_rowid = song_fts.rowid WHERE song_fts MATCH ?) " \
+                   "ON song.song_uid = match_uid"
+            sql += self.sql_where_clause()
+            sql += " ORDER BY rank LIMIT ?"
+            try:
+                songs = self.songs_for_query(sql, [query, limit])
+            except sqlite3.Error as e:
+                logging.error("error searching songs: " + e.args[0])
+        return songs
+
+    def search_without_index(self, search_text: str, limit: int = 50) -> List[song_metadata.SongMetadata]:
+        # search for when there's no full-text index: every word has to
+        # appear somewhere in the artist name, song name or song_uid (which
+        # holds the album name). this scans the song table and can't rank
+        words = search_text.split()
+        songs = []
+        if self.db_connection is not None and len(words) > 0:
+            sql = "SELECT %s FROM song" % SONG_COLUMNS
+            sql += self.sql_where_clause()
+            query_args = []
+            for word in words:
+                sql += " AND lower(artist_name || ' ' || song_name || ' ' || song_uid) LIKE ? ESCAPE '\\'"
+                word = word.lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+                query_args.append("%" + word + "%")
+            sql += " ORDER BY artist_name, song_name LIMIT ?"
+            query_args.append(limit)
+            try:
+                songs = self.songs_for_query(sql, query_args)
+            except sqlite3.Error as e:
+                logging.error("error searching songs: " + e.args[0])
+        return songs
+
+    def retrieve_song_md5_hashes(self) -> Dict[str, str]:
+        # map of song_uid to md5 hash for every song in the catalog
+        song_hashes: Dict[str, str] = {}
+        if self.db_connection is not None:
+            sql = "SELECT song_uid, md5_hash FROM song"
+            cursor = self.db_connection.cursor()
+            for row in cursor.execute(sql):
+                song_hashes[row[0]] = row[1]
+        return song_hashes
+
     def insert_playlist(self, pl_uid: str, pl_name: str, pl_desc: str = "") -> bool:
         insert_success = False
 
@@ -238,6 +710,7 @@ class JukeboxDB:
                 cursor.execute(sql,
                                [pl_uid, pl_name, pl_desc])
                 self.db_connection.commit()
+                self.record_change(sql, [pl_uid, pl_name, pl_desc])
                 insert_success = True
             except sqlite3.Error as e:
                 logging.error("error inserting playlist: " + e.args[0])
@@ -256,6 +729,7 @@ class JukeboxDB:
             try:
                 cursor.execute(sql, [pl_name])
                 self.db_connection.commit()
+                self.record_change(sql, [pl_name])
                 delete_success = True
             except sqlite3.Error as e:
                 logging.error("error deleting playlist: " + e.args[0])
@@ -269,22 +743,25 @@ class JukeboxDB:
             sql = "INSERT INTO song VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)"
             cursor = self.db_connection.cursor()
             try:
-                cursor.execute(sql,
-                               [song.fm.file_uid,
-                                song.fm.file_time,
-                                song.fm.origin_file_size,
-                                song.fm.stored_file_size,
-                                song.fm.pad_char_count,
-                                song.artist_name,
-                                "",
-                                song.song_name,
-                                song.fm.md5_hash,
-                                song.fm.compressed,
-                                song.fm.encrypted,
-                                song.fm.container_name,
-                                song.fm.object_name,
-                                song.album_uid])
+                song_args = [
+                    song.fm.file_uid,
+                    song.fm.file_time,
+                    song.fm.origin_file_size,
+                    song.fm.stored_file_size,
+                    song.fm.pad_char_count,
+                    song.artist_name,
+                    song.artist_uid,
+                    song.song_name,
+                    song.fm.md5_hash,
+                    song.fm.compressed,
+                    song.fm.encrypted,
+                    song.fm.container_name,
+                    song.fm.object_name,
+                    song.album_uid
+                ]
+                cursor.execute(sql, song_args)
                 self.db_connection.commit()
+                self.record_change(sql, song_args)
                 insert_success = True
             except sqlite3.Error as e:
                 logging.error("error inserting song: " + e.args[0])
@@ -311,37 +788,160 @@ class JukeboxDB:
             cursor = self.db_connection.cursor()
 
             try:
-                cursor.execute(sql, [song.fm.file_time,
-                                     song.fm.origin_file_size,
-                                     song.fm.stored_file_size,
-                                     song.fm.pad_char_count,
-                                     song.artist_name,
-                                     "",
-                                     song.song_name,
-                                     song.fm.md5_hash,
-                                     song.fm.compressed,
-                                     song.fm.encrypted,
-                                     song.fm.container_name,
-                                     song.fm.object_name,
-                                     song.album_uid,
-                                     song.fm.file_uid])
+                song_args = [
+                    song.fm.file_time,
+                    song.fm.origin_file_size,
+                    song.fm.stored_file_size,
+                    song.fm.pad_char_count,
+                    song.artist_name,
+                    song.artist_uid,
+                    song.song_name,
+                    song.fm.md5_hash,
+                    song.fm.compressed,
+                    song.fm.encrypted,
+                    song.fm.container_name,
+                    song.fm.object_name,
+                    song.album_uid,
+                    song.fm.file_uid
+                ]
+                cursor.execute(sql, song_args)
                 self.db_connection.commit()
+                self.record_change(sql, song_args)
                 update_success = True
             except sqlite3.Error as e:
                 logging.error("error updating song: " + e.args[0])
 
         return update_success
 
+    def insert_artists_albums(self, cursor, songs: List[song_metadata.SongMetadata]) -> list:
+        # adds the artist and album rows that the songs refer to, as part of
+        # the caller's transaction. the album name is decoded from the album
+        # uid ('the-artist--the-album'). returns the (sql, rows) changes made
+        artist_rows = {}
+        album_rows = {}
+        for song in songs:
+            if song.artist_uid and song.artist_uid not in artist_rows:
+                artist_rows[song.artist_uid] = [song.artist_uid, song.artist_name, None]
+            if song.artist_uid and song.album_uid and song.album_uid not in album_rows:
+                album_name = jb_utils.decode_value(song.album_uid.split(jb_utils.DOUBLE_DASHES)[-1])
+                album_rows[song.album_uid] = [song.album_uid, album_name, None, song.artist_uid, None]
+
+        changes = []
+        if artist_rows:
+            sql = "INSERT OR IGNORE INTO artist VALUES (?,?,?)"
+            cursor.executemany(sql, list(artist_rows.values()))
+            changes.append((sql, list(artist_rows.values())))
+        if album_rows:
+            sql = "INSERT OR IGNORE INTO album VALUES (?,?,?,?,?)"
+            cursor.executemany(sql, list(album_rows.values()))
+            changes.append((sql, list(album_rows.values())))
+        return changes
+
+    def songs_are_linked(self) -> bool:
+        # True if every song refers to its artist and album rows, so that
+        # artist and album filters can use them
+        if self.db_connection is not None:
+            sql = "SELECT 1 FROM song " + \
+                  "WHERE artist_uid IS NULL OR artist_uid = '' OR album_uid IS NULL OR album_uid = '' " + \
+                  "LIMIT 1"
+            return self.db_connection.execute(sql).fetchone() is None
+        return False
+
+    def retrieve_unlinked_songs(self) -> List[song_metadata.SongMetadata]:
+        songs = []
+        if self.db_connection is not None:
+            sql = "SELECT %s FROM song " % SONG_COLUMNS + \
+                  "WHERE artist_uid IS NULL OR artist_uid = '' OR album_uid IS NULL OR album_uid = ''"
+            songs = self.songs_for_query(sql)
+        return songs
+
+    def link_songs(self, songs: List[song_metadata.SongMetadata]) -> bool:
+        # stores the artist_uid and album_uid of existing songs, adding the
+        # artist and album rows they refer to, in a single transaction
+        link_success = False
+        if self.db_connection is not None and songs:
+            sql = "UPDATE song SET artist_uid = ?, album_uid = ? WHERE song_uid = ?"
+            song_rows = [[song.artist_uid, song.album_uid, song.fm.file_uid] for song in songs]
+            cursor = self.db_connection.cursor()
+            try:
+                artist_album_changes = self.insert_artists_albums(cursor, songs)
+                cursor.executemany(sql, song_rows)
+                self.db_connection.commit()
+                for change_sql, change_rows in artist_album_changes:
+                    self.record_changes(change_sql, change_rows)
+                self.record_changes(sql, song_rows)
+                link_success = True
+            except sqlite3.Error as e:
+                self.db_connection.rollback()
+                logging.error("error linking songs: " + e.args[0])
+        return link_success
+
+    def upsert_songs(self, songs: List[song_metadata.SongMetadata]) -> bool:
+        # inserts new songs and updates existing ones in a single transaction.
+        # either all of the songs are stored or none of them are.
+        upsert_success = False
+
+        if self.db_connection is not None and songs is not None:
+            sql = """INSERT INTO song (song_uid,
+                  file_time,
+                  origin_file_size,
+                  stored_file_size,
+                  pad_char_count,
+                  artist_name,
+                  artist_uid,
+                  song_name,
+                  md5_hash,
+                  compressed,
+                  encrypted,
+                  container_name,
+                  object_name,
+                  album_uid) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+                  ON CONFLICT(song_uid) DO UPDATE SET file_time=excluded.file_time,
+                  origin_file_size=excluded.origin_file_size,
+                  stored_file_size=excluded.stored_file_size,
+                  pad_char_count=excluded.pad_char_count,
+                  artist_name=excluded.artist_name,
+                  artist_uid=excluded.artist_uid,
+                  song_name=excluded.song_name,
+                  md5_hash=excluded.md5_hash,
+                  compressed=excluded.compressed,
+                  encrypted=excluded.encrypted,
+                  container_name=excluded.container_name,
+                  object_name=excluded.object_name,
+                  album_uid=excluded.album_uid"""
+            song_rows = []
+            for song in songs:
+                song_rows.append([song.fm.file_uid,
+                                  song.fm.file_time,
+                                  song.fm.origin_file_size,
+                                  song.fm.stored_file_size,
+                                  song.fm.pad_char_count,
+                                  song.artist_name,
+                                  song.artist_uid,
+                                  song.song_name,
+                                  song.fm.md5_hash,
+                                  song.fm.compressed,
+                                  song.fm.encrypted,
+                                  song.fm.container_name,
+                                  song.fm.object_name,
+                                  song.album_uid])
+            cursor = self.db_connection.cursor()
+            try:
+                artist_album_changes = self.insert_artists_albums(cursor, songs)
+                cursor.executemany(sql, song_rows)
+                self.db_connection.commit()
+                for change_sql, change_rows in artist_album_changes:
+                    self.record_changes(change_sql, change_rows)
+                self.record_changes(sql, song_rows)
+                upsert_success = True
+            except sqlite3.Error as e:
+                self.db_connection.rollback()
+                logging.error("error storing songs: " + e.args[0])
+
+        return upsert_success
+
     def store_song_metadata(self, song: song_metadata.SongMetadata) -> bool:
-        db_song = self.retrieve_song(song.fm.file_uid)
-        if db_song is not None:
-            if song != db_song:
-                return self.update_song(song)
-            else:
-                return True  # no insert or update needed (already up-to-date)
-        else:
-            # song is not in the database, insert it
-            return self.insert_song(song)
+        return self.upsert_songs([song])
 
     @staticmethod
     def sql_where_clause(using_encryption: bool = False, using_compression: bool = False) -> str:
@@ -382,47 +982,43 @@ class JukeboxDB:
                   object_name,
                   album_uid FROM song"""
             sql += self.sql_where_clause()
-            if len(artist) > 0:
-                encoded_artist = jb_utils.encode_value(artist)
+            if len(artist) > 0 and self.songs_are_linked():
+                # indexed equality lookups on the song's artist or album
+                query_args = []
                 if len(album) > 0:
-                    encoded_album = jb_utils.encode_value(album)
-                    if len(file_format) > 0:
-                        added_clause = " AND song_uid LIKE '%s--%s%%.%s'" % (encoded_artist, encoded_album, file_format)
-                    else:
-                        added_clause = " AND song_uid LIKE '%s--%s%%'" % (encoded_artist, encoded_album)
+                    sql += " AND album_uid = ?"
+                    query_args.append(jb_utils.encode_artist_album(artist, album))
                 else:
-                    if len(file_format) > 0:
-                        added_clause = " AND song_uid LIKE '%s--%%.%s'" % (encoded_artist, file_format)
-                    else:
-                        added_clause = " AND song_uid LIKE '%s--%%'" % encoded_artist
-                sql += added_clause
-            else:
+                    sql += " AND artist_uid = ?"
+                    query_args.append(jb_utils.encode_value(artist))
                 if len(file_format) > 0:
-                    sql += " AND song_uid LIKE '%%.%s'" % file_format
+                    sql += " AND song_uid LIKE ?"
+                    query_args.append("%%.%s" % file_format)
+                return self.songs_for_query(sql, query_args)
+            query_args = []
+            if len(artist) > 0:
+                # catalogs whose songs haven't been linked to artists and
+                # albums yet are filtered on the song_uid prefix, ignoring
+                # case as LIKE does
+                prefix = jb_utils.encode_value(artist) + jb_utils.DOUBLE_DASHES
+                if len(album) > 0:
+                    prefix += jb_utils.encode_value(album)
+                sql += " AND lower(song_uid) >= ? AND lower(song_uid) < ?"
+                query_args.extend(prefix_range(prefix.lower()))
+            if len(file_format) > 0:
+                sql += " AND song_uid LIKE ?"
+                query_args.append("%%.%s" % file_format)
 
-            songs = self.songs_for_query(sql)
+            songs = self.songs_for_query(sql, query_args)
         return songs
 
     def songs_for_artist(self, artist_name: str) -> List[song_metadata.SongMetadata]:
         songs: List[song_metadata.SongMetadata] = []
         if self.db_connection is not None:
-            sql = """SELECT song_uid,
-                  file_time,
-                  origin_file size,
-                  stored_file size,
-                  pad_char_count,
-                  artist_name,
-                  artist_uid,
-                  song_name,
-                  md5_hash,
-                  compressed,
-                  encrypted,
-                  container_name,
-                  object_name,
-                  album_uid FROM song"""
+            sql = "SELECT %s FROM song" % SONG_COLUMNS
             sql += self.sql_where_clause()
-            sql += " AND artist = ?"
-            songs = self.songs_for_query(sql, [artist_name])
+            sql += " AND artist_uid = ?"
+            songs = self.songs_for_query(sql, [jb_utils.encode_value(artist_name)])
         return songs
 
     def show_listings(self):
@@ -457,7 +1053,10 @@ class JukeboxDB:
                 print("%s" % genre_name)
 
     def show_artist_albums(self, artist_name: str):
-        pass
+        artist_uid = self.id_for_artist(artist_name)
+        if artist_uid is not None:
+            for album_name in self.albums_for_artist(artist_uid):
+                print("%s" % album_name)
 
     def show_albums(self):
         if self.db_connection is not None:
@@ -482,17 +1081,94 @@ class JukeboxDB:
                 pl_name = row[1]
                 print("%s - %s" % (pl_uid, pl_name))
 
-    def delete_song(self, song_uid: str) -> bool:
-        was_deleted = False
+    def album_uids_for_songs(self, cursor, song_uids: List[str]) -> List[str]:
+        # the albums the songs belong to. songs that haven't been linked to
+        # their album yet name it in their song_uid ('the-artist--the-album--...')
+        album_uids = []
+        for song_uid in song_uids:
+            row = cursor.execute("SELECT album_uid FROM song WHERE song_uid = ?", [song_uid]).fetchone()
+            if row is None:
+                continue
+            album_uid = row[0]
+            if not album_uid:
+                components = song_uid.split(jb_utils.DOUBLE_DASHES)
+                if len(components) != 3:
+                    continue
+                album_uid = jb_utils.DOUBLE_DASHES.join(components[:2])
+            if album_uid not in album_uids:
+                album_uids.append(album_uid)
+        return album_uids
+
+    def has_songs(self, cursor, uid_column: str, uid: str) -> bool:
+        # whether any song refers to the artist or album, either through
+        # uid_column or (when not linked yet) through its song_uid prefix
+        sql = "SELECT 1 FROM song WHERE %s = ? OR (song_uid >= ? AND song_uid < ?) LIMIT 1" % uid_column
+        args = [uid]
+        args.extend(prefix_range(uid + jb_utils.DOUBLE_DASHES))
+        return cursor.execute(sql, args).fetchone() is not None
+
+    def album_has_songs(self, album_uid: str) -> bool:
         if self.db_connection is not None:
-            if song_uid is not None and len(song_uid) > 0:
-                sql = "DELETE FROM song WHERE song_uid = ?"
-                cursor = self.db_connection.cursor()
-                try:
-                    cursor.execute(sql, [song_uid])
-                    self.db_connection.commit()
-                    was_deleted = True
-                except sqlite3.Error as e:
-                    logging.error("error deleting song: " + e.args[0])
+            return self.has_songs(self.db_connection.cursor(), "album_uid", album_uid)
+        return False
+
+    def delete_empty_albums(self, cursor, album_uids: List[str]) -> list:
+        # deletes the albums (and their track lists) that no song is left
+        # in, then the artists of those albums that have no album or song
+        # left, as part of the caller's transaction. returns the (sql, rows)
+        # changes made
+        album_rows = []
+        artist_uids = []
+        for album_uid in album_uids:
+            row = cursor.execute("SELECT artist_uid FROM album WHERE album_uid = ?", [album_uid]).fetchone()
+            if row is None or self.has_songs(cursor, "album_uid", album_uid):
+                continue
+            album_rows.append([album_uid])
+            if row[0] not in artist_uids:
+                artist_uids.append(row[0])
+
+        changes = []
+        if album_rows:
+            for sql in ["DELETE FROM album_track WHERE album_uid = ?",
+                        "DELETE FROM album WHERE album_uid = ?"]:
+                cursor.executemany(sql, album_rows)
+                changes.append((sql, album_rows))
+
+        artist_rows = []
+        for artist_uid in artist_uids:
+            row = cursor.execute("SELECT 1 FROM album WHERE artist_uid = ? LIMIT 1", [artist_uid]).fetchone()
+            if row is None and not self.has_songs(cursor, "artist_uid", artist_uid):
+                artist_rows.append([artist_uid])
+        if artist_rows:
+            sql = "DELETE FROM artist WHERE artist_uid = ?"
+            cursor.executemany(sql, artist_rows)
+            changes.append((sql, artist_rows))
+        return changes
+
+    def delete_songs(self, song_uids: List[str]) -> bool:
+        # deletes the songs in a single transaction, along with the albums
+        # and artists that are left without songs
+        was_deleted = False
+        if self.db_connection is not None and song_uids:
+            sql = "DELETE FROM song WHERE song_uid = ?"
+            rows = [[song_uid] for song_uid in song_uids]
+            cursor = self.db_connection.cursor()
+            try:
+                album_uids = self.album_uids_for_songs(cursor, song_uids)
+                cursor.executemany(sql, rows)
+                album_changes = self.delete_empty_albums(cursor, album_uids)
+                self.db_connection.commit()
+                self.record_changes(sql, rows)
+                for change_sql, change_rows in album_changes:
+                    self.record_changes(change_sql, change_rows)
+                was_deleted = True
+            except sqlite3.Error as e:
+                self.db_connection.rollback()
+                logging.error("error deleting songs: " + e.args[0])
 
         return was_deleted
+
+    def delete_song(self, song_uid: str) -> bool:
+        if song_uid is not None and len(song_uid) > 0:
+            return self.delete_songs([song_uid])
+        return False
@@ -3,6 +3,8 @@ import fs_storage_system
 import jukebox
 import minio_storage_system
 import s3
+import snapshot_codec
+import song_cache
 import storage_system
 import swift
 import sys
@@ -14,8 +16,19 @@ import utils
 
 ARG_PREFIX = "--"
 ARG_DEBUG = "debug"
+ARG_DOWNLOAD_WORKERS = "download-workers"
 ARG_FILE_CACHE_COUNT = "file-cache-count"
+ARG_HEDGE_AFTER_MS = "hedge-after-ms"
+ARG_IMPORT_WORKERS = "import-workers"
+ARG_FULL_IMPORT = "full-import"
 ARG_INTEGRITY_CHECKS = "integrity-checks"
+ARG_METADATA_DELTAS = "metadata-deltas"
+ARG_METADATA_COMPRESSION = "metadata-compression"
+ARG_PREFETCH_SECONDS = "prefetch-seconds"
+ARG_PREFETCH_MAX_MB = "prefetch-max-mb"
+ARG_SONG_CACHE_MB = "song-cache-mb"
+ARG_SONG_CACHE_POLICY = "song-cache-policy"
+ARG_STREAM_PLAYBACK = "stream-playback"
 ARG_STORAGE = "storage"
 ARG_ARTIST = "artist"
 ARG_PLAYLIST = "playlist"
@@ -23,7 +36,9 @@ ARG_SONG = "song"
 ARG_ALBUM = "album"
 ARG_COMMAND = "command"
 ARG_FORMAT = "format"
+ARG_QUERY = "query"
 
+CMD_BACKFILL_ALBUMS = "backfill-albums"
 CMD_DELETE_ALBUM = "delete-album"
 CMD_DELETE_ARTIST = "delete-artist"
 CMD_DELETE_PLAYLIST = "delete-playlist"
@@ -47,6 +62,7 @@ CMD_PLAY_ALBUM = "play-album"
 CMD_SHOW_ALBUM = "show-album"
 CMD_PLAY_PLAYLIST = "play-playlist"
 CMD_RETRIEVE_CATALOG = "retrieve-catalog"
+CMD_SEARCH = "search"
 CMD_SHOW_PLAYLIST = "show-playlist"
 CMD_SHUFFLE_PLAY = "shuffle-play"
 CMD_UPLOAD_METADATA_DB = "upload-metadata-db"
@@ -236,29 +252,43 @@ def connect_minio_system(credentials, in_debug_mode: bool, for_update: bool):
                                                        endpoint_url,
                                                        in_debug_mode)
 
+
+def connection_pool_size(options: jukebox_options.JukeboxOptions) -> int:
+    # enough connections for every transfer that can run at once: each import
+    # worker's upload may be split into concurrent parts, and during play the
+    # main thread downloads alongside the download workers
+    return max(storage_system.DEFAULT_MAX_CONNECTIONS,
+               options.import_workers * storage_system.MULTIPART_CONCURRENCY + 1,
+               options.download_workers + 2)
+
+
 def connect_storage_system(system_type: str, credentials, container_prefix: str,
-                           in_debug_mode: bool, for_update: bool):
+                           in_debug_mode: bool, for_update: bool,
+                           max_connections: int = storage_system.DEFAULT_MAX_CONNECTIONS):
+    storage_sys = None
     if system_type == SS_SWIFT:
-        return connect_swift_system(credentials, in_debug_mode, for_update)
+        storage_sys = connect_swift_system(credentials, in_debug_mode, for_update)
     elif system_type == SS_S3:
         if container_prefix is not None and len(container_prefix) > 0:
-            return connect_s3_system(credentials, in_debug_mode, for_update)
+            storage_sys = connect_s3_system(credentials, in_debug_mode, for_update)
         else:
             print("error: a container prefix MUST be specified for S3")
-            return None
     elif system_type == SS_MINIO:
-        return connect_minio_system(credentials, in_debug_mode, for_update)
+        storage_sys = connect_minio_system(credentials, in_debug_mode, for_update)
     elif system_type == SS_FS:
         if FS_ROOT_DIR in credentials:
             root_dir = credentials[FS_ROOT_DIR]
             if root_dir is not None and len(root_dir) > 0:
-                return fs_storage_system.FSStorageSystem(root_dir, in_debug_mode)
-    else:
-        return None
+                storage_sys = fs_storage_system.FSStorageSystem(root_dir, in_debug_mode)
+
+    if storage_sys is not None:
+        storage_sys.max_connections = max_connections
+    return storage_sys
 
 
 def show_usage():
     print('Supported Commands:')
+    print('\t%s    - link existing songs to their artist and album' % CMD_BACKFILL_ALBUMS)
     print('\t%s      - delete specified artist' % CMD_DELETE_ARTIST)
     print('\t%s       - delete specified album' % CMD_DELETE_ALBUM)
     print('\t%s    - delete specified playlist' % CMD_DELETE_PLAYLIST)
@@ -267,6 +297,7 @@ def show_usage():
     print('\t%s       - import all new songs from %s subdirectory' % (CMD_IMPORT_SONGS, jukebox.SONG_IMPORT_DIR))
     print('\t%s   - import all new playlists from %s subdirectory' % (CMD_IMPORT_PLAYLISTS, jukebox.PLAYLIST_IMPORT_DIR))
     print('\t%s   - import all album art from %s subdirectory' % (CMD_IMPORT_ALBUM_ART, jukebox.ALBUM_ART_IMPORT_DIR))
+    print('\t%s       - import album track lists from %s subdirectory' % (CMD_IMPORT_ALBUM, jukebox.ALBUM_IMPORT_DIR))
     print('\t%s         - show listing of all available songs' % CMD_LIST_SONGS)
     print('\t%s       - show listing of all available artists' % CMD_LIST_ARTISTS)
     print('\t%s    - show listing of all available storage containers' % CMD_LIST_CONTAINERS)
@@ -274,6 +305,7 @@ def show_usage():
     print('\t%s        - show listing of all available genres' % CMD_LIST_GENRES)
     print('\t%s     - show listing of all available playlists' % CMD_LIST_PLAYLISTS)
     print('\t%s      - show songs in specified playlist' % CMD_SHOW_PLAYLIST)
+    print('\t%s             - search artist, album and song names for specified query' % CMD_SEARCH)
     print('\t%s               - start playing songs' % CMD_PLAY)
     print('\t%s       - play songs randomly' % CMD_SHUFFLE_PLAY)
     print('\t%s      - play specified playlist' % CMD_PLAY_PLAYLIST)
@@ -304,18 +336,42 @@ def main():
     song = ""
     album = ""
     file_format = ""
+    query = None
 
     opt_parser = argparse.ArgumentParser()
     opt_parser.add_argument(ARG_PREFIX + ARG_DEBUG, action="store_true", help="run in debug mode")
+    opt_parser.add_argument(ARG_PREFIX + ARG_DOWNLOAD_WORKERS, type=int,
+                            help="number of songs to download concurrently during play")
     opt_parser.add_argument(ARG_PREFIX + ARG_FILE_CACHE_COUNT, type=int, help="number of songs to buffer in cache")
+    opt_parser.add_argument(ARG_PREFIX + ARG_HEDGE_AFTER_MS, type=int,
+                            help="send a second request for the next song if the first hasn't responded after this many ms")
+    opt_parser.add_argument(ARG_PREFIX + ARG_IMPORT_WORKERS, type=int,
+                            help="number of songs to hash and upload concurrently during import")
+    opt_parser.add_argument(ARG_PREFIX + ARG_FULL_IMPORT, action="store_true",
+                            help="re-hash and re-upload song files that appear unchanged since the last import")
     opt_parser.add_argument(ARG_PREFIX + ARG_INTEGRITY_CHECKS, action="store_true",
                             help="check file integrity after download")
+    opt_parser.add_argument(ARG_PREFIX + ARG_METADATA_DELTAS, action="store_true",
+                            help="sync metadata changes as small delta objects instead of whole db uploads")
+    opt_parser.add_argument(ARG_PREFIX + ARG_METADATA_COMPRESSION, type=str,
+                            help="compression for uploaded metadata db (%s)" % ", ".join(snapshot_codec.supported_codecs()))
+    opt_parser.add_argument(ARG_PREFIX + ARG_PREFETCH_SECONDS, type=int,
+                            help="seconds of upcoming playback to keep downloaded (0 disables)")
+    opt_parser.add_argument(ARG_PREFIX + ARG_PREFETCH_MAX_MB, type=int,
+                            help="maximum MB of upcoming songs to keep downloaded")
+    opt_parser.add_argument(ARG_PREFIX + ARG_SONG_CACHE_MB, type=int,
+                            help="size in MB of local cache of played songs (0 disables)")
+    opt_parser.add_argument(ARG_PREFIX + ARG_SONG_CACHE_POLICY, type=str,
+                            help="song cache eviction policy (%s)" % ", ".join(song_cache.CACHE_POLICIES))
+    opt_parser.add_argument(ARG_PREFIX + ARG_STREAM_PLAYBACK, action="store_true",
+                            help="start playing songs while they are being downloaded")
     opt_parser.add_argument(ARG_PREFIX + ARG_STORAGE, help="storage system type (%s, %s, %s)" % (SS_S3, SS_SWIFT, SS_FS))
     opt_parser.add_argument(ARG_PREFIX + ARG_ARTIST, type=str, help="limit operations to specified artist")
     opt_parser.add_argument(ARG_PREFIX + ARG_PLAYLIST, type=str, help="limit operations to specified playlist")
     opt_parser.add_argument(ARG_PREFIX + ARG_SONG, type=str, help="limit operations to specified song")
     opt_parser.add_argument(ARG_PREFIX + ARG_ALBUM, type=str, help="limit operations to specified album")
     opt_parser.add_argument(ARG_PREFIX + ARG_FORMAT, type=str, help="restrict play to specified audio file format")
+    opt_parser.add_argument(ARG_PREFIX + ARG_QUERY, type=str, help="words to search for")
     opt_parser.add_argument("command", help="command for jukebox")
     args = opt_parser.parse_args()
     if args is None:
@@ -327,16 +383,79 @@ def main():
         debug_mode = True
         options.debug_mode = True
 
+    if args.download_workers is not None:
+        if debug_mode:
+            print("setting download workers=" + repr(args.download_workers))
+        options.download_workers = args.download_workers
+
     if args.file_cache_count is not None and args.file_cache_count > 0:
         if debug_mode:
             print("setting file cache count=" + repr(args.file_cache_count))
         options.file_cache_count = args.file_cache_count
 
+    if args.hedge_after_ms is not None:
+        if debug_mode:
+            print("setting hedge after ms=" + repr(args.hedge_after_ms))
+        options.hedge_after_ms = args.hedge_after_ms
+
+    if args.import_workers is not None:
+        if debug_mode:
+            print("setting import workers=" + repr(args.import_workers))
+        options.import_workers = args.import_workers
+
+    if args.full_import:
+        if debug_mode:
+            print("setting full import on")
+        options.incremental_import = False
+
     if args.integrity_checks:
         if debug_mode:
             print("setting integrity checks on")
         options.check_data_integrity = True
 
+    if args.metadata_deltas:
+        if debug_mode:
+            print("setting metadata deltas on")
+        options.metadata_deltas = True
+
+    if args.metadata_compression is not None:
+        if args.metadata_compression not in snapshot_codec.supported_codecs():
+            print("error: invalid metadata compression '%s'" % args.metadata_compression)
+            print("supported compression types are: %s" % ",".join(snapshot_codec.supported_codecs()))
+            sys.exit(1)
+        if debug_mode:
+            print("setting metadata compression to '%s'" % args.metadata_compression)
+        options.metadata_compression = args.metadata_compression
+
+    if args.prefetch_seconds is not None:
+        if debug_mode:
+            print("setting prefetch seconds=" + repr(args.prefetch_seconds))
+        options.prefetch_seconds = args.prefetch_seconds
+
+    if args.prefetch_max_mb is not None:
+        if debug_mode:
+            print("setting prefetch max=" + repr(args.prefetch_max_mb) + " MB")
+        options.prefetch_max_mb = args.prefetch_max_mb
+
+    if args.song_cache_mb is not None:
+        if debug_mode:
+            print("setting song cache size=" + repr(args.song_cache_mb) + " MB")
+        options.song_cache_size_mb = args.song_cache_mb
+
+    if args.song_cache_policy is not None:
+        if args.song_cache_policy not in song_cache.CACHE_POLICIES:
+            print("error: invalid song cache policy '%s'" % args.song_cache_policy)
+            print("supported song cache policies are: %s" % ",".join(song_cache.CACHE_POLICIES))
+            sys.exit(1)
+        if debug_mode:
+            print("setting song cache policy to '%s'" % args.song_cache_policy)
+        options.song_cache_policy = args.song_cache_policy
+
+    if args.stream_playback:
+        if debug_mode:
+            print("setting stream playback on")
+        options.stream_playback = True
+
     if args.storage is not None:
         supported_systems = (SS_SWIFT, SS_S3, SS_MINIO, SS_FS)
         if args.storage not in supported_systems:
@@ -360,6 +479,9 @@ def main():
     if args.album is not None:
         album = args.album
 
+    if args.query is not None:
+        query = args.query
+
     if args.format is not None:
         file_format = args.format
         if file_format.startswith("."):
@@ -412,10 +534,12 @@ def main():
                          CMD_LIST_PLAYLISTS, CMD_SHOW_PLAYLIST, CMD_PLAY_PLAYLIST,
                          CMD_DELETE_SONG, CMD_DELETE_ALBUM, CMD_DELETE_PLAYLIST,
                          CMD_DELETE_ARTIST, CMD_UPLOAD_METADATA_DB, CMD_INIT_STORAGE,
-                         CMD_IMPORT_ALBUM_ART, CMD_PLAY_ALBUM, CMD_SHOW_ALBUM]
+                         CMD_IMPORT_ALBUM_ART, CMD_PLAY_ALBUM, CMD_SHOW_ALBUM, CMD_IMPORT_ALBUM,
+                         CMD_BACKFILL_ALBUMS, CMD_SEARCH]
         update_cmds = [CMD_IMPORT_SONGS, CMD_IMPORT_PLAYLISTS, CMD_DELETE_SONG,
                        CMD_DELETE_ALBUM, CMD_DELETE_PLAYLIST, CMD_DELETE_ARTIST,
-                       CMD_UPLOAD_METADATA_DB, CMD_IMPORT_ALBUM_ART, CMD_INIT_STORAGE]
+                       CMD_UPLOAD_METADATA_DB, CMD_IMPORT_ALBUM_ART, CMD_INIT_STORAGE,
+                       CMD_IMPORT_ALBUM, CMD_BACKFILL_ALBUMS]
         all_cmds = help_cmds + non_help_cmds
 
         if command not in all_cmds:
@@ -443,7 +567,8 @@ def main():
                                                 creds,
                                                 container_prefix,
                                                 debug_mode,
-                                                for_update) as storage_sys:
+                                                for_update,
+                                                connection_pool_size(options)) as storage_sys:
                         if command == CMD_INIT_STORAGE:
                             if init_storage_system(storage_sys, container_prefix):
                                 sys.exit(0)
@@ -478,6 +603,12 @@ def main():
                                 else:
                                     print("error: playlist must be specified using %s%s option" % (ARG_PREFIX, ARG_PLAYLIST))
                                     sys.exit(1)
+                            elif command == CMD_SEARCH:
+                                if query is not None:
+                                    the_jukebox.search(query)
+                                else:
+                                    print("error: search words must be specified using %s%s option" % (ARG_PREFIX, ARG_QUERY))
+                                    sys.exit(1)
                             elif command == CMD_PLAY_PLAYLIST:
                                 if playlist is not None:
                                     the_jukebox.play_playlist(playlist)
@@ -546,6 +677,10 @@ def main():
                                     sys.exit(1)
                             elif command == CMD_IMPORT_ALBUM_ART:
                                 the_jukebox.import_album_art()
+                            elif command == CMD_IMPORT_ALBUM:
+                                the_jukebox.import_albums()
+                            elif command == CMD_BACKFILL_ALBUMS:
+                                the_jukebox.link_songs_to_albums()
                 except requests.exceptions.ConnectionError:
                     print("Error: unable to connect to storage system server")
                     sys.exit(1)
@@ -4,8 +4,19 @@ class JukeboxOptions:
     def __init__(self):
         self.debug_mode = False
         self.check_data_integrity = False
+        self.download_workers = 2
         self.file_cache_count = 5
+        self.hedge_after_ms = 0
+        self.import_workers = 1
+        self.incremental_import = True
+        self.metadata_deltas = False
+        self.metadata_compression = "none"
         self.number_songs = 0
+        self.prefetch_seconds = 900
+        self.prefetch_max_mb = 500
+        self.song_cache_size_mb = 0
+        self.song_cache_policy = "lru"
+        self.stream_playback = False
         self.suppress_metadata_download = False
 
     def validate_options(self) -> bool:
@@ -13,8 +24,32 @@ class JukeboxOptions:
             print("error: file cache count must be non-negative integer value")
             return False
 
+        if self.download_workers < 1:
+            print("error: download workers must be positive integer value")
+            return False
+
+        if self.hedge_after_ms < 0:
+            print("error: hedge after ms must be non-negative integer value")
+            return False
+
+        if self.import_workers < 1:
+            print("error: import workers must be positive integer value")
+            return False
+
         if self.number_songs < 0:
             print("error: number songs must be non-negative integer value")
             return False
 
+        if self.prefetch_seconds < 0:
+            print("error: prefetch seconds must be non-negative integer value")
+            return False
+
+        if self.prefetch_max_mb < 0:
+            print("error: prefetch max MB must be non-negative integer value")
+            return False
+
+        if self.song_cache_size_mb < 0:
+            print("error: song cache size must be non-negative integer value")
+            return False
+
         return True
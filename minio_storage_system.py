@@ -1,9 +1,11 @@
 import io
 import os.path
+import socket
 import sys
 
-from typing import List
+from typing import Dict, List
 
+import storage_system
 from storage_system import StorageSystem
 import typing
 
@@ -13,15 +15,38 @@ _storage_system_minio_supported = False
 
 try:
     import minio
+    import minio.deleteobjects
+    import urllib3
     _storage_system_minio_supported = True
 except ImportError:
     _storage_system_minio_supported = False
 
 
+MINIO_CONNECT_TIMEOUT = 10
+MINIO_READ_TIMEOUT = 300
+
+
 def is_available():
     return _storage_system_minio_supported
 
 
+def iter_response_chunks(response, chunk_size: int):
+    # errors reading the response are raised as IOError. the connection is
+    # returned to the pool once the response is consumed or abandoned
+    try:
+        for chunk in response.stream(chunk_size):
+            yield chunk
+    except urllib3.exceptions.HTTPError as he:
+        raise IOError(repr(he))
+    finally:
+        response.close()
+        response.release_conn()
+
+
+# error codes that are returned when a request may succeed if sent again
+TRANSIENT_ERROR_CODES = ["RequestTimeout", "SlowDown", "InternalError", "ServiceUnavailable"]
+
+
 class MinioStorageSystem(StorageSystem):
 
     def __init__(self, access_key: str, secret_key: str,
@@ -31,6 +56,7 @@ class MinioStorageSystem(StorageSystem):
         self.access_key = access_key
         self.secret_key = secret_key
         self.endpoint_url = endpoint_url
+        self.http_client = None
         if self.debug_mode:
             print("Using access_key='%s', secret_key='%s', endpoint_url='%s'" % (self.access_key, self.secret_key, self.endpoint_url))
 
@@ -39,25 +65,43 @@ class MinioStorageSystem(StorageSystem):
             print("attempting to connect to Minio")
         quoted_endpoint_url = "'%s'" % self.endpoint_url
 
+        # the client is shared by all threads. its pool keeps up to
+        # max_connections connections alive for reuse
+        self.http_client = urllib3.PoolManager(
+            maxsize=self.max_connections,
+            block=True,
+            timeout=urllib3.Timeout(connect=MINIO_CONNECT_TIMEOUT, read=MINIO_READ_TIMEOUT),
+            socket_options=urllib3.connection.HTTPConnection.default_socket_options +
+            [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)])
         self.conn = minio.Minio(self.endpoint_url,
                                 access_key=self.access_key,
                                 secret_key=self.secret_key,
                                 secure=False,
-                                region="garage")
+                                region="garage",
+                                http_client=self.http_client)
         self.authenticated = True
         self.list_containers = self.list_account_containers()
 
         return self
 
     def __exit__(self, exception_type, exception_value, traceback):
+        self.shutdown_request_executor()
         if self.conn is not None:
             if self.debug_mode:
                 print("closing Minio connection object")
 
             self.authenticated = False
             self.list_containers = None
-            # self.conn.close()
             self.conn = None
+            self.http_client.clear()
+            self.http_client = None
+
+    def is_transient_error(self, error: Exception) -> bool:
+        if isinstance(error, minio.error.S3Error):
+            return error.code in TRANSIENT_ERROR_CODES
+        if isinstance(error, minio.error.ServerError):
+            return error.status_code >= 500
+        return isinstance(error, urllib3.exceptions.HTTPError) or StorageSystem.is_transient_error(self, error)
 
     def list_account_containers(self) -> typing.Optional[List[str]]:
         if self.debug_mode:
@@ -109,25 +153,22 @@ class MinioStorageSystem(StorageSystem):
 
         return container_deleted
 
-    def list_container_contents(self, container_name: str) -> typing.Optional[List[str]]:
+    def iter_container_contents(self, container_name: str, prefix: str = ""):
         if self.debug_mode:
-            print("list_container_contents: '%s'" % container_name)
+            print("iter_container_contents: '%s', prefix='%s'" % (container_name, prefix))
 
-        if self.conn is not None:
+        if self.conn is None or container_name is None:
+            return None
+
+        def object_names():
+            # list_objects requests the next page as the previous one is used up
             try:
-                objectsIterator = self.conn.list_objects(container_name)
-                list_contents = []
-                for obj in objectsIterator:
-                    list_contents.append(obj.object_name)
-
-                return list_contents
-            except Exception as exception:
-                print("exception caught: %s" % type(exception).__name__)
-            # except S3.Client.exceptions.NoSuchBucket:
-            #    print("bucket does not exist")
-            #    pass
+                for obj in self.conn.list_objects(container_name, prefix=prefix or None, recursive=True):
+                    yield obj.object_name
+            except (minio.error.S3Error, urllib3.exceptions.HTTPError) as e:
+                raise IOError(repr(e))
 
-        return None
+        return object_names()
 
     def get_object_metadata(self, container_name: str, object_name: str):
         if self.debug_mode:
@@ -135,7 +176,7 @@ class MinioStorageSystem(StorageSystem):
 
         if self.conn is not None and container_name is not None and object_name is not None:
             # try:
-                result = self.conn.stat_object(container_name, object_name)
+                result = self.with_retries(lambda: self.conn.stat_object(container_name, object_name))
                 dictMeta = {}
                 dictMeta['last_modified'] = result.last_modified
                 dictMeta['size'] = result.size
@@ -146,6 +187,21 @@ class MinioStorageSystem(StorageSystem):
 
         return None
 
+    def head_object(self, container_name: str, object_name: str) -> typing.Optional[Dict[str, object]]:
+        if self.debug_mode:
+            print("head_object: container='%s', object='%s'" % (container_name, object_name))
+
+        if self.conn is not None and container_name is not None and object_name is not None:
+            try:
+                result = self.conn.stat_object(container_name, object_name)
+                return {storage_system.OBJECT_ETAG: result.etag,
+                        storage_system.OBJECT_LAST_MODIFIED: str(result.last_modified),
+                        storage_system.OBJECT_SIZE: result.size}
+            except minio.error.S3Error:
+                pass
+
+        return None
+
     def put_object(self, container_name: str, object_name: str, file_contents, headers=None) -> bool:
 
         object_added = False
@@ -163,13 +219,9 @@ class MinioStorageSystem(StorageSystem):
                 else:
                     file_bytes = file_contents
 
-                try:
-                    object_data = io.BytesIO(file_bytes)
-                except Exception as e:
-                    print(f"exception: {e}")
-                    return False
-
-                obj_stat = self.conn.put_object(bucket, object_name, object_data, len(file_contents))
+                # each attempt reads the contents from the start
+                obj_stat = self.with_retries(
+                    lambda: self.conn.put_object(bucket, object_name, io.BytesIO(file_bytes), len(file_bytes)))
 
                 if obj_stat is not None:
                     object_added = True
@@ -187,6 +239,37 @@ class MinioStorageSystem(StorageSystem):
                 print("Exception ", sys.exc_info()[0], "occurred.")
                 pass
 
+        if object_added:
+            self.invalidate_container_listing(container_name)
+        return object_added
+
+    def put_object_stream(self, container_name: str, object_name: str, stream, content_length: int,
+                          headers=None) -> bool:
+        if self.debug_mode:
+            print("put_object_stream: container='%s', object='%s', length=%d" % (container_name,
+                                                                                   object_name,
+                                                                                   content_length))
+
+        object_added = False
+
+        if self.conn is not None and container_name is not None and \
+                object_name is not None and stream is not None:
+            try:
+                # minio reads the stream one part at a time. large objects
+                # are sent as a multipart upload with parts in parallel. the
+                # stream can't be read again, so the upload isn't retried
+                if content_length >= self.multipart_threshold:
+                    obj_stat = self.conn.put_object(container_name, object_name, stream, content_length,
+                                                    part_size=self.multipart_chunk_size,
+                                                    num_parallel_uploads=self.multipart_concurrency)
+                else:
+                    obj_stat = self.conn.put_object(container_name, object_name, stream, content_length)
+                object_added = obj_stat is not None
+            except (minio.error.S3Error, minio.error.ServerError) as me:
+                print(repr(me))
+
+        if object_added:
+            self.invalidate_container_listing(container_name)
         return object_added
 
     def delete_object(self, container_name: str, object_name: str) -> bool:
@@ -196,14 +279,40 @@ class MinioStorageSystem(StorageSystem):
         object_deleted = False
 
         if self.conn is not None and container_name is not None and object_name is not None:
-            # try:
-                self.conn.remove_object(container_name, object_name)
+            try:
+                self.with_retries(lambda: self.conn.remove_object(container_name, object_name))
                 object_deleted = True
-            # except boto.exception.S3ResponseError:
-            #    pass
+            except (minio.error.S3Error, minio.error.ServerError, urllib3.exceptions.HTTPError) as me:
+                print(repr(me))
 
+        if object_deleted:
+            self.invalidate_container_listing(container_name)
         return object_deleted
 
+    def delete_objects(self, container_name: str, object_names: List[str]) -> List[str]:
+        if self.debug_mode:
+            print("delete_objects: container='%s', %d objects" % (container_name, len(object_names)))
+
+        deleted_objects = []
+
+        if self.conn is not None and container_name is not None and object_names:
+            try:
+                # remove_objects sends the deletes in batches of 1000 as the
+                # returned errors are iterated, so it must be fully consumed
+                delete_list = [minio.deleteobjects.DeleteObject(object_name) for object_name in object_names]
+                failed_objects = set()
+                for error in self.conn.remove_objects(container_name, delete_list):
+                    print("error: unable to delete '%s': %s" % (error.name, error.message))
+                    failed_objects.add(error.name)
+                deleted_objects = [object_name for object_name in object_names
+                                   if object_name not in failed_objects]
+            except (minio.error.S3Error, minio.error.ServerError, urllib3.exceptions.HTTPError) as me:
+                print(repr(me))
+
+        if deleted_objects:
+            self.invalidate_container_listing(container_name)
+        return deleted_objects
+
     def get_object(self, container_name: str, object_name: str, local_file_path: str) -> int:
         if self.debug_mode:
             print("get_object: container='%s', object='%s', local_file_path='%s'" % (container_name,
@@ -215,9 +324,34 @@ class MinioStorageSystem(StorageSystem):
         if self.conn is not None and container_name is not None and \
                 object_name is not None and local_file_path is not None:
 
-            self.conn.fget_object(container_name, object_name, local_file_path)
-
-            if os.path.exists(local_file_path):
-                bytes_retrieved = os.path.getsize(local_file_path)
+            try:
+                self.with_retries(lambda: self.conn.fget_object(container_name, object_name, local_file_path))
+                if os.path.exists(local_file_path):
+                    bytes_retrieved = os.path.getsize(local_file_path)
+            except (minio.error.S3Error, minio.error.ServerError, urllib3.exceptions.HTTPError) as me:
+                print(repr(me))
 
         return bytes_retrieved
+
+    def get_object_chunks(self, container_name: str, object_name: str,
+                          chunk_size: int = storage_system.DOWNLOAD_CHUNK_SIZE,
+                          offset: int = 0,
+                          length: typing.Optional[int] = None):
+        if self.debug_mode:
+            print("get_object_chunks: container='%s', object='%s'" % (container_name, object_name))
+
+        if self.conn is not None and container_name is not None and object_name is not None:
+            # minio reads to the end of the object when length is 0, so an
+            # empty read is answered here and no length is passed as 0
+            if length == 0:
+                return storage_system.no_chunks()
+            try:
+                response = self.with_retries(
+                    lambda: self.conn.get_object(container_name, object_name,
+                                                 offset=offset,
+                                                 length=length if length is not None else 0))
+                return iter_response_chunks(response, chunk_size)
+            except (minio.error.S3Error, minio.error.ServerError, urllib3.exceptions.HTTPError) as me:
+                print(repr(me))
+
+        return None
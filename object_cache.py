@@ -0,0 +1,102 @@
+import json
+import logging
+import threading
+import typing
+
+from typing import Dict, Tuple
+
+import utils
+
+CACHE_INDEX_FILE_NAME = "cache_index.json"
+
+ENTRY_ETAG = "etag"
+ENTRY_VERSION = "version"
+
+
+# local cache of small objects (playlist and album json files) that are read
+# far more often than they change. each entry records the object's ETag and
+# the metadata version that was current when it was last validated; the
+# caller decides whether an entry is still good from those. cached objects
+# are kept in a subdirectory per container.
+class ObjectCache(object):
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        self.index_file_path = utils.path_join(cache_dir, CACHE_INDEX_FILE_NAME)
+        self.entries: Dict[str, Dict[str, object]] = {}
+        self.lock = threading.Lock()
+
+    def open(self) -> bool:
+        if not utils.directory_exists(self.cache_dir):
+            if not utils.create_directory(self.cache_dir):
+                logging.error("unable to create object cache directory %s" % self.cache_dir)
+                return False
+
+        entries = {}
+        if utils.file_exists(self.index_file_path):
+            file_contents = utils.file_read_all_text(self.index_file_path)
+            if file_contents is not None:
+                try:
+                    entries = json.loads(file_contents)
+                except ValueError:
+                    logging.error("object cache index is corrupt, ignoring it")
+
+        with self.lock:
+            self.entries = {}
+            for entry_key, entry in entries.items():
+                container_name, object_name = entry_key.split("/", 1)
+                if utils.file_exists(self.cached_file_path(container_name, object_name)):
+                    self.entries[entry_key] = entry
+        return True
+
+    def save(self) -> bool:
+        with self.lock:
+            index_contents = json.dumps(self.entries)
+        return utils.file_write_all_text(self.index_file_path, index_contents)
+
+    def cached_file_path(self, container_name: str, object_name: str) -> str:
+        return utils.path_join(utils.path_join(self.cache_dir, container_name), object_name)
+
+    def download_path(self, container_name: str, object_name: str) -> str:
+        # where a new copy of the object is downloaded before it's added
+        return self.cached_file_path(container_name, object_name) + ".download"
+
+    def prepare_container(self, container_name: str) -> bool:
+        container_dir = utils.path_join(self.cache_dir, container_name)
+        if not utils.directory_exists(container_dir):
+            return utils.create_directory(container_dir)
+        return True
+
+    def get(self, container_name: str, object_name: str) -> typing.Optional[Tuple[str, Dict[str, object]]]:
+        # returns the cached contents of the object and its entry
+        entry_key = "%s/%s" % (container_name, object_name)
+        with self.lock:
+            entry = self.entries.get(entry_key)
+            if entry is None:
+                return None
+            entry = dict(entry)
+        file_contents = utils.file_read_all_text(self.cached_file_path(container_name, object_name))
+        if file_contents is None:
+            self.remove(container_name, object_name)
+            return None
+        return file_contents, entry
+
+    def add(self, container_name: str, object_name: str, file_path: str, etag: typing.Optional[str],
+            version) -> bool:
+        # moves the downloaded object at file_path into the cache
+        if not utils.rename_file(file_path, self.cached_file_path(container_name, object_name)):
+            return False
+        self.set_version(container_name, object_name, etag, version)
+        return True
+
+    def set_version(self, container_name: str, object_name: str, etag: typing.Optional[str], version):
+        with self.lock:
+            self.entries["%s/%s" % (container_name, object_name)] = {ENTRY_ETAG: etag,
+                                                                     ENTRY_VERSION: version}
+
+    def remove(self, container_name: str, object_name: str):
+        with self.lock:
+            self.entries.pop("%s/%s" % (container_name, object_name), None)
+        file_path = self.cached_file_path(container_name, object_name)
+        if utils.file_exists(file_path):
+            utils.delete_file(file_path)
@@ -0,0 +1,65 @@
+import random
+import threading
+import time
+
+from typing import Dict
+
+DEFAULT_MAX_ATTEMPTS = 4
+DEFAULT_BASE_DELAY = 0.2
+DEFAULT_MAX_DELAY = 5.0
+
+# counters kept by RetryPolicy
+COUNTER_CALLS = "calls"
+COUNTER_RETRIES = "retries"
+COUNTER_FAILURES = "failures"
+COUNTER_HEDGED = "hedged"
+COUNTER_HEDGE_WINS = "hedge_wins"
+
+
+# retries storage operations that fail with transient errors (timeouts,
+# dropped connections, throttling, server errors), sleeping between attempts
+# for an exponentially growing delay with full jitter so that clients don't
+# retry in lockstep. operations that can't safely be repeated (e.g., uploads
+# from a stream that's already been consumed) are attempted only once.
+class RetryPolicy(object):
+    def __init__(self,
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+                 base_delay: float = DEFAULT_BASE_DELAY,
+                 max_delay: float = DEFAULT_MAX_DELAY):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.counters: Dict[str, int] = {COUNTER_CALLS: 0,
+                                         COUNTER_RETRIES: 0,
+                                         COUNTER_FAILURES: 0,
+                                         COUNTER_HEDGED: 0,
+                                         COUNTER_HEDGE_WINS: 0}
+        self.lock = threading.Lock()
+
+    def count(self, counter: str, amount: int = 1):
+        with self.lock:
+            self.counters[counter] += amount
+
+    def get_counters(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.counters)
+
+    def backoff_delay(self, attempt: int) -> float:
+        # delay before retrying after the given (1-based) attempt failed
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+
+    def call(self, func, is_transient_error, idempotent: bool = True):
+        # returns the result of func(), calling it again after a transient
+        # error. the last error is raised if every attempt fails
+        self.count(COUNTER_CALLS)
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return func()
+            except Exception as e:
+                if not idempotent or attempt >= self.max_attempts or not is_transient_error(e):
+                    self.count(COUNTER_FAILURES)
+                    raise
+                self.count(COUNTER_RETRIES)
+                time.sleep(self.backoff_delay(attempt))
@@ -1,8 +1,9 @@
 import os.path
 import sys
 
-from typing import List
+from typing import Dict, List
 
+import storage_system
 from storage_system import StorageSystem
 import typing
 
@@ -12,7 +13,9 @@ _storage_system_s3_supported = False
 
 try:
     import boto3
+    import boto3.s3.transfer
     import botocore
+    import botocore.config
     _storage_system_s3_supported = True
 except ImportError:
     _storage_system_s3_supported = False
@@ -22,6 +25,25 @@ def is_available():
     return _storage_system_s3_supported
 
 
+def iter_body_chunks(body, chunk_size: int):
+    # errors reading the response body are raised as IOError
+    try:
+        for chunk in body.iter_chunks(chunk_size):
+            yield chunk
+    except botocore.exceptions.BotoCoreError as bce:
+        raise IOError(repr(bce))
+    finally:
+        body.close()
+
+
+# most keys that a single DeleteObjects request may name
+DELETE_OBJECTS_BATCH_SIZE = 1000
+
+# error codes that S3 returns when a request may succeed if sent again
+TRANSIENT_ERROR_CODES = ["RequestTimeout", "SlowDown", "Throttling", "ThrottlingException",
+                         "InternalError", "ServiceUnavailable"]
+
+
 class S3StorageSystem(StorageSystem):
 
     def __init__(self, aws_access_key: str, aws_secret_key: str,
@@ -39,16 +61,23 @@ class S3StorageSystem(StorageSystem):
             print("attempting to connect to S3")
         quoted_endpoint_url = "'%s'" % self.endpoint_url
 
+        # the client is shared by all threads. its connection pool is sized so
+        # that concurrent transfers don't wait for (or discard) connections,
+        # and idle connections are kept alive for reuse
+        client_config = botocore.config.Config(max_pool_connections=self.max_connections,
+                                               tcp_keepalive=True)
         self.conn = boto3.client('s3',
                                  endpoint_url=quoted_endpoint_url,
                                  aws_access_key_id=self.aws_access_key,
-                                 aws_secret_access_key=self.aws_secret_key)
+                                 aws_secret_access_key=self.aws_secret_key,
+                                 config=client_config)
         self.authenticated = True
         self.list_containers = self.list_account_containers()
 
         return self
 
     def __exit__(self, exception_type, exception_value, traceback):
+        self.shutdown_request_executor()
         if self.conn is not None:
             if self.debug_mode:
                 print("closing S3 connection object")
@@ -58,6 +87,25 @@ class S3StorageSystem(StorageSystem):
             # self.conn.close()
             self.conn = None
 
+    def is_transient_error(self, error: Exception) -> bool:
+        if isinstance(error, botocore.exceptions.ClientError):
+            error_code = error.response.get('Error', {}).get('Code', '')
+            status_code = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+            return error_code in TRANSIENT_ERROR_CODES or status_code >= 500
+        if isinstance(error, boto3.exceptions.S3UploadFailedError):
+            # upload_file and upload_fileobj wrap the underlying error
+            return any(error_code in str(error) for error_code in TRANSIENT_ERROR_CODES)
+        return isinstance(error, (botocore.exceptions.ConnectionError,
+                                  botocore.exceptions.HTTPClientError)) or \
+            StorageSystem.is_transient_error(self, error)
+
+    def transfer_config(self):
+        # uploads at or above the multipart threshold are split into parts
+        # that are transferred concurrently
+        return boto3.s3.transfer.TransferConfig(multipart_threshold=self.multipart_threshold,
+                                                multipart_chunksize=self.multipart_chunk_size,
+                                                max_concurrency=self.multipart_concurrency)
+
     def list_account_containers(self) -> typing.Optional[List[str]]:
         if self.debug_mode:
             print("list_account_containers")
@@ -109,30 +157,26 @@ class S3StorageSystem(StorageSystem):
 
         return container_deleted
 
-    def list_container_contents(self, container_name: str) -> typing.Optional[List[str]]:
+    def iter_container_contents(self, container_name: str, prefix: str = ""):
         if self.debug_mode:
-            print("list_container_contents: '%s'" % container_name)
+            print("iter_container_contents: '%s', prefix='%s'" % (container_name, prefix))
 
-        if self.conn is not None:
+        if self.conn is None or container_name is None:
+            return None
+
+        # list_objects_v2 returns at most 1000 keys per call, so follow the
+        # continuation tokens through every page
+        paginator = self.conn.get_paginator('list_objects_v2')
+
+        def object_names():
             try:
-                response = self.conn.list_objects_v2(Bucket=container_name)
-                meta = response['ResponseMetadata']
-                status_code = meta['HTTPStatusCode']
-                if status_code == 200:
-                    list_contents = []
-                    contents = response['Contents']
-
-                    for objDict in contents:
-                        list_contents.append(objDict['Key'])
-
-                    return list_contents
-            except Exception as exception:
-                print("exception caught: %s" % type(exception).__name__)
-            # except S3.Client.exceptions.NoSuchBucket:
-            #    print("bucket does not exist")
-            #    pass
+                for page in paginator.paginate(Bucket=container_name, Prefix=prefix):
+                    for obj_dict in page.get('Contents', []):
+                        yield obj_dict['Key']
+            except (botocore.exceptions.ClientError, botocore.exceptions.BotoCoreError) as e:
+                raise IOError(repr(e))
 
-        return None
+        return object_names()
 
     def get_object_metadata(self, container_name: str, object_name: str):
         if self.debug_mode:
@@ -152,6 +196,22 @@ class S3StorageSystem(StorageSystem):
 
         return None
 
+    def head_object(self, container_name: str, object_name: str) -> typing.Optional[Dict[str, object]]:
+        if self.debug_mode:
+            print("head_object: container='%s', object='%s'" % (container_name, object_name))
+
+        if self.conn is not None and container_name is not None and object_name is not None:
+            try:
+                response = self.with_retries(
+                    lambda: self.conn.head_object(Bucket=container_name, Key=object_name))
+                return {storage_system.OBJECT_ETAG: response['ETag'],
+                        storage_system.OBJECT_LAST_MODIFIED: str(response['LastModified']),
+                        storage_system.OBJECT_SIZE: response['ContentLength']}
+            except botocore.exceptions.ClientError:
+                pass
+
+        return None
+
     def put_object(self, container_name: str, object_name: str, file_contents, headers=None) -> bool:
 
         object_added = False
@@ -164,7 +224,8 @@ class S3StorageSystem(StorageSystem):
 
             try:
                 bucket = container_name
-                result = self.conn.put_object(Body=file_contents, Bucket=bucket, Key=object_name)
+                result = self.with_retries(
+                    lambda: self.conn.put_object(Body=file_contents, Bucket=bucket, Key=object_name))
                 if "HTTPStatusCode" in result:
                     status_code = result["HTTPStatusCode"]
                     if status_code == 200:
@@ -190,6 +251,64 @@ class S3StorageSystem(StorageSystem):
                 print("Exception ", sys.exc_info()[0], "occurred.")
                 pass
 
+        if object_added:
+            self.invalidate_container_listing(container_name)
+        return object_added
+
+    def put_object_stream(self, container_name: str, object_name: str, stream, content_length: int,
+                          headers=None) -> bool:
+        if self.debug_mode:
+            print("put_object_stream: container='%s', object='%s', length=%d" % (container_name,
+                                                                                   object_name,
+                                                                                   content_length))
+
+        object_added = False
+
+        if self.conn is not None and container_name is not None and \
+                object_name is not None and stream is not None:
+            try:
+                # upload_fileobj reads the stream in bounded chunks rather
+                # than requiring the whole object in memory. the stream can't
+                # be read again, so the upload isn't retried
+                self.with_retries(lambda: self.conn.upload_fileobj(stream, container_name, object_name,
+                                                                   Config=self.transfer_config()),
+                                  idempotent=False)
+                object_added = True
+            except boto3.exceptions.S3UploadFailedError as ufe:
+                print(repr(ufe))
+            except botocore.exceptions.ClientError as ce:
+                print(repr(ce))
+
+        if object_added:
+            self.invalidate_container_listing(container_name)
+        return object_added
+
+    def put_object_from_file(self, container_name: str, object_name: str, file_path: str,
+                             headers=None) -> bool:
+        if self.debug_mode:
+            print("put_object_from_file: container='%s', object='%s', file_path='%s'" % (container_name,
+                                                                                         object_name,
+                                                                                         file_path))
+
+        object_added = False
+
+        if self.conn is not None and container_name is not None and \
+                object_name is not None and file_path is not None:
+            try:
+                # with a file path, the parts of a multipart upload are read
+                # and sent in parallel
+                self.with_retries(lambda: self.conn.upload_file(file_path, container_name, object_name,
+                                                                Config=self.transfer_config()))
+                object_added = True
+            except boto3.exceptions.S3UploadFailedError as ufe:
+                print(repr(ufe))
+            except botocore.exceptions.ClientError as ce:
+                print(repr(ce))
+            except (IOError, OSError):
+                print("error: unable to read file %s" % file_path)
+
+        if object_added:
+            self.invalidate_container_listing(container_name)
         return object_added
 
     def delete_object(self, container_name: str, object_name: str) -> bool:
@@ -199,14 +318,48 @@ class S3StorageSystem(StorageSystem):
         object_deleted = False
 
         if self.conn is not None and container_name is not None and object_name is not None:
-            # try:
-                self.conn.delete_object(Bucket=container_name, Key=object_name)
+            try:
+                self.with_retries(lambda: self.conn.delete_object(Bucket=container_name, Key=object_name))
                 object_deleted = True
-            # except boto.exception.S3ResponseError:
-            #    pass
+            except botocore.exceptions.ClientError as ce:
+                print(repr(ce))
+            except botocore.exceptions.BotoCoreError as bce:
+                print(repr(bce))
 
+        if object_deleted:
+            self.invalidate_container_listing(container_name)
         return object_deleted
 
+    def delete_objects(self, container_name: str, object_names: List[str]) -> List[str]:
+        if self.debug_mode:
+            print("delete_objects: container='%s', %d objects" % (container_name, len(object_names)))
+
+        deleted_objects = []
+
+        if self.conn is not None and container_name is not None:
+            for i in range(0, len(object_names), DELETE_OBJECTS_BATCH_SIZE):
+                batch = object_names[i:i + DELETE_OBJECTS_BATCH_SIZE]
+                delete_request = {'Objects': [{'Key': object_name} for object_name in batch],
+                                  'Quiet': True}
+                try:
+                    # in quiet mode, only the keys that couldn't be deleted are listed
+                    response = self.with_retries(
+                        lambda: self.conn.delete_objects(Bucket=container_name, Delete=delete_request))
+                    failed_keys = set()
+                    for error in response.get('Errors', []):
+                        print("error: unable to delete '%s': %s" % (error.get('Key'), error.get('Message')))
+                        failed_keys.add(error.get('Key'))
+                    deleted_objects.extend([object_name for object_name in batch
+                                            if object_name not in failed_keys])
+                except botocore.exceptions.ClientError as ce:
+                    print(repr(ce))
+                except botocore.exceptions.BotoCoreError as bce:
+                    print(repr(bce))
+
+        if deleted_objects:
+            self.invalidate_container_listing(container_name)
+        return deleted_objects
+
     def get_object(self, container_name: str, object_name: str, local_file_path: str) -> int:
         if self.debug_mode:
             print("get_object: container='%s', object='%s', local_file_path='%s'" % (container_name,
@@ -218,11 +371,39 @@ class S3StorageSystem(StorageSystem):
         if self.conn is not None and container_name is not None and \
                 object_name is not None and local_file_path is not None:
 
-            # try:
-                self.conn.download_file(container_name, object_name, local_file_path)
+            try:
+                self.with_retries(lambda: self.conn.download_file(container_name, object_name, local_file_path))
                 if os.path.exists(local_file_path):
                     bytes_retrieved = os.path.getsize(local_file_path)
-            # except (Exception, boto.exception.S3ResponseError):
-            #    pass
+            except botocore.exceptions.ClientError as ce:
+                print(repr(ce))
+            except botocore.exceptions.BotoCoreError as bce:
+                print(repr(bce))
 
         return bytes_retrieved
+
+    def get_object_chunks(self, container_name: str, object_name: str,
+                          chunk_size: int = storage_system.DOWNLOAD_CHUNK_SIZE,
+                          offset: int = 0,
+                          length: typing.Optional[int] = None):
+        if self.debug_mode:
+            print("get_object_chunks: container='%s', object='%s'" % (container_name, object_name))
+
+        if self.conn is not None and container_name is not None and object_name is not None:
+            if length == 0:
+                return storage_system.no_chunks()
+            try:
+                byte_range = storage_system.range_header(offset, length)
+                if byte_range is not None:
+                    response = self.with_retries(
+                        lambda: self.conn.get_object(Bucket=container_name, Key=object_name, Range=byte_range))
+                else:
+                    response = self.with_retries(
+                        lambda: self.conn.get_object(Bucket=container_name, Key=object_name))
+                return iter_body_chunks(response['Body'], chunk_size)
+            except botocore.exceptions.ClientError as ce:
+                print(repr(ce))
+            except botocore.exceptions.BotoCoreError as bce:
+                print(repr(bce))
+
+        return None
@@ -0,0 +1,97 @@
+import gzip
+import logging
+import shutil
+
+import utils
+
+_zstd_supported = False
+
+try:
+    import zstandard
+    _zstd_supported = True
+except ImportError:
+    _zstd_supported = False
+
+CODEC_NONE = "none"
+CODEC_GZIP = "gzip"
+CODEC_ZSTD = "zstd"
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+_codec_errors = (IOError, OSError, EOFError)
+if _zstd_supported:
+    _codec_errors = _codec_errors + (zstandard.ZstdError,)
+
+
+def zstd_is_available() -> bool:
+    return _zstd_supported
+
+
+def supported_codecs() -> list:
+    codecs = [CODEC_NONE, CODEC_GZIP]
+    if zstd_is_available():
+        codecs.append(CODEC_ZSTD)
+    return codecs
+
+
+def codec_for_header(header: bytes) -> str:
+    if header.startswith(GZIP_MAGIC):
+        return CODEC_GZIP
+    elif header.startswith(ZSTD_MAGIC):
+        return CODEC_ZSTD
+    else:
+        return CODEC_NONE
+
+
+def detect_codec(file_path: str) -> str:
+    try:
+        with open(file_path, "rb") as f:
+            return codec_for_header(f.read(4))
+    except IOError:
+        return CODEC_NONE
+
+
+def compress_file(source_path: str, dest_path: str, codec: str) -> bool:
+    # both compression and decompression stream in bounded chunks, so
+    # neither copy of the file is held in memory
+    try:
+        with open(source_path, "rb") as source_file:
+            if codec == CODEC_GZIP:
+                with gzip.open(dest_path, "wb") as dest_file:
+                    shutil.copyfileobj(source_file, dest_file, utils.FILE_CHUNK_SIZE)
+            elif codec == CODEC_ZSTD and zstd_is_available():
+                with open(dest_path, "wb") as dest_file:
+                    compressor = zstandard.ZstdCompressor()
+                    compressor.copy_stream(source_file, dest_file)
+            else:
+                logging.error("unsupported compression '%s'" % codec)
+                return False
+        return True
+    except _codec_errors as e:
+        logging.error("unable to compress %s: %s" % (source_path, repr(e)))
+        return False
+
+
+def decompress_file(source_path: str, dest_path: str) -> bool:
+    # writes the decoded contents of source_path to dest_path, detecting the
+    # compression (if any) from the file header
+    codec = detect_codec(source_path)
+    try:
+        with open(source_path, "rb") as source_file:
+            with open(dest_path, "wb") as dest_file:
+                if codec == CODEC_GZIP:
+                    with gzip.GzipFile(fileobj=source_file, mode="rb") as gzip_file:
+                        shutil.copyfileobj(gzip_file, dest_file, utils.FILE_CHUNK_SIZE)
+                elif codec == CODEC_ZSTD:
+                    if not zstd_is_available():
+                        logging.error("%s is zstd compressed, please install zstandard" % source_path)
+                        return False
+                    decompressor = zstandard.ZstdDecompressor()
+                    decompressor.copy_stream(source_file, dest_file)
+                else:
+                    shutil.copyfileobj(source_file, dest_file, utils.FILE_CHUNK_SIZE)
+        return True
+    except _codec_errors as e:
+        logging.error("unable to decompress %s: %s" % (source_path, repr(e)))
+        return False
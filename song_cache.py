@@ -0,0 +1,154 @@
+import json
+import logging
+import threading
+import time
+import typing
+
+from typing import Dict
+
+import song_metadata
+import utils
+
+CACHE_INDEX_FILE_NAME = "cache_index.json"
+
+POLICY_LRU = "lru"
+POLICY_LFU = "lfu"
+CACHE_POLICIES = [POLICY_LRU, POLICY_LFU]
+
+ENTRY_SIZE = "size"
+ENTRY_MD5_HASH = "md5_hash"
+ENTRY_LAST_ACCESS = "last_access"
+ENTRY_HITS = "hits"
+
+
+# persistent local cache of song files, bounded by total size in bytes. the
+# index records the size and md5 hash of each cached file so that a cached
+# copy is only used when it matches the song's current metadata. when the
+# cache is full, songs are evicted least recently used (lru) or least
+# frequently used (lfu) first.
+class SongCache(object):
+
+    def __init__(self, cache_dir: str, max_bytes: int, policy: str = POLICY_LRU):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.index_file_path = utils.path_join(cache_dir, CACHE_INDEX_FILE_NAME)
+        self.entries: Dict[str, Dict[str, object]] = {}
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+    def open(self) -> bool:
+        if not utils.directory_exists(self.cache_dir):
+            if not utils.create_directory(self.cache_dir):
+                logging.error("unable to create song cache directory %s" % self.cache_dir)
+                return False
+
+        entries = {}
+        if utils.file_exists(self.index_file_path):
+            file_contents = utils.file_read_all_text(self.index_file_path)
+            if file_contents is not None:
+                try:
+                    entries = json.loads(file_contents)
+                except ValueError:
+                    logging.error("song cache index is corrupt, ignoring it")
+
+        # only keep entries whose file is still present and intact
+        with self.lock:
+            self.entries = {}
+            self.total_bytes = 0
+            for file_uid, entry in entries.items():
+                file_path = self.cached_file_path(file_uid)
+                if utils.file_exists(file_path) and utils.get_file_size(file_path) == entry.get(ENTRY_SIZE):
+                    self.entries[file_uid] = entry
+                    self.total_bytes += entry[ENTRY_SIZE]
+
+            # remove files that aren't in the index
+            for file_name in utils.list_files_in_directory(self.cache_dir):
+                if file_name != CACHE_INDEX_FILE_NAME and file_name not in self.entries:
+                    utils.delete_file(self.cached_file_path(file_name))
+        return True
+
+    def save(self) -> bool:
+        # downloader threads save concurrently, so the index is written to a
+        # temp file and swapped into place while holding the lock. a reader
+        # never sees a partly written index
+        with self.lock:
+            index_contents = json.dumps(self.entries)
+            temp_file_path = self.index_file_path + ".tmp"
+            if not utils.file_write_all_text(temp_file_path, index_contents):
+                return False
+            return utils.replace_file(temp_file_path, self.index_file_path)
+
+    def cached_file_path(self, file_uid: str) -> str:
+        return utils.path_join(self.cache_dir, file_uid)
+
+    def lookup(self, song: song_metadata.SongMetadata) -> typing.Optional[str]:
+        # returns the path of the cached copy of the song, if there is one
+        # that matches the song's metadata
+        with self.lock:
+            entry = self.entries.get(song.fm.file_uid)
+            if entry is None:
+                return None
+            if entry[ENTRY_MD5_HASH] != song.fm.md5_hash or entry[ENTRY_SIZE] != song.fm.stored_file_size:
+                # stale copy of a song that has been re-imported
+                self.remove_entry(song.fm.file_uid)
+                return None
+            entry[ENTRY_LAST_ACCESS] = time.time()
+            entry[ENTRY_HITS] += 1
+            return self.cached_file_path(song.fm.file_uid)
+
+    def retrieve_file(self, song: song_metadata.SongMetadata, file_path: str) -> int:
+        # places the cached copy of the song at file_path. returns the number
+        # of bytes retrieved (0 if the song isn't cached)
+        cached_file_path = self.lookup(song)
+        if cached_file_path is not None and utils.link_or_copy_file(cached_file_path, file_path):
+            return utils.get_file_size(file_path)
+        return 0
+
+    def add(self, song: song_metadata.SongMetadata, file_path: str) -> bool:
+        file_size = utils.get_file_size(file_path)
+        if file_size > self.max_bytes:
+            return False
+
+        # verify the downloaded file before trusting it for later plays
+        if song.fm.md5_hash and utils.md5_for_file(file_path) != song.fm.md5_hash:
+            logging.error("not caching %s, md5 hash doesn't match" % song.fm.file_uid)
+            return False
+
+        with self.lock:
+            if song.fm.file_uid in self.entries:
+                self.remove_entry(song.fm.file_uid)
+            self.evict(file_size)
+            if not utils.link_or_copy_file(file_path, self.cached_file_path(song.fm.file_uid)):
+                logging.error("unable to add %s to song cache" % song.fm.file_uid)
+                return False
+            self.entries[song.fm.file_uid] = {ENTRY_SIZE: file_size,
+                                              ENTRY_MD5_HASH: song.fm.md5_hash,
+                                              ENTRY_LAST_ACCESS: time.time(),
+                                              ENTRY_HITS: 0}
+            self.total_bytes += file_size
+        return self.save()
+
+    def evict(self, needed_bytes: int):
+        # caller must hold self.lock
+        if self.total_bytes + needed_bytes <= self.max_bytes:
+            return
+        if self.policy == POLICY_LFU:
+            eviction_order = sorted(self.entries.keys(),
+                                    key=lambda uid: (self.entries[uid][ENTRY_HITS],
+                                                     self.entries[uid][ENTRY_LAST_ACCESS]))
+        else:
+            eviction_order = sorted(self.entries.keys(),
+                                    key=lambda uid: self.entries[uid][ENTRY_LAST_ACCESS])
+        for file_uid in eviction_order:
+            if self.total_bytes + needed_bytes <= self.max_bytes:
+                break
+            logging.debug("evicting %s from song cache" % file_uid)
+            self.remove_entry(file_uid)
+
+    def remove_entry(self, file_uid: str):
+        # caller must hold self.lock
+        entry = self.entries.pop(file_uid, None)
+        if entry is not None:
+            self.total_bytes -= entry[ENTRY_SIZE]
+            utils.delete_file(self.cached_file_path(file_uid))
@@ -1,18 +1,99 @@
+import queue
 import threading
+import typing
 
+from typing import Dict
 
-class SongDownloader(threading.Thread):
-    def __init__(self, jb, list_songs):
-        super(SongDownloader, self).__init__()
+
+# long-lived pool of download threads fed from a single queue. a song is
+# tracked from the time it's queued until its download finishes, so asking
+# for the same song again while it's pending is a no-op and no two workers
+# ever download the same file. each pending song also has a hedge event
+# that's set once a slow response to its download would hold up playback.
+class SongDownloader(object):
+    def __init__(self, jb, num_workers: int = 1):
         self.jukebox = jb
-        self.list_songs = list_songs
+        self.num_workers = max(1, num_workers)
+        self.download_queue = queue.Queue()
+        self.pending: Dict[str, threading.Event] = {}
+        self.hedge_events: Dict[str, threading.Event] = {}
+        self.lock = threading.Lock()
+        self.workers = []
+
+    def start(self):
+        for i in range(self.num_workers):
+            worker = threading.Thread(target=self.run, name="song-downloader-%d" % i)
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def stop(self):
+        # wake each worker so that it can exit
+        for i in range(len(self.workers)):
+            self.download_queue.put(None)
+        self.workers = []
+
+    def enqueue(self, song) -> bool:
+        # returns False if the song is already queued or being downloaded
+        with self.lock:
+            file_uid = song.fm.file_uid
+            if file_uid in self.pending:
+                return False
+            if not self.pending:
+                # first song of a new batch
+                self.jukebox.batch_download_start()
+            self.pending[file_uid] = threading.Event()
+            self.hedge_events[file_uid] = threading.Event()
+        self.download_queue.put(song)
+        return True
+
+    def is_pending(self, song) -> bool:
+        with self.lock:
+            return song.fm.file_uid in self.pending
+
+    def pending_count(self) -> int:
+        with self.lock:
+            return len(self.pending)
+
+    def hedge_event(self, song) -> typing.Optional[threading.Event]:
+        with self.lock:
+            return self.hedge_events.get(song.fm.file_uid)
+
+    def request_hedge(self, song) -> bool:
+        # asks for a slow download of the song to be hedged. returns False
+        # if the song isn't pending
+        hedge_event = self.hedge_event(song)
+        if hedge_event is None:
+            return False
+        hedge_event.set()
+        return True
+
+    def wait_for_song(self, song, timeout: float = None) -> bool:
+        # blocks until a pending download of the song has finished. returns
+        # False if the download is still running when the timeout expires.
+        # the caller is waiting on the song, so its download is hedged
+        with self.lock:
+            done_event = self.pending.get(song.fm.file_uid)
+            hedge_event = self.hedge_events.get(song.fm.file_uid)
+        if done_event is None:
+            return True
+        if not done_event.is_set():
+            hedge_event.set()
+        return done_event.wait(timeout)
 
     def run(self):
-        if self.jukebox is not None and self.list_songs is not None:
-            self.jukebox.batch_download_start()
-            for song in self.list_songs:
-                if self.jukebox.exit_requested:
-                    break
-                else:
+        while True:
+            song = self.download_queue.get()
+            if song is None:
+                break
+            try:
+                if not self.jukebox.exit_requested:
                     self.jukebox.download_song(song)
-            self.jukebox.batch_download_complete()
+            finally:
+                with self.lock:
+                    done_event = self.pending.pop(song.fm.file_uid, None)
+                    self.hedge_events.pop(song.fm.file_uid, None)
+                    if not self.pending:
+                        self.jukebox.batch_download_complete()
+                if done_event is not None:
+                    done_event.set()
@@ -0,0 +1,68 @@
+import logging
+import threading
+
+FEED_CHUNK_SIZE = 64 * 1024
+
+
+# feeds a song file to the audio player's standard input while the file is
+# still being downloaded. the downloader writes to the file at full speed and
+# reports each write; a separate feeder thread copies the newly written bytes
+# to the player, so a player that reads at playback speed never slows down
+# the download.
+class SongStreamer(object):
+    def __init__(self, file_path: str, player_stdin):
+        self.file_path = file_path
+        self.player_stdin = player_stdin
+        self.condition = threading.Condition()
+        self.bytes_available = 0
+        self.bytes_fed = 0
+        self.download_done = False
+        self.feeder = None
+
+    def start(self):
+        self.feeder = threading.Thread(target=self.run, name="song-streamer")
+        self.feeder.daemon = True
+        self.feeder.start()
+
+    def data_written(self, num_bytes: int):
+        # called by the downloader after flushing num_bytes to the file
+        with self.condition:
+            self.bytes_available += num_bytes
+            self.condition.notify()
+
+    def finish(self):
+        # called by the downloader once nothing more will be written
+        with self.condition:
+            self.download_done = True
+            self.condition.notify()
+
+    def join(self):
+        if self.feeder is not None:
+            self.feeder.join()
+            self.feeder = None
+
+    def run(self):
+        try:
+            with open(self.file_path, "rb") as f:
+                while True:
+                    with self.condition:
+                        while self.bytes_fed >= self.bytes_available and not self.download_done:
+                            self.condition.wait()
+                        bytes_available = self.bytes_available
+                    if self.bytes_fed >= bytes_available:
+                        break
+                    chunk = f.read(min(FEED_CHUNK_SIZE, bytes_available - self.bytes_fed))
+                    if not chunk:
+                        break
+                    self.player_stdin.write(chunk)
+                    self.player_stdin.flush()
+                    self.bytes_fed += len(chunk)
+        except (IOError, OSError, ValueError):
+            # the player exited (song skipped or paused) before reading
+            # everything
+            logging.debug("audio player stopped reading after %d bytes" % self.bytes_fed)
+        finally:
+            try:
+                self.player_stdin.close()
+            except (IOError, OSError):
+                pass
@@ -1,8 +1,50 @@
 import os.path
 import abc
+import concurrent.futures
+import socket
+import threading
+import time
 import typing
 
-from typing import List
+from typing import Dict, Iterator, List
+
+import retry_policy
+
+# objects at least this large are uploaded in parts
+MULTIPART_THRESHOLD = 16 * 1024 * 1024
+MULTIPART_CHUNK_SIZE = 8 * 1024 * 1024
+MULTIPART_CONCURRENCY = 4
+
+# size of the chunks returned by get_object_chunks
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# seconds that a container listing is reused before the container is listed again
+LISTING_CACHE_TTL = 30
+
+# default size of the HTTP connection pool of remote storage systems
+DEFAULT_MAX_CONNECTIONS = 10
+
+# how often a hedged read checks whether its caller has asked for the hedge
+HEDGE_POLL_SECONDS = 0.05
+
+
+# keys of the dictionary returned by head_object
+OBJECT_ETAG = "etag"
+OBJECT_LAST_MODIFIED = "last_modified"
+OBJECT_SIZE = "size"
+
+
+def range_header(offset: int = 0, length: typing.Optional[int] = None) -> typing.Optional[str]:
+    # value of an HTTP Range header for length bytes starting at offset
+    # (through the end of the object when length is None). a Range header
+    # can't select zero bytes, so empty reads don't make a request at all
+    if length is not None:
+        if length <= 0:
+            raise ValueError("range length must be positive, not %d" % length)
+        return "bytes=%d-%d" % (offset, offset + length - 1)
+    elif offset > 0:
+        return "bytes=%d-" % offset
+    return None
 
 
 class StorageSystem:
@@ -17,6 +59,52 @@ class StorageSystem:
         self.container_prefix = ""
         self.metadata_prefix = ""
         self.storage_system_type = storage_system_type
+        # whether a single instance may be used by multiple threads at once
+        self.thread_safe = True
+        self.multipart_threshold = MULTIPART_THRESHOLD
+        self.multipart_chunk_size = MULTIPART_CHUNK_SIZE
+        self.multipart_concurrency = MULTIPART_CONCURRENCY
+        # size of the connection pool, which should cover every transfer that
+        # can be in progress at once. must be set before __enter__
+        self.max_connections = DEFAULT_MAX_CONNECTIONS
+        # whether objects are files on a local (or network mounted) filesystem
+        self.is_local = False
+        # (container, prefix) -> (time listed, object names)
+        self.listing_cache_ttl = LISTING_CACHE_TTL
+        self.listing_cache: Dict[typing.Tuple[str, str], typing.Tuple[float, List[str]]] = {}
+        self.listing_cache_lock = threading.Lock()
+        self.retry_policy = retry_policy.RetryPolicy()
+        # threads for parallel and hedged requests. they're kept for the life
+        # of the storage system, since clients may hold a connection per
+        # thread (see swift.py), and are stopped by __exit__
+        self.request_executor: typing.Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self.request_executor_lock = threading.Lock()
+
+    def get_request_executor(self) -> concurrent.futures.ThreadPoolExecutor:
+        with self.request_executor_lock:
+            if self.request_executor is None:
+                self.request_executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.max_connections, thread_name_prefix="storage-request")
+            return self.request_executor
+
+    def shutdown_request_executor(self):
+        # requests still running (such as the losing side of a hedged read)
+        # aren't waited for
+        with self.request_executor_lock:
+            executor = self.request_executor
+            self.request_executor = None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def is_transient_error(self, error: Exception) -> bool:
+        # whether an operation that failed with the error may succeed if it's
+        # tried again. only network errors count; other OSErrors (a missing
+        # local file, a full disk, no permission) fail the same way every
+        # time. storage systems override this for their client's errors
+        return isinstance(error, (ConnectionError, TimeoutError, socket.timeout))
+
+    def with_retries(self, func, idempotent: bool = True):
+        return self.retry_policy.call(func, self.is_transient_error, idempotent)
 
     def un_prefixed_container(self, container_name: str) -> str:
         if len(self.container_prefix) > 0 and len(container_name) > 0:
@@ -56,11 +144,15 @@ class StorageSystem:
         return False
 
     def add_file_from_path(self, container_name: str, object_name: str, file_path: str) -> bool:
+        return self.put_object_from_file(container_name, object_name, file_path)
+
+    def put_object_from_file(self, container_name: str, object_name: str, file_path: str,
+                             headers=None) -> bool:
         try:
+            file_size = os.path.getsize(file_path)
             with open(file_path, 'rb') as input_file:
-                file_contents = input_file.read()
-            return self.put_object(container_name, object_name, file_contents)
-        except IOError:
+                return self.put_object_stream(container_name, object_name, input_file, file_size, headers)
+        except (IOError, OSError):
             print("error: unable to read file %s" % file_path)
             return False
 
@@ -77,21 +169,183 @@ class StorageSystem:
         return False
 
     @abc.abstractmethod
-    def list_container_contents(self, container_name: str) -> typing.Optional[List[str]]:
+    def iter_container_contents(self, container_name: str, prefix: str = "") -> typing.Optional[Iterator[str]]:
+        # returns a generator over the names of the objects in the container
+        # that start with prefix, fetching the listing a page at a time, or
+        # None if the container can't be listed. errors while iterating are
+        # raised as IOError
         return None
 
+    def list_container_contents(self, container_name: str, prefix: str = "") -> typing.Optional[List[str]]:
+        # listings are cached for listing_cache_ttl seconds. putting or
+        # deleting an object through this storage system invalidates the
+        # container's listings, but changes made by other clients may take
+        # that long to show up
+        cache_key = (container_name, prefix)
+        with self.listing_cache_lock:
+            cached_listing = self.listing_cache.get(cache_key)
+        if cached_listing is not None and time.time() - cached_listing[0] < self.listing_cache_ttl:
+            return list(cached_listing[1])
+
+        listing_time = time.time()
+        object_names = self.iter_container_contents(container_name, prefix)
+        if object_names is None:
+            return None
+        try:
+            list_contents = list(object_names)
+        except IOError as e:
+            print("error: unable to list container '%s': %s" % (container_name, repr(e)))
+            return None
+
+        with self.listing_cache_lock:
+            self.listing_cache[cache_key] = (listing_time, list_contents)
+        return list(list_contents)
+
+    def invalidate_container_listing(self, container_name: str):
+        with self.listing_cache_lock:
+            for cache_key in list(self.listing_cache.keys()):
+                if cache_key[0] == container_name:
+                    del self.listing_cache[cache_key]
+
     @abc.abstractmethod
     def get_object_metadata(self, container_name: str, object_name: str):
         return None
 
+    @abc.abstractmethod
+    def head_object(self, container_name: str, object_name: str) -> typing.Optional[Dict[str, object]]:
+        # returns a dictionary with OBJECT_ETAG, OBJECT_LAST_MODIFIED and
+        # OBJECT_SIZE for the object, or None if it doesn't exist
+        return None
+
     @abc.abstractmethod
     def put_object(self, container_name: str, object_name: str, file_contents, headers=None) -> bool:
         return False
 
+    def put_object_stream(self, container_name: str, object_name: str, stream, content_length: int,
+                          headers=None) -> bool:
+        # default for storage systems that can't stream uploads: buffer the
+        # whole stream and put it in one piece
+        file_contents = stream.read()
+        if file_contents is None or len(file_contents) != content_length:
+            return False
+        return self.put_object(container_name, object_name, file_contents, headers)
+
     @abc.abstractmethod
     def delete_object(self, container_name: str, object_name: str) -> bool:
         return False
 
+    def local_object_path(self, container_name: str, object_name: str) -> typing.Optional[str]:
+        # path of the file holding the object, for storage systems whose
+        # objects are local files. callers must not modify the file
+        return None
+
+    def delete_objects(self, container_name: str, object_names: List[str]) -> List[str]:
+        # deletes the objects from the container, returning the names of the
+        # objects that were deleted. objects that don't exist count as
+        # deleted, as they do in bulk delete requests. storage systems with a
+        # bulk delete request override this; the default deletes the objects
+        # in parallel
+        if not object_names:
+            return []
+        if not self.thread_safe:
+            return [object_name for object_name in object_names
+                    if self.delete_object(container_name, object_name)]
+        results = self.get_request_executor().map(
+            lambda object_name: self.delete_object(container_name, object_name), object_names)
+        return [object_name for object_name, deleted in zip(object_names, results) if deleted]
+
     @abc.abstractmethod
     def get_object(self, container_name: str, object_name: str, local_file_path: str) -> int:
         return 0
+
+    @abc.abstractmethod
+    def get_object_chunks(self, container_name: str, object_name: str,
+                          chunk_size: int = DOWNLOAD_CHUNK_SIZE,
+                          offset: int = 0,
+                          length: typing.Optional[int] = None) -> typing.Optional[Iterator[bytes]]:
+        # returns a generator over the contents of the object in chunks of at
+        # most chunk_size bytes, or None if the object can't be read. with
+        # offset and/or length, only that byte range of the object is read;
+        # a length of 0 reads nothing. errors while iterating are raised as
+        # IOError
+        return None
+
+    def open_object_chunks(self, container_name: str, object_name: str,
+                           chunk_size: int = DOWNLOAD_CHUNK_SIZE,
+                           offset: int = 0,
+                           length: typing.Optional[int] = None):
+        # like get_object_chunks, but doesn't return until the first chunk
+        # has arrived. returns the chunk iterator and the first chunk
+        chunks = self.get_object_chunks(container_name, object_name, chunk_size, offset, length)
+        if chunks is None:
+            return None
+        try:
+            first_chunk = next(chunks, b'')
+        except IOError:
+            chunks.close()
+            return None
+        return chunks, first_chunk
+
+    def get_object_chunks_hedged(self, container_name: str, object_name: str,
+                                 hedge_delay: float,
+                                 chunk_size: int = DOWNLOAD_CHUNK_SIZE,
+                                 offset: int = 0,
+                                 length: typing.Optional[int] = None,
+                                 hedge_event: typing.Optional[threading.Event] = None) \
+            -> typing.Optional[Iterator[bytes]]:
+        # get_object_chunks for latency sensitive reads. if the first chunk
+        # hasn't arrived after hedge_delay seconds, a second identical request
+        # is sent and whichever responds first is used; the other is closed.
+        # with hedge_event, the second request also waits for the event to be
+        # set, so that the caller can decide while the first request is
+        # outstanding whether the read has become latency sensitive
+        executor = self.get_request_executor()
+        requests = [executor.submit(self.open_object_chunks, container_name, object_name,
+                                    chunk_size, offset, length)]
+        done, not_done = concurrent.futures.wait(requests, timeout=hedge_delay)
+        if not done and hedge_event is not None:
+            while not requests[0].done() and not hedge_event.wait(HEDGE_POLL_SECONDS):
+                pass
+        if not requests[0].done():
+            self.retry_policy.count(retry_policy.COUNTER_HEDGED)
+            requests.append(executor.submit(self.open_object_chunks, container_name, object_name,
+                                            chunk_size, offset, length))
+
+        winner = None
+        not_done = set(requests)
+        while not_done and winner is None:
+            done, not_done = concurrent.futures.wait(not_done,
+                                                     return_when=concurrent.futures.FIRST_COMPLETED)
+            for request in done:
+                result = request.result()
+                if result is None:
+                    continue
+                if winner is None:
+                    winner = result
+                    if request is not requests[0]:
+                        self.retry_policy.count(retry_policy.COUNTER_HEDGE_WINS)
+                else:
+                    result[0].close()
+
+        # close the losing request once it responds
+        for request in not_done:
+            request.add_done_callback(lambda r: r.result() is not None and r.result()[0].close())
+
+        if winner is None:
+            return None
+        return iter_chunks_after(winner[1], winner[0])
+
+
+def no_chunks() -> Iterator[bytes]:
+    # what get_object_chunks returns for a read of zero bytes
+    yield from ()
+
+
+def iter_chunks_after(first_chunk: bytes, chunks) -> Iterator[bytes]:
+    try:
+        if first_chunk:
+            yield first_chunk
+        for chunk in chunks:
+            yield chunk
+    finally:
+        chunks.close()
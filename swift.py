@@ -1,7 +1,13 @@
-from typing import List
+import json
+import threading
+import urllib.parse
 
+from typing import Dict, List
+
+import storage_system
 from storage_system import StorageSystem
 import typing
+import utils
 
 _storage_system_swift_supported = False
 
@@ -11,11 +17,24 @@ try:
 except ImportError:
     _storage_system_swift_supported = False
 
+STREAM_CHUNK_SIZE = 65536
+
 
 def is_available() -> bool:
     return _storage_system_swift_supported
 
 
+def iter_body_chunks(body):
+    # errors reading the response body are raised as IOError
+    try:
+        for chunk in body:
+            yield chunk
+    except swiftclient.client.ClientException as ce:
+        raise IOError(repr(ce))
+    finally:
+        body.close()
+
+
 class SwiftStorageSystem(StorageSystem):
     def __init__(self, auth_host: str, account: str, username: str, password: str, debug_mode: bool = False):
         StorageSystem.__init__(self, "Swift", debug_mode)
@@ -28,6 +47,16 @@ class SwiftStorageSystem(StorageSystem):
         self.username = username
         self.password = password
         self.metadata_prefix = "x-meta-"
+        # a swiftclient.Connection must not be shared between threads, so
+        # each thread gets its own (see conn). connections opened after the
+        # first reuse its auth token
+        self.auth_conn = None
+        self.thread_connections = threading.local()
+        self.connections = []
+        self.connections_lock = threading.Lock()
+        # most objects the cluster accepts in one bulk-delete request, from
+        # its /info. None until it's been asked, 0 if bulk delete isn't offered
+        self.bulk_delete_batch_size: typing.Optional[int] = None
         self.auth_url = ""
 
         if self.auth_ssl:
@@ -46,10 +75,8 @@ class SwiftStorageSystem(StorageSystem):
         if self.debug_mode:
             print("attempting to connect to swift server at %s" % self.auth_url)
 
-        self.conn = swiftclient.Connection(
-            self.auth_url, self.account_username, self.password,
-            auth_version=self.auth_version, retries=1)
-        dict_headers = self.conn.head_account()
+        self.auth_conn = self.new_connection()
+        dict_headers = self.auth_conn.head_account()
         if dict_headers is not None:
             self.authenticated = True
             self.list_containers = self.list_account_containers()
@@ -57,14 +84,53 @@ class SwiftStorageSystem(StorageSystem):
         return self
 
     def __exit__(self, exception_type, exception_value, traceback):
-        if self.conn is not None:
+        self.shutdown_request_executor()
+        if self.auth_conn is not None:
             if self.debug_mode:
-                print("closing swift connection object")
+                print("closing swift connection objects")
 
             self.authenticated = False
             self.list_containers = None
-            self.conn.close()
-            self.conn = None
+            with self.connections_lock:
+                for conn in self.connections:
+                    conn.close()
+                self.connections = []
+            self.auth_conn = None
+            self.thread_connections = threading.local()
+
+    def new_connection(self):
+        # swiftclient retries failed requests itself (re-authenticating when
+        # the token has expired, and only when the request body can be
+        # rewound), so it's given the retry policy's limits
+        if self.auth_conn is not None:
+            conn = swiftclient.Connection(
+                self.auth_url, self.account_username, self.password,
+                auth_version=self.auth_version,
+                retries=self.retry_policy.max_attempts - 1,
+                starting_backoff=self.retry_policy.base_delay,
+                max_backoff=self.retry_policy.max_delay,
+                preauthurl=self.auth_conn.url, preauthtoken=self.auth_conn.token)
+        else:
+            conn = swiftclient.Connection(
+                self.auth_url, self.account_username, self.password,
+                auth_version=self.auth_version,
+                retries=self.retry_policy.max_attempts - 1,
+                starting_backoff=self.retry_policy.base_delay,
+                max_backoff=self.retry_policy.max_delay)
+        self.thread_connections.conn = conn
+        with self.connections_lock:
+            self.connections.append(conn)
+        return conn
+
+    @property
+    def conn(self):
+        # the calling thread's connection, opened on first use
+        if self.auth_conn is None:
+            return None
+        conn = getattr(self.thread_connections, "conn", None)
+        if conn is None:
+            conn = self.new_connection()
+        return conn
 
     def list_account_containers(self) -> typing.Optional[List[str]]:
         if self.conn is not None:
@@ -104,24 +170,45 @@ class SwiftStorageSystem(StorageSystem):
 
         return container_deleted
 
-    def list_container_contents(self, container_name: str) -> typing.Optional[List[str]]:
-        if self.conn is not None:
+    def iter_container_contents(self, container_name: str, prefix: str = ""):
+        if self.conn is None or container_name is None:
+            return None
+
+        def object_names():
+            # a container listing is returned a page at a time. each page
+            # starts after the last name (the marker) of the previous page
+            marker = ""
             try:
-                dict_headers, list_contents = self.conn.get_container(container_name)
-                if dict_headers is not None and list_contents is not None:
-                    list_object_names = []
+                while True:
+                    dict_headers, list_contents = self.conn.get_container(container_name,
+                                                                          marker=marker,
+                                                                          prefix=prefix or None)
+                    if not list_contents:
+                        break
                     for object_record in list_contents:
-                        list_object_names.append(object_record['name'])
-                    return list_object_names
+                        yield object_record['name']
+                    marker = list_contents[-1]['name']
+            except swiftclient.client.ClientException as ce:
+                raise IOError(repr(ce))
+
+        return object_names()
+
+    def get_object_metadata(self, container_name: str, object_name: str):
+        if self.conn is not None and container_name is not None and object_name is not None:
+            try:
+                return self.conn.head_object(container_name, object_name)
             except swiftclient.client.ClientException:
                 pass
 
         return None
 
-    def get_object_metadata(self, container_name: str, object_name: str):
+    def head_object(self, container_name: str, object_name: str) -> typing.Optional[Dict[str, object]]:
         if self.conn is not None and container_name is not None and object_name is not None:
             try:
-                return self.conn.head_object(container_name, object_name)
+                dict_headers = self.conn.head_object(container_name, object_name)
+                return {storage_system.OBJECT_ETAG: dict_headers.get('etag'),
+                        storage_system.OBJECT_LAST_MODIFIED: dict_headers.get('last-modified'),
+                        storage_system.OBJECT_SIZE: int(dict_headers.get('content-length', 0))}
             except swiftclient.client.ClientException:
                 pass
 
@@ -142,6 +229,31 @@ class SwiftStorageSystem(StorageSystem):
             except swiftclient.client.ClientException:
                 pass
 
+        if object_added:
+            self.invalidate_container_listing(container_name)
+        return object_added
+
+    def put_object_stream(self, container_name: str, object_name: str, stream, content_length: int,
+                          headers=None) -> bool:
+        object_added = False
+
+        if self.conn is not None and container_name is not None and \
+                object_name is not None and stream is not None:
+
+            if not self.has_container(container_name):
+                self.create_container(container_name)
+
+            try:
+                self.conn.put_object(container_name, object_name, stream,
+                                     content_length=content_length,
+                                     chunk_size=STREAM_CHUNK_SIZE,
+                                     headers=headers)
+                object_added = True
+            except swiftclient.client.ClientException as ce:
+                print(repr(ce))
+
+        if object_added:
+            self.invalidate_container_listing(container_name)
         return object_added
 
     def delete_object(self, container_name: str, object_name: str) -> bool:
@@ -151,35 +263,108 @@ class SwiftStorageSystem(StorageSystem):
             try:
                 self.conn.delete_object(container_name, object_name)
                 object_deleted = True
-            except swiftclient.client.ClientException:
-                pass
+            except swiftclient.client.ClientException as ce:
+                # an object that's already gone counts as deleted
+                if ce.http_status == 404:
+                    object_deleted = True
 
+        if object_deleted:
+            self.invalidate_container_listing(container_name)
         return object_deleted
 
+    def get_bulk_delete_batch_size(self) -> int:
+        if self.bulk_delete_batch_size is None:
+            batch_size = 0
+            try:
+                capabilities = self.conn.get_capabilities()
+                if "bulk_delete" in capabilities:
+                    batch_size = int(capabilities["bulk_delete"].get("max_deletes_per_request", 0))
+            except (swiftclient.client.ClientException, ValueError, TypeError):
+                pass
+            self.bulk_delete_batch_size = batch_size
+        return self.bulk_delete_batch_size
+
+    def delete_objects(self, container_name: str, object_names: List[str]) -> List[str]:
+        # uses the bulk middleware's bulk-delete request. if the cluster
+        # doesn't offer it, or a bulk request fails as a whole, the objects
+        # are deleted one at a time (in parallel)
+        if self.conn is None or container_name is None or not object_names:
+            return []
+
+        batch_size = self.get_bulk_delete_batch_size()
+        if batch_size <= 0:
+            return StorageSystem.delete_objects(self, container_name, object_names)
+
+        deleted_objects = []
+        for i in range(0, len(object_names), batch_size):
+            batch = object_names[i:i + batch_size]
+            request_body = "\n".join(urllib.parse.quote("/%s/%s" % (container_name, object_name))
+                                     for object_name in batch)
+            try:
+                dict_headers, response_body = self.conn.post_account(
+                    headers={"Content-Type": "text/plain", "Accept": "application/json"},
+                    query_string="bulk-delete",
+                    data=request_body)
+                result = json.loads(response_body)
+            except (swiftclient.client.ClientException, ValueError):
+                result = None
+
+            # the request can fail as a whole (e.g., 413 for too many objects,
+            # or aborted after too many failed deletes) with no per-object
+            # errors, so the status of the whole request is checked first
+            response_status = result.get("Response Status", "") if result is not None else ""
+            if not response_status.startswith("2"):
+                if result is not None:
+                    print("error: bulk delete failed: %s %s" % (response_status, result.get("Response Body", "")))
+                deleted_objects.extend(StorageSystem.delete_objects(self, container_name, batch))
+                continue
+
+            failed_objects = set()
+            for object_path, error_status in result.get("Errors", []):
+                print("error: unable to delete '%s': %s" % (object_path, error_status))
+                failed_objects.add(urllib.parse.unquote(object_path).split("/", 2)[-1])
+            deleted_objects.extend([object_name for object_name in batch
+                                    if object_name not in failed_objects])
+
+        if deleted_objects:
+            self.invalidate_container_listing(container_name)
+        return deleted_objects
+
     def get_object(self, container_name: str, object_name: str, local_file_path: str) -> int:
         bytes_retrieved = 0
 
         if self.conn is not None and container_name is not None and \
                 object_name is not None and local_file_path is not None:
 
+            # the object is written to the file as it arrives rather than
+            # being read into memory first
+            chunks = self.get_object_chunks(container_name, object_name)
+            if chunks is not None:
+                bytes_written = utils.file_write_from_chunks(local_file_path, chunks)
+                if bytes_written >= 0:
+                    bytes_retrieved = bytes_written
+                else:
+                    print("error: unable to retrieve object to file '%s'" % local_file_path)
+
+        return bytes_retrieved
+
+    def get_object_chunks(self, container_name: str, object_name: str,
+                          chunk_size: int = storage_system.DOWNLOAD_CHUNK_SIZE,
+                          offset: int = 0,
+                          length: typing.Optional[int] = None):
+        if self.conn is not None and container_name is not None and object_name is not None:
+            if length == 0:
+                return storage_system.no_chunks()
             try:
-                dict_headers, file_contents = self.conn.get_object(container_name, object_name)
-                if dict_headers is not None and file_contents is not None:
-                    if len(file_contents) > 0:
-                        try:
-                            with open(local_file_path, 'wb') as content_file:
-                                content_file.write(file_contents)
-                            bytes_retrieved = len(file_contents)
-                        except IOError:
-                            print("error: unable to write to file '%s'" % local_file_path)
-                    else:
-                        # create empty file
-                        try:
-                            open(local_file_path, 'w').close()
-                            bytes_retrieved = 0
-                        except IOError:
-                            print("error: unable to write to file '%s'" % local_file_path)
+                request_headers = {}
+                byte_range = storage_system.range_header(offset, length)
+                if byte_range is not None:
+                    request_headers['Range'] = byte_range
+                dict_headers, body = self.conn.get_object(container_name, object_name,
+                                                          resp_chunk_size=chunk_size,
+                                                          headers=request_headers)
+                return iter_body_chunks(body)
             except swiftclient.client.ClientException:
                 pass
 
-        return bytes_retrieved
+        return None
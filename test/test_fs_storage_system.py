@@ -0,0 +1,180 @@
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import fs_storage_system
+import retry_policy
+import storage_system
+
+
+class SlowFirstGetStorageSystem(fs_storage_system.FSStorageSystem):
+    # the first read of an object stalls, as if the request hit a slow server
+    def __init__(self, root_dir: str):
+        fs_storage_system.FSStorageSystem.__init__(self, root_dir)
+        self.gets = 0
+        self.gets_lock = threading.Lock()
+
+    def get_object_chunks(self, container_name, object_name, chunk_size=65536, offset=0, length=None):
+        with self.gets_lock:
+            self.gets += 1
+            first_get = self.gets == 1
+        if first_get:
+            time.sleep(0.5)
+        return fs_storage_system.FSStorageSystem.get_object_chunks(self, container_name, object_name,
+                                                                   chunk_size, offset, length)
+
+
+class TestFSStorageSystem(unittest.TestCase):
+
+    def setUp(self):
+        self.root_dir = tempfile.mkdtemp()
+        self.ss = fs_storage_system.FSStorageSystem(self.root_dir)
+        self.ss.__enter__()
+        self.ss.create_container("songs")
+        self.contents = os.urandom(10000)
+        self.assertTrue(self.ss.put_object("songs", "a.mp3", self.contents))
+
+    def tearDown(self):
+        self.ss.__exit__(None, None, None)
+        shutil.rmtree(self.root_dir)
+
+    def test_get_object_chunks(self):
+        chunks = list(self.ss.get_object_chunks("songs", "a.mp3", 4096))
+        self.assertEqual([4096, 4096, 1808], [len(chunk) for chunk in chunks])
+        self.assertEqual(self.contents, b"".join(chunks))
+
+    def test_get_object_chunks_range(self):
+        chunks = self.ss.get_object_chunks("songs", "a.mp3", 1000, offset=2500, length=3000)
+        self.assertEqual(self.contents[2500:5500], b"".join(chunks))
+        chunks = self.ss.get_object_chunks("songs", "a.mp3", offset=9000)
+        self.assertEqual(self.contents[9000:], b"".join(chunks))
+        chunks = self.ss.get_object_chunks("songs", "a.mp3", offset=9000, length=0)
+        self.assertEqual(b"", b"".join(chunks))
+
+    def test_range_header(self):
+        self.assertIsNone(storage_system.range_header())
+        self.assertEqual("bytes=100-", storage_system.range_header(100))
+        self.assertEqual("bytes=100-199", storage_system.range_header(100, 100))
+        self.assertRaises(ValueError, storage_system.range_header, 100, 0)
+
+    def test_get_object_chunks_missing_object(self):
+        self.assertIsNone(self.ss.get_object_chunks("songs", "b.mp3"))
+
+    def test_get_object(self):
+        local_file_path = os.path.join(self.root_dir, "a.mp3")
+        self.assertEqual(len(self.contents), self.ss.get_object("songs", "a.mp3", local_file_path))
+        with open(local_file_path, "rb") as f:
+            self.assertEqual(self.contents, f.read())
+
+    def test_get_object_is_private_copy(self):
+        local_file_path = os.path.join(self.root_dir, "a.mp3")
+        self.ss.get_object("songs", "a.mp3", local_file_path)
+        with open(local_file_path, "r+b") as f:
+            f.write(b"changed")
+        chunks = self.ss.get_object_chunks("songs", "a.mp3")
+        self.assertEqual(self.contents, b"".join(chunks))
+
+    def test_local_object_path(self):
+        object_path = self.ss.local_object_path("songs", "a.mp3")
+        with open(object_path, "rb") as f:
+            self.assertEqual(self.contents, f.read())
+        self.assertIsNone(self.ss.local_object_path("songs", "b.mp3"))
+
+    def test_put_object_replaces_object(self):
+        linked_path = os.path.join(self.root_dir, "linked.mp3")
+        os.link(self.ss.local_object_path("songs", "a.mp3"), linked_path)
+        self.assertTrue(self.ss.put_object("songs", "a.mp3", b"new contents"))
+        self.assertEqual(b"new contents", b"".join(self.ss.get_object_chunks("songs", "a.mp3")))
+        # a hard link to the old object keeps the old contents
+        with open(linked_path, "rb") as f:
+            self.assertEqual(self.contents, f.read())
+
+    def test_failed_put_object_stream_keeps_object(self):
+        # the stream is shorter than the content length
+        self.assertFalse(self.ss.put_object_stream("songs", "a.mp3", io.BytesIO(b"short"), 100))
+        self.assertEqual(self.contents, b"".join(self.ss.get_object_chunks("songs", "a.mp3")))
+        self.assertEqual(["a.mp3"], sorted(os.listdir(os.path.join(self.root_dir, "songs"))))
+        self.assertTrue(self.ss.put_object_stream("songs", "a.mp3", io.BytesIO(b"12345"), 5))
+        self.assertEqual(b"12345", b"".join(self.ss.get_object_chunks("songs", "a.mp3")))
+        self.assertEqual(["a.mp3"], sorted(os.listdir(os.path.join(self.root_dir, "songs"))))
+
+    def test_list_container_contents_prefix(self):
+        self.assertTrue(self.ss.put_object("songs", "b.flac", b"b"))
+        self.assertEqual(["a.mp3"], self.ss.list_container_contents("songs", "a"))
+        self.assertEqual(["a.mp3", "b.flac"], sorted(self.ss.list_container_contents("songs")))
+
+    def test_listing_cache_invalidated_by_put_and_delete(self):
+        self.assertEqual(["a.mp3"], self.ss.list_container_contents("songs"))
+        # changes made behind the storage system's back aren't seen until the listing expires
+        with open(os.path.join(self.root_dir, "songs", "c.mp3"), "wb") as f:
+            f.write(b"c")
+        self.assertEqual(["a.mp3"], self.ss.list_container_contents("songs"))
+        self.assertTrue(self.ss.put_object("songs", "b.mp3", b"b"))
+        self.assertEqual(["a.mp3", "b.mp3", "c.mp3"], sorted(self.ss.list_container_contents("songs")))
+        self.assertTrue(self.ss.delete_object("songs", "c.mp3"))
+        self.assertEqual(["a.mp3", "b.mp3"], sorted(self.ss.list_container_contents("songs")))
+
+    def test_delete_objects(self):
+        self.assertTrue(self.ss.put_object("songs", "b.mp3", b"b"))
+        # a missing object counts as deleted
+        self.assertEqual(["a.mp3", "missing.mp3"],
+                         sorted(self.ss.delete_objects("songs", ["a.mp3", "missing.mp3"])))
+        self.assertEqual(["b.mp3"], self.ss.list_container_contents("songs"))
+        self.assertEqual([], self.ss.delete_objects("songs", []))
+
+    def test_is_transient_error(self):
+        self.assertTrue(self.ss.is_transient_error(ConnectionResetError()))
+        self.assertTrue(self.ss.is_transient_error(TimeoutError()))
+        self.assertFalse(self.ss.is_transient_error(FileNotFoundError()))
+        self.assertFalse(self.ss.is_transient_error(PermissionError()))
+        self.assertFalse(self.ss.is_transient_error(OSError(28, "No space left on device")))
+
+    def test_hedged_get(self):
+        ss = SlowFirstGetStorageSystem(self.root_dir)
+        start_time = time.time()
+        chunks = ss.get_object_chunks_hedged("songs", "a.mp3", 0.05, offset=100)
+        self.assertEqual(self.contents[100:], b"".join(chunks))
+        self.assertLess(time.time() - start_time, 0.4)
+        counters = ss.retry_policy.get_counters()
+        self.assertEqual(1, counters[retry_policy.COUNTER_HEDGED])
+        self.assertEqual(1, counters[retry_policy.COUNTER_HEDGE_WINS])
+        # let the slow request finish before the store is removed
+        time.sleep(0.5)
+
+    def test_hedged_get_waits_for_hedge_event(self):
+        ss = SlowFirstGetStorageSystem(self.root_dir)
+        hedge_event = threading.Event()
+        threading.Timer(0.2, hedge_event.set).start()
+        start_time = time.time()
+        chunks = ss.get_object_chunks_hedged("songs", "a.mp3", 0.05, hedge_event=hedge_event)
+        self.assertEqual(self.contents, b"".join(chunks))
+        # the hedge went out when the event was set, not after hedge_delay
+        self.assertGreaterEqual(time.time() - start_time, 0.2)
+        self.assertEqual(1, ss.retry_policy.get_counters()[retry_policy.COUNTER_HEDGED])
+        time.sleep(0.5)
+
+    def test_hedged_get_without_hedge_event_set(self):
+        ss = SlowFirstGetStorageSystem(self.root_dir)
+        chunks = ss.get_object_chunks_hedged("songs", "a.mp3", 0.05, hedge_event=threading.Event())
+        self.assertEqual(self.contents, b"".join(chunks))
+        self.assertEqual(0, ss.retry_policy.get_counters()[retry_policy.COUNTER_HEDGED])
+
+    def test_hedged_gets_reuse_request_threads(self):
+        self.ss.max_connections = 2
+        for i in range(5):
+            chunks = self.ss.get_object_chunks_hedged("songs", "a.mp3", 1.0)
+            self.assertEqual(self.contents, b"".join(chunks))
+        request_threads = [thread for thread in threading.enumerate()
+                           if thread.name.startswith("storage-request")]
+        self.assertLessEqual(len(request_threads), 2)
+        self.ss.__exit__(None, None, None)
+        self.assertIsNone(self.ss.request_executor)
+
+    def test_hedged_get_fast_response(self):
+        chunks = self.ss.get_object_chunks_hedged("songs", "a.mp3", 1.0)
+        self.assertEqual(self.contents, b"".join(chunks))
+        self.assertEqual(0, self.ss.retry_policy.get_counters()[retry_policy.COUNTER_HEDGED])
@@ -0,0 +1,41 @@
+import os
+import tempfile
+import unittest
+
+import import_index
+
+
+class TestImportIndex(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.index_file_path = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+        os.remove(self.index_file_path)
+
+    def tearDown(self):
+        if os.path.exists(self.index_file_path):
+            os.remove(self.index_file_path)
+
+    def test_lookup_unchanged_file(self):
+        index = import_index.ImportIndex(self.index_file_path)
+        self.assertFalse(index.load())
+        index.update("Cream--Fresh-Cream--Badge.mp3", 1234, 1700000000.5, "abc123")
+        self.assertTrue(index.save())
+
+        index = import_index.ImportIndex(self.index_file_path)
+        self.assertTrue(index.load())
+        self.assertEqual("abc123", index.lookup("Cream--Fresh-Cream--Badge.mp3", 1234, 1700000000.5))
+
+    def test_lookup_changed_file(self):
+        index = import_index.ImportIndex(self.index_file_path)
+        index.update("Cream--Fresh-Cream--Badge.mp3", 1234, 1700000000.5, "abc123")
+        self.assertIsNone(index.lookup("Cream--Fresh-Cream--Badge.mp3", 1235, 1700000000.5))
+        self.assertIsNone(index.lookup("Cream--Fresh-Cream--Badge.mp3", 1234, 1700000001.5))
+        self.assertIsNone(index.lookup("Cream--Fresh-Cream--Sunshine.mp3", 1234, 1700000000.5))
+
+    def test_corrupt_index_is_ignored(self):
+        with open(self.index_file_path, "w") as f:
+            f.write("{not json")
+        index = import_index.ImportIndex(self.index_file_path)
+        self.assertFalse(index.load())
+        self.assertEqual({}, index.entries)
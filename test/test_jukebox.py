@@ -1,8 +1,15 @@
+import os
+import shutil
+import tempfile
 import unittest
 
+import fs_storage_system
+import jukebox
+import jukebox_db
 from jukebox import Jukebox
 from jukebox_options import JukeboxOptions
 from song_metadata import SongMetadata
+from test_jukebox_db import make_song
 
 
 class TestJukebox(unittest.TestCase):
@@ -68,3 +75,110 @@ class TestJukebox(unittest.TestCase):
 
     def test_show_artists(self):
         self.assertTrue(False)
+
+
+class TestJukeboxPrefetch(unittest.TestCase):
+
+    def setUp(self):
+        self.jb_options = JukeboxOptions()
+        self.jb_options.prefetch_seconds = 600
+        self.jb_options.prefetch_max_mb = 100
+        self.jb = Jukebox(self.jb_options, None, "")
+
+    def test_record_download_throughput(self):
+        # the first measurement is taken as is, later ones are blended in
+        self.jb.record_download_throughput(1000.0)
+        self.assertEqual(1000.0, self.jb.download_throughput)
+        self.jb.record_download_throughput(2000.0)
+        self.assertAlmostEqual(1000.0 + jukebox.DOWNLOAD_THROUGHPUT_WEIGHT * 1000.0, self.jb.download_throughput)
+        self.jb.record_download_throughput(self.jb.download_throughput)
+        self.assertAlmostEqual(1000.0 + jukebox.DOWNLOAD_THROUGHPUT_WEIGHT * 1000.0, self.jb.download_throughput)
+
+    def test_estimated_play_seconds(self):
+        song = make_song("Cream--Goodbye--Badge.mp3")
+        song.fm.origin_file_size = 3200000
+        song.fm.stored_file_size = 1000
+        # 256 kbps
+        self.assertAlmostEqual(100.0, self.jb.estimated_play_seconds(song))
+        song = make_song("Cream--Goodbye--Badge.flac")
+        song.fm.origin_file_size = 10000000
+        # 1000 kbps
+        self.assertAlmostEqual(80.0, self.jb.estimated_play_seconds(song))
+        # unknown formats use the default bitrate, and the stored size is
+        # used when the original size isn't known
+        song = make_song("Cream--Goodbye--Badge.ogg")
+        song.fm.origin_file_size = 0
+        song.fm.stored_file_size = 3200000
+        self.assertAlmostEqual(100.0, self.jb.estimated_play_seconds(song))
+
+    def test_needs_more_prefetch(self):
+        # less than prefetch_seconds of playback looked ahead
+        self.assertTrue(self.jb.needs_more_prefetch(300.0, 10000000, 0.0))
+        # the byte budget caps the look ahead
+        self.assertFalse(self.jb.needs_more_prefetch(300.0, 101000000, 0.0))
+        # enough playback looked ahead, throughput unknown
+        self.assertFalse(self.jb.needs_more_prefetch(700.0, 50000000, 0.0))
+        # downloading the window (1000 seconds) takes longer than playing it
+        self.assertTrue(self.jb.needs_more_prefetch(700.0, 50000000, 50000.0))
+        # downloading the window (500 seconds) is faster than playing it
+        self.assertFalse(self.jb.needs_more_prefetch(700.0, 50000000, 100000.0))
+        self.jb_options.prefetch_seconds = 0
+        self.assertFalse(self.jb.needs_more_prefetch(300.0, 10000000, 50000.0))
+
+
+class TestJukeboxMetadata(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.ss = fs_storage_system.FSStorageSystem(os.path.join(self.temp_dir, "store"))
+        self.ss.__enter__()
+        self.ss.create_container(jukebox.METADATA_CONTAINER)
+        self.jb = Jukebox(JukeboxOptions(), self.ss, "")
+        self.jb.current_dir = self.temp_dir
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_undecodable_snapshot_keeps_local_db(self):
+        local_db = jukebox_db.JukeboxDB(self.jb.get_metadata_db_file_path())
+        self.assertTrue(local_db.open())
+        self.assertTrue(local_db.upsert_songs([make_song("Cream--Goodbye--Badge.mp3")]))
+        local_db.close()
+        # gzip header followed by garbage, like a truncated download
+        self.assertTrue(self.ss.put_object(jukebox.METADATA_CONTAINER, jukebox.DEFAULT_DB_FILE_NAME,
+                                           b"\x1f\x8b\x08\x00truncated"))
+        with self.jb:
+            self.assertIsNotNone(self.jb.jukebox_db.retrieve_song("Cream--Goodbye--Badge.mp3"))
+        self.assertFalse(os.path.exists(self.jb.get_metadata_db_stat_file_path()))
+        self.assertFalse(os.path.exists(self.jb.get_metadata_db_file_path() + ".decoded"))
+
+    def test_metadata_db_stat(self):
+        db_file_path = self.jb.get_metadata_db_file_path()
+        stat_file_path = self.jb.get_metadata_db_stat_file_path()
+        local_db = jukebox_db.JukeboxDB(db_file_path)
+        self.assertTrue(local_db.open())
+        local_db.close()
+        db_object_stat = {"etag": "etag-1", "last_modified": 1000.0, "size": 4096}
+
+        self.jb.save_metadata_db_stat(db_object_stat)
+        self.assertTrue(self.jb.metadata_db_is_current(db_object_stat))
+
+        # the stored object changed
+        self.assertFalse(self.jb.metadata_db_is_current(dict(db_object_stat, etag="etag-2")))
+
+        # the local file was modified
+        mtime = os.path.getmtime(db_file_path)
+        os.utime(db_file_path, (mtime + 10, mtime + 10))
+        self.assertFalse(self.jb.metadata_db_is_current(db_object_stat))
+
+        # missing or corrupt .stat file
+        self.jb.save_metadata_db_stat(db_object_stat)
+        os.remove(stat_file_path)
+        self.assertFalse(self.jb.metadata_db_is_current(db_object_stat))
+        with open(stat_file_path, "w") as stat_file:
+            stat_file.write("{not json")
+        self.assertFalse(self.jb.metadata_db_is_current(db_object_stat))
+
+        # without a stored object, no .stat file is kept
+        self.jb.save_metadata_db_stat(None)
+        self.assertFalse(os.path.exists(stat_file_path))
@@ -1,6 +1,23 @@
+import os
 import unittest
 
 import jukebox_db
+from file_metadata import FileMetadata
+from song_metadata import SongMetadata
+
+
+def make_song(song_uid: str, md5_hash: str = "d41d8cd98f00b204e9800998ecf8427e") -> SongMetadata:
+    song = SongMetadata()
+    song.fm = FileMetadata()
+    song.fm.file_uid = song_uid
+    song.fm.object_name = song_uid
+    song.fm.container_name = "c-artist-songs"
+    song.fm.md5_hash = md5_hash
+    song.fm.origin_file_size = 1000
+    song.fm.stored_file_size = 1000
+    song.artist_name = "Cream"
+    song.song_name = "Badge"
+    return song
 
 
 class TestJukeboxDB(unittest.TestCase):
@@ -13,7 +30,8 @@ class TestJukeboxDB(unittest.TestCase):
 
     def tearDown(self):
         self.jb_db.close()
-        # TODO: delete file
+        if os.path.exists(self.mdb_file_path):
+            os.remove(self.mdb_file_path)
 
     def test_is_open(self):
         self.assertTrue(self.jb_db.is_open())
@@ -37,6 +55,40 @@ class TestJukeboxDB(unittest.TestCase):
     def test_have_tables(self):
         self.assertTrue(False)
 
+    def test_migrate_schema(self):
+        self.assertEqual(jukebox_db.SCHEMA_VERSION, self.jb_db.get_schema_version())
+        # a catalog from before schema versioning is upgraded when opened
+        self.jb_db.db_connection.execute("DROP INDEX song_prefix_idx")
+        self.jb_db.db_connection.execute("PRAGMA user_version = 0")
+        self.jb_db.close()
+        self.assertTrue(self.jb_db.open())
+        self.assertEqual(jukebox_db.SCHEMA_VERSION, self.jb_db.get_schema_version())
+
+    def test_song_filter_uses_index(self):
+        sql = "EXPLAIN QUERY PLAN SELECT song_uid FROM song" + \
+              jukebox_db.JukeboxDB.sql_where_clause() + \
+              " AND lower(song_uid) >= ? AND lower(song_uid) < ?"
+        args = jukebox_db.prefix_range("zz-top--eliminator")
+        plan = " ".join(row[3] for row in self.jb_db.db_connection.execute(sql, args))
+        self.assertIn("song_prefix_idx", plan)
+        self.assertIn("<expr>>?", plan)
+
+    def test_retrieve_songs_by_prefix_ignores_case(self):
+        # songs that haven't been linked to their artist and album are
+        # matched on the song_uid prefix, in any case, as LIKE matched them
+        song = make_song("Cream--Goodbye--Badge.mp3")
+        other = make_song("Cream--Disraeli-Gears--Tales-of-Brave-Ulysses.flac")
+        self.assertTrue(self.jb_db.upsert_songs([song, other]))
+        self.assertEqual(["Cream--Goodbye--Badge.mp3"],
+                         [s.fm.file_uid for s in self.jb_db.retrieve_songs("cream", "goodbye")])
+        self.assertEqual(2, len(self.jb_db.retrieve_songs("CREAM")))
+        self.assertEqual(["Cream--Disraeli-Gears--Tales-of-Brave-Ulysses.flac"],
+                         [s.fm.file_uid for s in self.jb_db.retrieve_songs("Cream", file_format="FLAC")])
+        self.assertEqual([], self.jb_db.retrieve_songs("Creams"))
+        # LIKE is case-insensitive for every other query on the connection
+        row = self.jb_db.db_connection.execute("SELECT 'ABC' LIKE 'abc'").fetchone()
+        self.assertEqual(1, row[0])
+
     def test_songs_for_query(self):
         self.assertTrue(False)
 
@@ -52,6 +104,217 @@ class TestJukeboxDB(unittest.TestCase):
     def test_store_song_metadata(self):
         self.assertTrue(False)
 
+    def test_upsert_songs(self):
+        songs = [make_song("Cream--Fresh-Cream--Badge.mp3"),
+                 make_song("Cream--Fresh-Cream--Sunshine.mp3")]
+        self.assertTrue(self.jb_db.upsert_songs(songs))
+        self.assertIsNotNone(self.jb_db.retrieve_song("Cream--Fresh-Cream--Sunshine.mp3"))
+
+        updated_song = make_song("Cream--Fresh-Cream--Badge.mp3", "0cc175b9c0f1b6a831c399e269772661")
+        self.assertTrue(self.jb_db.upsert_songs([updated_song]))
+        db_song = self.jb_db.retrieve_song("Cream--Fresh-Cream--Badge.mp3")
+        self.assertEqual("0cc175b9c0f1b6a831c399e269772661", db_song.fm.md5_hash)
+        self.assertEqual(2, len(self.jb_db.retrieve_song_md5_hashes()))
+
+    def test_upsert_songs_is_all_or_nothing(self):
+        bad_song = make_song("Cream--Fresh-Cream--Toad.mp3")
+        bad_song.song_name = None
+        songs = [make_song("Cream--Fresh-Cream--Badge.mp3"), bad_song]
+        self.assertFalse(self.jb_db.upsert_songs(songs))
+        self.assertIsNone(self.jb_db.retrieve_song("Cream--Fresh-Cream--Badge.mp3"))
+
+    def test_change_log_replay(self):
+        self.jb_db.start_change_log()
+        self.assertTrue(self.jb_db.upsert_songs([make_song("Cream--Fresh-Cream--Badge.mp3"),
+                                                 make_song("Cream--Fresh-Cream--Toad.mp3")]))
+        self.assertTrue(self.jb_db.delete_song("Cream--Fresh-Cream--Toad.mp3"))
+        changes = self.jb_db.take_change_log()
+        self.assertEqual(2, len(changes))
+        self.assertEqual([], self.jb_db.take_change_log())
+
+        replica_path = "test_jukebox_db_replica.sqlite3"
+        replica_db = jukebox_db.JukeboxDB(replica_path)
+        try:
+            self.assertTrue(replica_db.open())
+            self.assertTrue(replica_db.apply_delta("delta.1", changes))
+            self.assertIsNotNone(replica_db.retrieve_song("Cream--Fresh-Cream--Badge.mp3"))
+            self.assertIsNone(replica_db.retrieve_song("Cream--Fresh-Cream--Toad.mp3"))
+            self.assertEqual(["delta.1"], replica_db.get_applied_deltas())
+        finally:
+            replica_db.close()
+            os.remove(replica_path)
+
+    def test_delete_songs(self):
+        self.jb_db.start_change_log()
+        self.assertTrue(self.jb_db.upsert_songs([make_song("Cream--Fresh-Cream--Badge.mp3"),
+                                                 make_song("Cream--Fresh-Cream--Toad.mp3"),
+                                                 make_song("Cream--Fresh-Cream--Sunshine.mp3")]))
+        self.assertTrue(self.jb_db.delete_songs(["Cream--Fresh-Cream--Badge.mp3",
+                                                 "Cream--Fresh-Cream--Toad.mp3"]))
+        self.assertEqual(1, len(self.jb_db.retrieve_song_md5_hashes()))
+        # the album still has a song, so only the song deletes are logged
+        self.assertEqual(2, len(self.jb_db.take_change_log()))
+        self.assertFalse(self.jb_db.delete_songs([]))
+
+    def test_delete_songs_removes_empty_albums_and_artists(self):
+        badge = make_song("Cream--Goodbye--Badge.mp3")
+        badge.artist_uid = "Cream"
+        badge.album_uid = "Cream--Goodbye"
+        # not linked to its artist and album yet
+        toad = make_song("Cream--Fresh-Cream--Toad.mp3")
+        self.assertTrue(self.jb_db.store_album("Cream", "Goodbye", ["Cream--Goodbye--Badge"]))
+        self.assertTrue(self.jb_db.store_album("Cream", "Fresh Cream", ["Cream--Fresh-Cream--Toad"]))
+        self.assertTrue(self.jb_db.upsert_songs([badge, toad]))
+
+        # the replica receives the same changes through a metadata delta
+        replica_path = "test_jukebox_db_replica.sqlite3"
+        replica = jukebox_db.JukeboxDB(replica_path)
+        self.assertTrue(replica.open())
+        try:
+            self.assertTrue(replica.upsert_songs([badge, toad]))
+            self.assertTrue(replica.store_album("Cream", "Goodbye", ["Cream--Goodbye--Badge"]))
+            self.assertTrue(replica.store_album("Cream", "Fresh Cream", ["Cream--Fresh-Cream--Toad"]))
+
+            self.jb_db.start_change_log()
+            self.assertTrue(self.jb_db.delete_songs(["Cream--Goodbye--Badge.mp3"]))
+            self.assertEqual(["Fresh Cream"], self.jb_db.albums_for_artist("Cream"))
+            self.assertEqual([], self.jb_db.get_album_tracks("Cream--Goodbye"))
+            self.assertEqual(["Cream"], self.jb_db.get_artists())
+
+            self.assertTrue(self.jb_db.delete_songs(["Cream--Fresh-Cream--Toad.mp3"]))
+            self.assertEqual([], self.jb_db.albums_for_artist("Cream"))
+            self.assertEqual([], self.jb_db.get_album_tracks("Cream--Fresh-Cream"))
+            self.assertEqual([], self.jb_db.get_artists())
+
+            self.assertTrue(replica.apply_delta("delta-1", self.jb_db.take_change_log()))
+            self.assertEqual([], replica.get_artists())
+            self.assertEqual([], replica.get_album_tracks("Cream--Fresh-Cream"))
+        finally:
+            replica.close()
+            os.remove(replica_path)
+
+    def test_retrieve_songs_for_base_names(self):
+        self.assertTrue(self.jb_db.upsert_songs([make_song("Cream--Fresh-Cream--Badge.mp3"),
+                                                 make_song("Cream--Fresh-Cream--Badge.flac"),
+                                                 make_song("Cream--Fresh-Cream--Toad.m4a")]))
+        songs = self.jb_db.retrieve_songs_for_base_names(["Cream--Fresh-Cream--Toad",
+                                                          "Cream--Fresh-Cream--Sunshine",
+                                                          "Cream--Fresh-Cream--Badge",
+                                                          "Cream--Fresh-Cream--Toad"])
+        self.assertEqual(["Cream--Fresh-Cream--Toad.m4a", None, "Cream--Fresh-Cream--Badge.flac",
+                          "Cream--Fresh-Cream--Toad.m4a"],
+                         [song.fm.file_uid if song is not None else None for song in songs])
+        songs = self.jb_db.retrieve_songs_for_base_names(["Cream--Fresh-Cream--Badge"], [".mp3", ".flac"])
+        self.assertEqual("Cream--Fresh-Cream--Badge.mp3", songs[0].fm.file_uid)
+
+    def test_store_album(self):
+        self.jb_db.start_change_log()
+        self.assertTrue(self.jb_db.upsert_songs([make_song("Cream--Fresh-Cream--Badge.mp3"),
+                                                 make_song("Cream--Fresh-Cream--Toad.flac")]))
+        self.assertTrue(self.jb_db.store_album("Cream", "Fresh Cream", ["Cream--Fresh-Cream--Toad",
+                                                                        "Cream--Fresh-Cream--Sunshine",
+                                                                        "Cream--Fresh-Cream--Badge"]))
+        album_uid = self.jb_db.id_for_album("Cream", "Fresh Cream")
+        self.assertEqual("Cream--Fresh-Cream", album_uid)
+        self.assertEqual(["Fresh Cream"], self.jb_db.albums_for_artist(self.jb_db.id_for_artist("Cream")))
+        self.assertEqual(["Cream--Fresh-Cream--Toad.flac", "Cream--Fresh-Cream--Badge.mp3"],
+                         [song.fm.file_uid for song in self.jb_db.songs_for_album(album_uid)])
+
+        # storing the album again replaces its track list
+        self.assertTrue(self.jb_db.store_album("Cream", "Fresh Cream", ["Cream--Fresh-Cream--Badge"]))
+        self.assertEqual(["Cream--Fresh-Cream--Badge"], self.jb_db.get_album_tracks(album_uid))
+        self.assertEqual(["Cream"], self.jb_db.get_artists())
+        self.assertEqual(9, len(self.jb_db.take_change_log()))
+
+    def test_link_songs(self):
+        songs = [make_song("Cream--Fresh-Cream--Badge.mp3"),
+                 make_song("Cream--Wheels-of-Fire--Toad.flac")]
+        self.assertTrue(self.jb_db.upsert_songs(songs))
+        self.assertFalse(self.jb_db.songs_are_linked())
+        self.assertEqual(2, len(self.jb_db.retrieve_unlinked_songs()))
+
+        for song in songs:
+            song.artist_uid = "Cream"
+            song.album_uid = song.fm.file_uid[:song.fm.file_uid.rfind("--")]
+        self.assertTrue(self.jb_db.link_songs(songs))
+        self.assertTrue(self.jb_db.songs_are_linked())
+        self.assertEqual("Cream--Wheels-of-Fire", self.jb_db.id_for_album("Cream", "Wheels of Fire"))
+        self.assertEqual(["Cream--Fresh-Cream--Badge.mp3"],
+                         [song.fm.file_uid for song in self.jb_db.retrieve_songs("Cream", "Fresh Cream")])
+        self.assertEqual(["Cream--Wheels-of-Fire--Toad.flac"],
+                         [song.fm.file_uid for song in self.jb_db.retrieve_songs("Cream", "", "flac")])
+
+    def test_search(self):
+        badge = make_song("Cream--Goodbye--Badge.mp3")
+        sunshine = make_song("Cream--Disraeli-Gears--Sunshine-of-Your-Love.mp3")
+        sunshine.song_name = "Sunshine of Your Love"
+        self.assertTrue(self.jb_db.upsert_songs([badge, sunshine]))
+        self.assertEqual(["Cream--Disraeli-Gears--Sunshine-of-Your-Love.mp3"],
+                         [song.fm.file_uid for song in self.jb_db.search("sunsh love")])
+        self.assertEqual(["Cream--Goodbye--Badge.mp3"],
+                         [song.fm.file_uid for song in self.jb_db.search("goodbye")])
+        self.assertEqual(2, len(self.jb_db.search("cream")))
+        self.assertEqual([], self.jb_db.search('"'))
+
+        # the index follows updates and deletes
+        badge.song_name = "Badge (Live)"
+        self.assertTrue(self.jb_db.upsert_songs([badge]))
+        self.assertEqual(1, len(self.jb_db.search("live")))
+        self.assertTrue(self.jb_db.delete_song("Cream--Goodbye--Badge.mp3"))
+        self.assertEqual([], self.jb_db.search("badge"))
+
+        # and isn't tied to song rowids, which VACUUM can renumber
+        self.jb_db.db_connection.execute("VACUUM")
+        self.assertEqual(["Cream--Disraeli-Gears--Sunshine-of-Your-Love.mp3"],
+                         [song.fm.file_uid for song in self.jb_db.search("sunshine")])
+
+    def test_search_index_delete_cost(self):
+        # deleting songs looks up their search rows by key, so it costs the
+        # same (in SQLite VM steps) however large the catalog is
+        def delete_steps(catalog_size: int) -> int:
+            songs = [make_song("Cream--Goodbye--Song-%d.mp3" % i) for i in range(catalog_size)]
+            self.assertTrue(self.jb_db.upsert_songs(songs))
+            steps = [0]
+
+            def count_step():
+                steps[0] += 1
+                return 0
+
+            self.jb_db.db_connection.set_progress_handler(count_step, 100)
+            self.assertTrue(self.jb_db.delete_songs([song.fm.file_uid for song in songs[:20]]))
+            self.jb_db.db_connection.set_progress_handler(None, 100)
+            self.assertTrue(self.jb_db.delete_songs([song.fm.file_uid for song in songs[20:]]))
+            return steps[0]
+
+        self.assertTrue(self.jb_db.search_index_available)
+        small_catalog_steps = delete_steps(200)
+        large_catalog_steps = delete_steps(4000)
+        self.assertLess(large_catalog_steps, small_catalog_steps * 2)
+
+    def test_search_without_fts5(self):
+        # a catalog opened by a SQLite without FTS5 still opens, takes
+        # writes and searches with LIKE
+        self.jb_db.close()
+        no_fts_db = jukebox_db.JukeboxDB(self.mdb_file_path)
+        no_fts_db.fts5_is_available = lambda: False
+        self.assertTrue(no_fts_db.open())
+        self.assertFalse(no_fts_db.search_index_available)
+        badge = make_song("Cream--Goodbye--Badge.mp3")
+        sunshine = make_song("Cream--Disraeli-Gears--Sunshine-of-Your-Love.mp3")
+        sunshine.song_name = "Sunshine of Your Love"
+        self.assertTrue(no_fts_db.upsert_songs([badge, sunshine]))
+        self.assertEqual(["Cream--Disraeli-Gears--Sunshine-of-Your-Love.mp3"],
+                         [song.fm.file_uid for song in no_fts_db.search("SUNSH gears")])
+        self.assertEqual(2, len(no_fts_db.search("cream")))
+        self.assertEqual([], no_fts_db.search("%"))
+        no_fts_db.close()
+
+        # opening it with FTS5 again rebuilds the index from the songs
+        self.assertTrue(self.jb_db.open())
+        self.assertTrue(self.jb_db.search_index_available)
+        self.assertEqual(["Cream--Goodbye--Badge.mp3"],
+                         [song.fm.file_uid for song in self.jb_db.search("goodbye")])
+
     def test_retrieve_songs(self):
         self.assertTrue(False)
 
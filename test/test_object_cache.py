@@ -0,0 +1,57 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import object_cache
+
+
+class TestObjectCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def add_object(self, cache: object_cache.ObjectCache, object_name: str, contents: str):
+        self.assertTrue(cache.prepare_container("playlists"))
+        download_path = cache.download_path("playlists", object_name)
+        with open(download_path, "w") as f:
+            f.write(contents)
+        self.assertTrue(cache.add("playlists", object_name, download_path, "etag-1", {"db": "v1"}))
+        self.assertFalse(os.path.exists(download_path))
+
+    def test_get_after_reopen(self):
+        cache = object_cache.ObjectCache(self.cache_dir)
+        self.assertTrue(cache.open())
+        self.assertIsNone(cache.get("playlists", "Mix.json"))
+        self.add_object(cache, "Mix.json", '{"songs": []}')
+        self.assertTrue(cache.save())
+
+        cache = object_cache.ObjectCache(self.cache_dir)
+        self.assertTrue(cache.open())
+        contents, entry = cache.get("playlists", "Mix.json")
+        self.assertEqual('{"songs": []}', contents)
+        self.assertEqual("etag-1", entry[object_cache.ENTRY_ETAG])
+        self.assertEqual({"db": "v1"}, entry[object_cache.ENTRY_VERSION])
+
+    def test_set_version_and_remove(self):
+        cache = object_cache.ObjectCache(self.cache_dir)
+        self.assertTrue(cache.open())
+        self.add_object(cache, "Mix.json", '{"songs": []}')
+        cache.set_version("playlists", "Mix.json", "etag-1", {"db": "v2"})
+        self.assertEqual({"db": "v2"}, cache.get("playlists", "Mix.json")[1][object_cache.ENTRY_VERSION])
+        cache.remove("playlists", "Mix.json")
+        self.assertIsNone(cache.get("playlists", "Mix.json"))
+        self.assertFalse(os.path.exists(cache.cached_file_path("playlists", "Mix.json")))
+
+    def test_missing_file_is_dropped_on_open(self):
+        cache = object_cache.ObjectCache(self.cache_dir)
+        self.assertTrue(cache.open())
+        self.add_object(cache, "Mix.json", '{"songs": []}')
+        self.assertTrue(cache.save())
+        os.remove(cache.cached_file_path("playlists", "Mix.json"))
+        cache = object_cache.ObjectCache(self.cache_dir)
+        self.assertTrue(cache.open())
+        self.assertEqual({}, cache.entries)
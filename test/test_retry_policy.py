@@ -0,0 +1,56 @@
+import unittest
+
+import retry_policy
+
+
+class FlakyOperation(object):
+    def __init__(self, failures: int, error: Exception):
+        self.failures = failures
+        self.error = error
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error
+        return "done"
+
+
+def is_transient_error(error: Exception) -> bool:
+    return isinstance(error, IOError)
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+    def setUp(self):
+        self.policy = retry_policy.RetryPolicy(max_attempts=3, base_delay=0, max_delay=0)
+
+    def test_transient_error_is_retried(self):
+        operation = FlakyOperation(2, IOError("connection reset"))
+        self.assertEqual("done", self.policy.call(operation, is_transient_error))
+        self.assertEqual(3, operation.calls)
+        counters = self.policy.get_counters()
+        self.assertEqual(1, counters[retry_policy.COUNTER_CALLS])
+        self.assertEqual(2, counters[retry_policy.COUNTER_RETRIES])
+        self.assertEqual(0, counters[retry_policy.COUNTER_FAILURES])
+
+    def test_gives_up_after_max_attempts(self):
+        operation = FlakyOperation(5, IOError("connection reset"))
+        self.assertRaises(IOError, self.policy.call, operation, is_transient_error)
+        self.assertEqual(3, operation.calls)
+        self.assertEqual(1, self.policy.get_counters()[retry_policy.COUNTER_FAILURES])
+
+    def test_permanent_error_is_not_retried(self):
+        operation = FlakyOperation(1, KeyError("no such key"))
+        self.assertRaises(KeyError, self.policy.call, operation, is_transient_error)
+        self.assertEqual(1, operation.calls)
+
+    def test_non_idempotent_operation_is_not_retried(self):
+        operation = FlakyOperation(1, IOError("connection reset"))
+        self.assertRaises(IOError, self.policy.call, operation, is_transient_error, False)
+        self.assertEqual(1, operation.calls)
+
+    def test_backoff_delay_is_bounded(self):
+        policy = retry_policy.RetryPolicy(base_delay=0.1, max_delay=1.0)
+        for attempt in range(1, 10):
+            self.assertLessEqual(policy.backoff_delay(attempt), min(1.0, 0.1 * 2 ** (attempt - 1)))
@@ -0,0 +1,45 @@
+import os
+import tempfile
+import unittest
+
+import snapshot_codec
+
+
+class TestSnapshotCodec(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.source_path = os.path.join(self.temp_dir, "jukebox_db.sqlite3")
+        self.contents = b"SQLite format 3\x00" + os.urandom(4096) + b"\x00" * 65536
+        with open(self.source_path, "wb") as f:
+            f.write(self.contents)
+
+    def tearDown(self):
+        for file_name in os.listdir(self.temp_dir):
+            os.remove(os.path.join(self.temp_dir, file_name))
+        os.rmdir(self.temp_dir)
+
+    def round_trip(self, codec: str):
+        compressed_path = self.source_path + "." + codec
+        decoded_path = self.source_path + ".decoded"
+        self.assertTrue(snapshot_codec.compress_file(self.source_path, compressed_path, codec))
+        self.assertEqual(codec, snapshot_codec.detect_codec(compressed_path))
+        self.assertLess(os.path.getsize(compressed_path), len(self.contents))
+        self.assertTrue(snapshot_codec.decompress_file(compressed_path, decoded_path))
+        with open(decoded_path, "rb") as f:
+            self.assertEqual(self.contents, f.read())
+
+    def test_gzip_round_trip(self):
+        self.round_trip(snapshot_codec.CODEC_GZIP)
+
+    def test_zstd_round_trip(self):
+        if not snapshot_codec.zstd_is_available():
+            self.skipTest("zstandard is not installed")
+        self.round_trip(snapshot_codec.CODEC_ZSTD)
+
+    def test_uncompressed_is_copied(self):
+        decoded_path = self.source_path + ".decoded"
+        self.assertEqual(snapshot_codec.CODEC_NONE, snapshot_codec.detect_codec(self.source_path))
+        self.assertTrue(snapshot_codec.decompress_file(self.source_path, decoded_path))
+        with open(decoded_path, "rb") as f:
+            self.assertEqual(self.contents, f.read())
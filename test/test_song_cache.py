@@ -0,0 +1,106 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import song_cache
+from file_metadata import FileMetadata
+from song_metadata import SongMetadata
+
+
+class TestSongCache(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.temp_dir, "song-cache")
+        self.play_dir = os.path.join(self.temp_dir, "song-play")
+        os.mkdir(self.play_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def make_song(self, file_uid: str, file_size: int) -> SongMetadata:
+        contents = os.urandom(file_size)
+        file_path = os.path.join(self.play_dir, file_uid)
+        with open(file_path, "wb") as f:
+            f.write(contents)
+        song = SongMetadata()
+        song.fm = FileMetadata()
+        song.fm.file_uid = file_uid
+        song.fm.md5_hash = hashlib.md5(contents).hexdigest()
+        song.fm.stored_file_size = file_size
+        return song
+
+    def add_song(self, cache: song_cache.SongCache, file_uid: str, file_size: int) -> SongMetadata:
+        song = self.make_song(file_uid, file_size)
+        self.assertTrue(cache.add(song, os.path.join(self.play_dir, file_uid)))
+        return song
+
+    def test_retrieve_after_reopen(self):
+        cache = song_cache.SongCache(self.cache_dir, 10000)
+        self.assertTrue(cache.open())
+        song = self.add_song(cache, "a.mp3", 1000)
+        os.remove(os.path.join(self.play_dir, "a.mp3"))
+
+        cache = song_cache.SongCache(self.cache_dir, 10000)
+        self.assertTrue(cache.open())
+        file_path = os.path.join(self.play_dir, "a.mp3")
+        self.assertEqual(1000, cache.retrieve_file(song, file_path))
+        self.assertTrue(os.path.exists(file_path))
+
+    def test_lru_eviction(self):
+        cache = song_cache.SongCache(self.cache_dir, 2500)
+        self.assertTrue(cache.open())
+        song_a = self.add_song(cache, "a.mp3", 1000)
+        song_b = self.add_song(cache, "b.mp3", 1000)
+        self.assertIsNotNone(cache.lookup(song_a))
+        self.add_song(cache, "c.mp3", 1000)
+        self.assertIsNotNone(cache.lookup(song_a))
+        self.assertIsNone(cache.lookup(song_b))
+        self.assertEqual(2000, cache.total_bytes)
+
+    def test_lfu_eviction(self):
+        cache = song_cache.SongCache(self.cache_dir, 2500, song_cache.POLICY_LFU)
+        self.assertTrue(cache.open())
+        song_a = self.add_song(cache, "a.mp3", 1000)
+        song_b = self.add_song(cache, "b.mp3", 1000)
+        cache.lookup(song_a)
+        cache.lookup(song_a)
+        cache.lookup(song_b)
+        self.add_song(cache, "c.mp3", 1000)
+        self.assertIsNotNone(cache.lookup(song_a))
+        self.assertIsNone(cache.lookup(song_b))
+
+    def test_stale_entry_is_not_used(self):
+        cache = song_cache.SongCache(self.cache_dir, 10000)
+        self.assertTrue(cache.open())
+        song = self.add_song(cache, "a.mp3", 1000)
+        song.fm.md5_hash = "0" * 32
+        self.assertEqual(0, cache.retrieve_file(song, os.path.join(self.temp_dir, "a.mp3")))
+        self.assertEqual(0, cache.total_bytes)
+        self.assertFalse(os.path.exists(cache.cached_file_path("a.mp3")))
+
+    def test_corrupt_download_is_not_cached(self):
+        cache = song_cache.SongCache(self.cache_dir, 10000)
+        self.assertTrue(cache.open())
+        song = self.make_song("a.mp3", 1000)
+        song.fm.md5_hash = "0" * 32
+        self.assertFalse(cache.add(song, os.path.join(self.play_dir, "a.mp3")))
+        self.assertEqual(0, cache.total_bytes)
+
+    def test_concurrent_saves(self):
+        cache = song_cache.SongCache(self.cache_dir, 100000)
+        self.assertTrue(cache.open())
+        for i in range(20):
+            self.add_song(cache, "%d.mp3" % i, 100)
+        threads = [threading.Thread(target=cache.save) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        cache = song_cache.SongCache(self.cache_dir, 100000)
+        self.assertTrue(cache.open())
+        self.assertEqual(20, len(cache.entries))
+        self.assertFalse(os.path.exists(cache.index_file_path + ".tmp"))
@@ -0,0 +1,87 @@
+import threading
+import unittest
+
+import song_downloader
+from file_metadata import FileMetadata
+from song_metadata import SongMetadata
+
+
+class FakeJukebox(object):
+    def __init__(self):
+        self.exit_requested = False
+        self.release_downloads = threading.Event()
+        self.downloaded = []
+        self.batches_completed = 0
+        self.lock = threading.Lock()
+
+    def batch_download_start(self):
+        pass
+
+    def batch_download_complete(self):
+        self.batches_completed += 1
+
+    def download_song(self, song) -> bool:
+        self.release_downloads.wait(5)
+        with self.lock:
+            self.downloaded.append(song.fm.file_uid)
+        return True
+
+
+def make_song(file_uid: str) -> SongMetadata:
+    song = SongMetadata()
+    song.fm = FileMetadata()
+    song.fm.file_uid = file_uid
+    return song
+
+
+class TestSongDownloader(unittest.TestCase):
+
+    def setUp(self):
+        self.jukebox = FakeJukebox()
+        self.downloader = song_downloader.SongDownloader(self.jukebox, 3)
+        self.downloader.start()
+
+    def tearDown(self):
+        self.jukebox.release_downloads.set()
+        self.downloader.stop()
+
+    def test_pending_song_is_not_queued_again(self):
+        song = make_song("a.mp3")
+        self.assertTrue(self.downloader.enqueue(song))
+        self.assertFalse(self.downloader.enqueue(make_song("a.mp3")))
+        self.assertTrue(self.downloader.is_pending(song))
+        self.jukebox.release_downloads.set()
+        self.assertTrue(self.downloader.wait_for_song(song, 5))
+        self.assertFalse(self.downloader.is_pending(song))
+        self.assertEqual(["a.mp3"], self.jukebox.downloaded)
+
+    def test_songs_download_concurrently(self):
+        songs = [make_song("%d.mp3" % i) for i in range(3)]
+        for song in songs:
+            self.downloader.enqueue(song)
+        self.assertEqual(3, self.downloader.pending_count())
+        self.assertFalse(self.downloader.wait_for_song(songs[0], 0.05))
+        self.jukebox.release_downloads.set()
+        for song in songs:
+            self.assertTrue(self.downloader.wait_for_song(song, 5))
+        self.assertEqual(0, self.downloader.pending_count())
+        self.assertEqual(sorted(s.fm.file_uid for s in songs), sorted(self.jukebox.downloaded))
+        self.assertEqual(1, self.jukebox.batches_completed)
+
+    def test_waiting_for_song_requests_hedge(self):
+        song = make_song("a.mp3")
+        self.assertTrue(self.downloader.enqueue(song))
+        hedge_event = self.downloader.hedge_event(song)
+        self.assertFalse(hedge_event.is_set())
+        self.assertFalse(self.downloader.wait_for_song(song, 0.05))
+        self.assertTrue(hedge_event.is_set())
+        self.jukebox.release_downloads.set()
+        self.assertTrue(self.downloader.wait_for_song(song, 5))
+        self.assertIsNone(self.downloader.hedge_event(song))
+        self.assertFalse(self.downloader.request_hedge(song))
+
+    def test_request_hedge(self):
+        song = make_song("a.mp3")
+        self.assertTrue(self.downloader.enqueue(song))
+        self.assertTrue(self.downloader.request_hedge(song))
+        self.assertTrue(self.downloader.hedge_event(song).is_set())
@@ -0,0 +1,30 @@
+import unittest
+
+import utils
+
+
+class TestElapsedTimeOfIntervals(unittest.TestCase):
+
+    def test_no_intervals(self):
+        self.assertEqual(0.0, utils.elapsed_time_of_intervals([]))
+
+    def test_disjoint_intervals(self):
+        self.assertAlmostEqual(3.0, utils.elapsed_time_of_intervals([(5.0, 7.0), (1.0, 2.0)]))
+
+    def test_overlapping_intervals(self):
+        # e.g., downloads running in parallel
+        self.assertAlmostEqual(5.0, utils.elapsed_time_of_intervals([(0.0, 3.0), (2.0, 5.0)]))
+        self.assertAlmostEqual(6.0, utils.elapsed_time_of_intervals([(4.0, 6.0), (0.0, 3.0), (2.0, 5.0)]))
+
+    def test_nested_intervals(self):
+        self.assertAlmostEqual(10.0, utils.elapsed_time_of_intervals([(0.0, 10.0), (2.0, 3.0), (4.0, 9.0)]))
+        # an interval nested in the first one doesn't end the span early
+        self.assertAlmostEqual(11.0, utils.elapsed_time_of_intervals([(0.0, 10.0), (2.0, 3.0), (9.0, 11.0)]))
+
+    def test_touching_intervals(self):
+        self.assertAlmostEqual(4.0, utils.elapsed_time_of_intervals([(0.0, 1.5), (1.5, 4.0)]))
+        self.assertAlmostEqual(2.0, utils.elapsed_time_of_intervals([(1.0, 2.0), (0.0, 1.0)]))
+
+    def test_empty_interval(self):
+        self.assertAlmostEqual(1.0, utils.elapsed_time_of_intervals([(1.0, 1.0), (3.0, 4.0)]))
+
@@ -2,13 +2,44 @@ import hashlib
 import os
 import os.path
 import pathlib
+import shutil
 import typing
 from typing import List, Tuple
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+FILE_CHUNK_SIZE = 1024 * 1024
+# linux ioctl that shares the data blocks of one file with another (btrfs, xfs)
+FICLONE = 0x40049409
+
 
 def md5_for_file(path_to_file: str) -> str:
+    md5 = hashlib.md5()
     with open(path_to_file, 'rb') as f:
-        return hashlib.md5(f.read()).hexdigest()
+        for chunk in iter(lambda: f.read(FILE_CHUNK_SIZE), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def elapsed_time_of_intervals(intervals: List[Tuple[float, float]]) -> float:
+    # total time covered by the (start, end) intervals, counting overlaps once
+    elapsed_time = 0.0
+    span_start = None
+    span_end = None
+    for start, end in sorted(intervals):
+        if span_end is None or start > span_end:
+            if span_end is not None:
+                elapsed_time += span_end - span_start
+            span_start = start
+            span_end = end
+        elif end > span_end:
+            span_end = end
+    if span_end is not None:
+        elapsed_time += span_end - span_start
+    return elapsed_time
 
 
 def get_file_size(path_to_file: str) -> int:
@@ -45,6 +76,67 @@ def rename_file(old_path_to_file: str, new_path_to_file: str) -> bool:
         return False
 
 
+def replace_file(source_path: str, dest_path: str) -> bool:
+    # atomically puts source_path in place of dest_path (if it exists)
+    try:
+        os.replace(source_path, dest_path)
+        return True
+    except OSError:
+        return False
+
+
+def link_or_copy_file(source_path: str, dest_path: str) -> bool:
+    # hard links the file when both paths are on the same filesystem,
+    # otherwise makes a copy. only for files that won't be modified, since
+    # a hard link shares its contents with the source
+    try:
+        if os.path.exists(dest_path):
+            os.remove(dest_path)
+        os.link(source_path, dest_path)
+        return True
+    except OSError:
+        pass
+    return copy_file(source_path, dest_path)
+
+
+def copy_file(source_path: str, dest_path: str) -> bool:
+    # copies the file without passing its contents through python where
+    # possible: as a reflink (copy on write clone) on filesystems that
+    # support one, otherwise with copy_file_range in the kernel, falling
+    # back to a chunked copy
+    try:
+        with open(source_path, "rb") as source_file:
+            with open(dest_path, "wb") as dest_file:
+                if fcntl is not None:
+                    try:
+                        fcntl.ioctl(dest_file.fileno(), FICLONE, source_file.fileno())
+                        return True
+                    except OSError:
+                        pass
+                if hasattr(os, "copy_file_range"):
+                    try:
+                        bytes_remaining = os.fstat(source_file.fileno()).st_size
+                        while bytes_remaining > 0:
+                            bytes_copied = os.copy_file_range(source_file.fileno(),
+                                                              dest_file.fileno(),
+                                                              bytes_remaining)
+                            if bytes_copied == 0:
+                                break
+                            bytes_remaining -= bytes_copied
+                        if bytes_remaining == 0:
+                            return True
+                    except OSError:
+                        pass
+                    # start over with a plain copy
+                    source_file.seek(0)
+                    dest_file.seek(0)
+                    dest_file.truncate()
+                shutil.copyfileobj(source_file, dest_file, FILE_CHUNK_SIZE)
+        return True
+    except (IOError, OSError):
+        return False
+
+
 def delete_file(path_to_file: str) -> bool:
     if file_exists(path_to_file):
         os.remove(path_to_file)
@@ -126,6 +218,53 @@ def file_write_all_bytes(file_path: str, file_contents: list[bytes]) -> bool:
         return False
 
 
+def file_write_from_stream(file_path: str, stream, chunk_size: int = FILE_CHUNK_SIZE) -> int:
+    # copies the stream to the file in bounded chunks. returns number of
+    # bytes written, or -1 on error
+    bytes_written = 0
+    try:
+        with open(file_path, "wb") as f:
+            for chunk in iter(lambda: stream.read(chunk_size), b''):
+                f.write(chunk)
+                bytes_written += len(chunk)
+        return bytes_written
+    except IOError:
+        return -1
+
+
+def file_iter_chunks(file_path: str, chunk_size: int = FILE_CHUNK_SIZE,
+                     offset: int = 0, length: typing.Optional[int] = None):
+    # generator over the contents of the file (or of length bytes starting
+    # at offset) in chunks of at most chunk_size bytes. errors reading the
+    # file are raised to the caller
+    with open(file_path, "rb") as f:
+        if offset > 0:
+            f.seek(offset)
+        bytes_remaining = length
+        while bytes_remaining is None or bytes_remaining > 0:
+            read_size = chunk_size if bytes_remaining is None else min(chunk_size, bytes_remaining)
+            chunk = f.read(read_size)
+            if not chunk:
+                break
+            if bytes_remaining is not None:
+                bytes_remaining -= len(chunk)
+            yield chunk
+
+
+def file_write_from_chunks(file_path: str, chunks) -> int:
+    # writes each chunk from the iterable to the file. returns number of
+    # bytes written, or -1 if reading a chunk or writing the file fails
+    bytes_written = 0
+    try:
+        with open(file_path, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+                bytes_written += len(chunk)
+        return bytes_written
+    except IOError:
+        return -1
+
+
 def file_write_all_text(file_path: str, file_contents: str) -> bool:
     try:
         with open(file_path, "w") as f: